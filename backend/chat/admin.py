@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ChatRoom, Message, Reaction
+from .models import ChatRoom, Message, Reaction, RoomReadState
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
@@ -9,11 +9,16 @@ class ChatRoomAdmin(admin.ModelAdmin):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ['sender', 'room', 'content', 'timestamp', 'is_read']
-    list_filter = ['room', 'is_read']
+    list_display = ['sender', 'room', 'content', 'timestamp']
+    list_filter = ['room']
     search_fields = ['content']
 
 @admin.register(Reaction)
 class ReactionAdmin(admin.ModelAdmin):
     list_display = ['user', 'message', 'emoji', 'created_at']
     list_filter = ['emoji']
+
+@admin.register(RoomReadState)
+class RoomReadStateAdmin(admin.ModelAdmin):
+    list_display = ['user', 'room', 'last_read_message_id', 'updated_at']
+    list_filter = ['room']
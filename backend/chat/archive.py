@@ -0,0 +1,257 @@
+"""
+Cold storage for old message history.
+
+``archive_messages`` moves every message older than a cutoff out of
+``chat_message`` into one ``MessageArchive`` row per room and (local) day.
+The row's ``data`` is zlib-compressed JSON::
+
+    [[id, sender_id, timestamp, content, [[user_id, emoji], ...]], ...]
+
+ordered by (timestamp, id), with each message's reactions in the order they
+were made. Ids and timestamps are kept, so pagination cursors stay valid
+across the boundary. ``fall_through`` extends a page of hot history with
+archived messages once a client pages past the oldest row still in
+``chat_message``.
+
+Archived messages are read-only: they can't be reacted to, they are no
+longer in the full-text index, and messages from since-deleted users are
+left out when a block is read. Each block is written before the messages
+it holds are deleted, and deletes run in batches of their own transactions
+so no lock is held for long. A run that is interrupted between the two is
+finished by the next run, which merges into the existing block.
+"""
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .encoding import dumps
+from .models import ChatRoom, Message, MessageArchive, Reaction
+from .pagination import decode_cursor, encode_cursor
+from .serializers import fetch_reactions, summarize_reactions
+
+DELETE_BATCH_SIZE = 500
+BLOCKS_PER_QUERY = 4
+
+
+def pack_rows(rows):
+    return zlib.compress(dumps([
+        [message_id, sender_id, timestamp.isoformat(), content, reactions]
+        for message_id, sender_id, timestamp, content, reactions in rows
+    ]).encode())
+
+
+def unpack_rows(data):
+    rows = json.loads(zlib.decompress(bytes(data)))
+    for row in rows:
+        row[2] = datetime.fromisoformat(row[2])
+    return rows
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+# Writing
+
+def archive_day(room_id, day, batch_size=DELETE_BATCH_SIZE):
+    """
+    Move ``room_id``'s messages from ``day`` into its block; returns the
+    number of messages moved.
+    """
+    start, end = day_bounds(day)
+    messages = list(
+        Message.objects.filter(room_id=room_id, timestamp__gte=start, timestamp__lt=end)
+        .order_by('timestamp', 'id').values_list('id', 'sender_id', 'timestamp', 'content')
+    )
+    if not messages:
+        return 0
+    ids = [m[0] for m in messages]
+    reactions = {}
+    for message_id, user_id, emoji in (
+        Reaction.objects.filter(message_id__in=ids).order_by('id').values_list('message_id', 'user_id', 'emoji')
+    ):
+        reactions.setdefault(message_id, []).append([user_id, emoji])
+    rows = [
+        [message_id, sender_id, timestamp, content, reactions.get(message_id, [])]
+        for message_id, sender_id, timestamp, content in messages
+    ]
+
+    with transaction.atomic():
+        block = MessageArchive.objects.select_for_update().filter(room_id=room_id, day=day).first()
+        if block is None:
+            block = MessageArchive(room_id=room_id, day=day)
+        else:
+            # Finish an interrupted run: rows already in the block win
+            merged = {row[0]: row for row in rows}
+            merged.update((row[0], row) for row in unpack_rows(block.data))
+            rows = sorted(merged.values(), key=lambda row: (row[2], row[0]))
+        block.data = pack_rows(rows)
+        block.message_count = len(rows)
+        block.first_timestamp = rows[0][2]
+        block.last_timestamp = rows[-1][2]
+        block.save()
+        ChatRoom.objects.filter(pk=room_id).filter(
+            Q(archived_until__isnull=True) | Q(archived_until__lt=block.last_timestamp)
+        ).update(archived_until=block.last_timestamp)
+
+    for i in range(0, len(ids), batch_size):
+        chunk = ids[i:i + batch_size]
+        with transaction.atomic():
+            Reaction.objects.filter(message_id__in=chunk).delete()
+            Message.objects.filter(id__in=chunk).delete()
+    return len(ids)
+
+
+def archive_before(cutoff, room_ids=None, batch_size=DELETE_BATCH_SIZE, progress=None):
+    """
+    Archive every whole day before ``cutoff`` (rounded down to midnight),
+    oldest first. Returns the number of messages moved.
+    """
+    cutoff = day_bounds(timezone.localtime(cutoff).date())[0]
+    rooms = Message.objects.filter(timestamp__lt=cutoff)
+    if room_ids is not None:
+        rooms = rooms.filter(room_id__in=room_ids)
+    moved = 0
+    for room_id in rooms.values_list('room_id', flat=True).distinct().order_by('room_id'):
+        while True:
+            oldest = (
+                Message.objects.filter(room_id=room_id, timestamp__lt=cutoff)
+                .order_by('timestamp').values_list('timestamp', flat=True).first()
+            )
+            if oldest is None:
+                break
+            day = timezone.localtime(oldest).date()
+            count = archive_day(room_id, day, batch_size)
+            moved += count
+            if progress:
+                progress(room_id, day, count)
+    return moved
+
+
+# Reading
+
+def _blocks(queryset):
+    """Yield blocks a few at a time, so a page only loads the days it needs"""
+    offset = 0
+    while True:
+        chunk = list(queryset[offset:offset + BLOCKS_PER_QUERY])
+        yield from chunk
+        if len(chunk) < BLOCKS_PER_QUERY:
+            return
+        offset += BLOCKS_PER_QUERY
+
+
+def older_than(room_id, position, count):
+    """Up to ``count`` archived rows before ``(timestamp, id)``, newest first"""
+    blocks = MessageArchive.objects.filter(room_id=room_id)
+    if position is not None:
+        blocks = blocks.filter(first_timestamp__lte=position[0])
+    rows = []
+    for block in _blocks(blocks.order_by('-day')):
+        for row in reversed(unpack_rows(block.data)):
+            if position is None or (row[2], row[0]) < position:
+                rows.append(row)
+                if len(rows) == count:
+                    return rows
+    return rows
+
+
+def newer_than(room_id, position, count):
+    """Up to ``count`` archived rows after ``(timestamp, id)``, oldest first"""
+    blocks = MessageArchive.objects.filter(room_id=room_id, last_timestamp__gte=position[0])
+    rows = []
+    for block in _blocks(blocks.order_by('day')):
+        for row in unpack_rows(block.data):
+            if (row[2], row[0]) > position:
+                rows.append(row)
+                if len(rows) == count:
+                    return rows
+    return rows
+
+
+def to_messages(room_id, rows, user_id=None):
+    """
+    Unsaved ``Message`` instances for archived rows, with their senders
+    attached, and their reactions summarized as by ``fetch_reactions``.
+    """
+    from users.models import User
+
+    user_ids = {row[1] for row in rows} | {u for row in rows for u, _ in row[4]}
+    users = User.objects.in_bulk(user_ids) if user_ids else {}
+    messages = []
+    reaction_rows = []
+    for message_id, sender_id, timestamp, content, reactions in rows:
+        sender = users.get(sender_id)
+        if sender is None:
+            continue
+        messages.append(Message(id=message_id, room_id=room_id, sender=sender, content=content, timestamp=timestamp))
+        reaction_rows.extend(
+            {'message_id': message_id, 'emoji': emoji, 'user_id': u, 'username': users[u].username}
+            for u, emoji in reactions if u in users
+        )
+    return messages, summarize_reactions(reaction_rows, user_id)
+
+
+def fall_through(room, page, before=None, after=None, limit=50, user_id=None):
+    """
+    Extend a page from ``paginate_messages`` with archived history where the
+    hot range runs out. The page gains ``reactions`` for all of its messages
+    when anything was added from the archive.
+    """
+    if room.archived_until is None:
+        return page
+    results = page['results']
+
+    if after:
+        position = decode_cursor(after)
+        if position[0] > room.archived_until:
+            return page
+        hot_ids = {m.id for m in results}
+        rows = [row for row in newer_than(room.id, position, limit + 1) if row[0] not in hot_ids]
+        if not rows:
+            return page
+        archived, reactions = to_messages(room.id, rows, user_id)
+        merged = sorted(archived + results, key=lambda m: (m.timestamp, m.id))
+        has_more = len(merged) > limit or page['after'] is not None
+        merged = merged[:limit]
+        return {
+            'results': merged,
+            'before': encode_cursor(merged[0]) if merged else after,
+            'after': encode_cursor(merged[-1]) if has_more else None,
+            'reactions': _page_reactions(merged, archived, reactions, user_id),
+        }
+
+    if page['before'] is not None:
+        return page  # still inside the hot range
+    if results:
+        position = (results[0].timestamp, results[0].id)
+    elif before:
+        position = decode_cursor(before)
+    else:
+        position = None
+    needed = limit - len(results)
+    rows = older_than(room.id, position, needed + 1)
+    if not rows:
+        return page
+    has_more = len(rows) > needed
+    archived, reactions = to_messages(room.id, rows[:needed][::-1], user_id)
+    merged = archived + results
+    return {
+        'results': merged,
+        'before': encode_cursor(merged[0]) if has_more and merged else None,
+        'after': encode_cursor(merged[-1]) if merged and before else None,
+        'reactions': _page_reactions(merged, archived, reactions, user_id),
+    }
+
+
+def _page_reactions(messages, archived, archived_reactions, user_id):
+    archived_ids = {m.id for m in archived}
+    hot_ids = [m.id for m in messages if m.id not in archived_ids]
+    reactions = fetch_reactions(hot_ids, user_id) if hot_ids else {}
+    reactions.update(archived_reactions)
+    return reactions
@@ -0,0 +1,80 @@
+"""
+Bounded outbound queues for WebSocket connections.
+
+Every socket gets at most ``CHAT_OUTBOUND_QUEUE_LIMIT`` events waiting to
+be written. When a slow client lets its queue fill up, the policy is, in
+order:
+
+1. drop ephemeral events (typing indicators), queued or new;
+2. squash ``reaction.changed`` events for the same message, keeping only
+   the newest, since each one carries the message's full reaction list;
+3. give up on the socket: the consumer closes it with
+   ``SLOW_CONSUMER_CLOSE_CODE`` and reason ``resync``, and the client is
+   expected to reconnect and reload history.
+
+Each step is counted in chat.metrics.
+"""
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+
+SLOW_CONSUMER_CLOSE_CODE = 4429
+RESYNC_REASON = 'resync'
+
+
+def queue_limit():
+    return getattr(settings, 'CHAT_OUTBOUND_QUEUE_LIMIT', 256)
+
+
+class OutboundQueue:
+    """Encoded ``chat.event`` messages waiting to be written to one socket"""
+
+    def __init__(self, limit=None):
+        self.limit = limit or queue_limit()
+        self._items = deque()
+
+    def __len__(self):
+        return len(self._items)
+
+    def popleft(self):
+        return self._items.popleft()
+
+    def take_all(self):
+        items, self._items = list(self._items), deque()
+        return items
+
+    def push(self, message):
+        """Queue ``message``; returns False if the socket has to be dropped"""
+        if len(self._items) < self.limit:
+            self._items.append(message)
+            return True
+
+        if message.get('ephemeral'):
+            metrics.increment('ws_ephemeral_dropped')
+            return True
+        items = [m for m in self._items if not m.get('ephemeral')]
+        if len(items) < len(self._items):
+            metrics.increment('ws_ephemeral_dropped', len(self._items) - len(items))
+        items.append(message)
+
+        if len(items) > self.limit:
+            items = self._squash(items)
+        self._items = deque(items)
+        return len(items) <= self.limit
+
+    def _squash(self, items):
+        seen = set()
+        kept = []
+        for message in reversed(items):
+            key = message.get('squash')
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(message)
+        if len(kept) < len(items):
+            metrics.increment('ws_events_squashed', len(items) - len(kept))
+        kept.reverse()
+        return kept
@@ -1,99 +1,211 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from .middleware import JWT_SUBPROTOCOL
 from .models import ChatRoom, Message
-from django.contrib.auth import get_user_model
+from .serializers import serialize_messages
+from yap_project import timing
+from . import backpressure, encoding, ephemeral, events, metrics, presence, writebehind
 
-User = get_user_model()
+RECEIVED_TYPES = {'chat_message', 'heartbeat', *ephemeral.KINDS}
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    _outbox = None
+    _writer = None
+
+    async def dispatch(self, message):
+        if not timing.enabled():
+            return await super().dispatch(message)
+        # Same breakdown as TimingMiddleware, per handled message
+        with timing.track(f"ws {message['type']} room={self.scope['url_route']['kwargs'].get('room_id')}"):
+            return await super().dispatch(message)
+
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'chat_{self.room_id}'
+        self.room_group_name = events.room_group_name(self.room_id)
 
-        # Join room group
+        # Resolve identity and room once for the life of the connection
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.room = await self.get_room()
+        if self.room is None:
+            # Unknown room or not a member: never join the group
+            await self.close(code=4403)
+            return
+
+        # Join room group, and the user's own group for inbox-wide events
+        self.user_group_name = events.user_group_name(self.user.id)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
+        # and the inbox of every room the user is in, for unread bumps
+        self.inbox_group_names = {events.inbox_group_name(room_id) for room_id in await self.get_room_ids()}
+        for group in self.inbox_group_names:
+            await self.channel_layer.group_add(group, self.channel_name)
+
+        # Binary frames are opt-in; JSON text stays the default
+        subprotocols = self.scope.get('subprotocols', [])
+        self.binary = encoding.BINARY_SUBPROTOCOL in subprotocols and encoding.binary_available()
+        self._outbox = backpressure.OutboundQueue()
+        self._has_outbound = asyncio.Event()
+        self._writer = asyncio.ensure_future(self._write_outbox())
+        if self.binary:
+            await self.accept(subprotocol=encoding.BINARY_SUBPROTOCOL)
+        elif JWT_SUBPROTOCOL in subprotocols:
+            await self.accept(subprotocol=JWT_SUBPROTOCOL)
+        else:
+            await self.accept()
+        metrics.increment('ws_connections_opened')
 
-        await self.accept()
+        if presence.registry.connect(self.channel_name, self.user.id, self.room.id):
+            presence.get_notifier(self.channel_layer).changed(self.room.id, self.user.id, online=True)
+        await self.send_encoded(events.encode(
+            events.presence_state(self.room.id, presence.registry.online_in_room(self.room.id))
+        ))
 
     async def disconnect(self, close_code):
+        if self._writer is not None:
+            metrics.increment('ws_connections_closed')
+        self._outbox = None
+        if self._writer is not None:
+            self._writer.cancel()
+        gone = presence.registry.disconnect(self.channel_name)
+        if gone is not None and gone[2]:
+            presence.get_notifier(self.channel_layer).changed(self.room.id, self.user.id, online=False)
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        if hasattr(self, 'user_group_name'):
+            await self.channel_layer.group_discard(
+                self.user_group_name,
+                self.channel_name
+            )
+        for group in getattr(self, 'inbox_group_names', ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
 
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message_type = text_data_json.get('type', 'chat_message')
-        
-        if message_type == 'reaction_update':
-            # Broadcast reaction update to all users in the room
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'reaction_update',
-                    'message_id': text_data_json.get('message_id'),
-                    'emoji': text_data_json.get('emoji'),
-                    'user_id': text_data_json.get('user_id'),
-                    'action': text_data_json.get('action')
-                }
-            )
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            if not self.binary:
+                return
+            payload = encoding.unpack(bytes_data)
         else:
-            # Handle chat message
-            message = text_data_json['message']
-            user_id = text_data_json.get('user_id')
-
-            # Save message to database
-            await self.save_message(user_id, message)
-
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'user_id': user_id
-                }
-            )
+            payload = json.loads(text_data)
+        message_type = payload.get('type', 'chat_message')
+        # Only known types become label values, so clients can't add series
+        metrics.increment('ws_events_received', type=message_type if message_type in RECEIVED_TYPES else 'other')
+
+        # Any frame proves the socket is alive; heartbeats carry nothing else
+        presence.registry.touch(self.channel_name)
+        if message_type == 'heartbeat':
+            return
+
+        # Typing and similar signals are relayed, rate limited, never stored
+        if message_type in ephemeral.KINDS:
+            if ephemeral.coalescer.allow((message_type, self.user.id, self.room.id)):
+                event = events.ephemeral(ephemeral.KINDS[message_type], self.room.id, self.user)
+                await events.broadcast(event, self.channel_layer, ephemeral=True)
+            return
 
-    # Receive message from room group
-    async def chat_message(self, event):
-        message = event['message']
-        user_id = event['user_id']
-
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'user_id': user_id
-        }))
-    
-    # Handle reaction updates
-    async def reaction_update(self, event):
-        # Send reaction update to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'reaction_update',
-            'message_id': event['message_id'],
-            'emoji': event.get('emoji'),
-            'user_id': event.get('user_id'),
-            'action': event.get('action')
-        }))
-
-    # Handle read receipt updates
-    async def messages_read(self, event):
-        # Send read receipt to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'messages_read',
-            'user_id': event['user_id'],
-            'username': event['username']
-        }))
+        # Reactions and read state are changed through the REST API, which
+        # broadcasts the resulting events itself; clients only send messages.
+        if message_type != 'chat_message':
+            return
+
+        message = payload['message']
+
+        # Save message to database
+        buffered = writebehind.is_enabled()
+        if buffered:
+            # The buffer bumps unread counts once per room and flushed batch
+            message_data = await writebehind.get_write_buffer().submit(self.user, self.room.id, message)
+        else:
+            message_data = await self.save_message(message)
+
+        # Send the persisted row to room group
+        await events.broadcast(events.message_created(message_data), self.channel_layer)
+        if not buffered:
+            await events.notify_new_messages(self.room.id, {self.user.id: 1}, self.channel_layer)
+
+    # Receive event from room group, already encoded by events.encode
+    async def chat_event(self, event):
+        if self.user.id in event.get('revoke', ()):
+            # Membership was checked once, on connect; this user has just
+            # been removed from the room
+            self._outbox = None
+            await self.close(code=4403)
+            return
+        await self.send_encoded(event)
+
+    async def send_encoded(self, message):
+        # Sockets are written by a separate task, so a slow client backs up
+        # into this connection's bounded queue instead of the channel layer
+        if self._outbox is None:
+            return  # disconnected
+        if not self._outbox.push(message):
+            metrics.increment('ws_slow_consumer_disconnects')
+            self._outbox = None
+            await self.close(code=backpressure.SLOW_CONSUMER_CLOSE_CODE, reason=backpressure.RESYNC_REASON)
+            return
+        self._has_outbound.set()
+
+    async def _write_outbox(self):
+        while True:
+            await self._has_outbound.wait()
+            self._has_outbound.clear()
+            while self._outbox:
+                if self.binary:
+                    # Everything queued within one window goes out as one frame
+                    await asyncio.sleep(getattr(settings, 'CHAT_BINARY_BATCH_WINDOW', 0.01))
+                    if not self._outbox:
+                        break
+                    messages = self._outbox.take_all()
+                    await self.send(bytes_data=encoding.pack_frame([encoding.pack_text(message['text']) for message in messages]))
+                    for message in messages:
+                        metrics.increment('ws_events_sent', type=message['event'])
+                else:
+                    message = self._outbox.popleft()
+                    await self.send(text_data=message['text'])
+                    metrics.increment('ws_events_sent', type=message['event'])
+
+    # Membership changed while connected (events.update_inboxes)
+    async def inbox_update(self, event):
+        group = events.inbox_group_name(event['room'])
+        if event['join']:
+            self.inbox_group_names.add(group)
+            await self.channel_layer.group_add(group, self.channel_name)
+        else:
+            self.inbox_group_names.discard(group)
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    # The presence sweeper gave up on this socket
+    async def presence_expired(self, event):
+        await self.close(code=4408)
+
+    @database_sync_to_async
+    def get_room(self):
+        try:
+            return ChatRoom.objects.get(id=self.room_id, members=self.user)
+        except (ChatRoom.DoesNotExist, ValueError):
+            return None
+
+    @database_sync_to_async
+    def get_room_ids(self):
+        return list(ChatRoom.members.through.objects.filter(user_id=self.user.id).values_list('chatroom_id', flat=True))
 
     @database_sync_to_async
-    def save_message(self, user_id, content):
-        user = User.objects.get(id=user_id)
-        room = ChatRoom.objects.get(id=self.room_id)
-        Message.objects.create(sender=user, room=room, content=content)
+    def save_message(self, content):
+        message = Message.objects.create(sender=self.user, room=self.room, content=content)
+        return serialize_messages([message], reactions={})[0]
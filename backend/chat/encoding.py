@@ -0,0 +1,110 @@
+"""
+Encoding for outbound frames.
+
+JSON uses orjson when it is installed (several times faster than the
+standard library, and compact by default) and falls back to ``json``
+otherwise. Both produce the same compact text.
+
+Clients that offer the ``yap.msgpack.v1`` subprotocol (and servers with
+msgpack installed) get binary frames instead: every frame is a MessagePack
+array of one or more events, with field names shortened through
+``SHORT_KEYS``. Events travel as JSON text and are packed from it on first
+use: once per process and event however many binary sockets receive it,
+and not at all when none do (see ``pack_text``). A frame is just an array
+header followed by the packed events, so batching costs no re-encoding.
+Clients may send binary frames with the same short keys.
+"""
+import json
+from functools import lru_cache
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+BINARY_SUBPROTOCOL = 'yap.msgpack.v1'
+
+SHORT_KEYS = {
+    'type': 't',
+    'room': 'r',
+    'message': 'm',
+    'message_id': 'mi',
+    'reactions': 'rx',
+    'user_id': 'u',
+    'username': 'un',
+    'last_read_message_id': 'lr',
+    'unread_count': 'uc',
+    'online': 'on',
+    'offline': 'off',
+    'id': 'i',
+    'sender': 's',
+    'content': 'c',
+    'timestamp': 'ts',
+    'is_read': 'rd',
+    'emoji': 'e',
+    'count': 'n',
+    'users': 'us',
+    'email': 'em',
+    'role': 'ro',
+    'status': 'st',
+    'is_approved': 'ap',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+
+def dumps(obj):
+    """Encode ``obj`` as a compact JSON string, ready for a text frame"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def binary_available():
+    return msgpack is not None and getattr(settings, 'CHAT_BINARY_PROTOCOL', True)
+
+
+def _rename(obj, keys):
+    if isinstance(obj, dict):
+        return {keys.get(key, key): _rename(value, keys) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_rename(value, keys) for value in obj]
+    return obj
+
+
+def pack(event):
+    """One event as MessagePack with short keys, for ``pack_frame``"""
+    return msgpack.packb(_rename(event, SHORT_KEYS))
+
+
+@lru_cache(maxsize=1024)
+def pack_text(text):
+    """
+    ``pack`` for an event already encoded as JSON ``text``. Every recipient
+    of a broadcast in this process holds the same string (the in-memory
+    layer's deepcopy leaves strings alone), so each event is packed once.
+    """
+    return pack(loads(text))
+
+
+def pack_frame(packed_events):
+    """Join already packed events into one binary frame (a MessagePack array)"""
+    header = msgpack.Packer().pack_array_header(len(packed_events))
+    return header + b''.join(packed_events)
+
+
+def unpack(data):
+    """Decode a binary frame from a client back to long keys"""
+    return _rename(msgpack.unpackb(data), LONG_KEYS)
@@ -0,0 +1,42 @@
+"""
+Ephemeral signals: typing indicators and the like.
+
+They are relayed to the room group and nothing else; no ORM, no
+persistence. Each (kind, user, room) may produce at most one event per
+``CHAT_EPHEMERAL_INTERVAL`` seconds on this process, so a burst of
+keystrokes in a large group costs one group_send per typist per interval.
+"""
+import time
+
+from django.conf import settings
+
+# Client frame type -> event type sent to the room
+KINDS = {
+    'typing': 'typing',
+}
+
+
+def _interval():
+    return getattr(settings, 'CHAT_EPHEMERAL_INTERVAL', 2.0)
+
+
+class RateCoalescer:
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._last = {}
+
+    def allow(self, key):
+        """True if ``key`` has not been allowed within the interval"""
+        interval = self.interval if self.interval is not None else _interval()
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < interval:
+            return False
+        self._last[key] = now
+        if len(self._last) > 10000:
+            # Forget keys that have gone quiet
+            self._last = {k: t for k, t in self._last.items() if now - t < interval}
+        return True
+
+
+coalescer = RateCoalescer()
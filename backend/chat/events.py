@@ -0,0 +1,193 @@
+"""
+Server-authoritative WebSocket events.
+
+Every event is built by the server after the change it describes has been
+persisted, so clients can apply it as a patch to their local state instead
+of refetching. All events share the envelope::
+
+    {"v": 1, "type": "<name>", "room": <room id>, ...}
+
+``message.created``   ``message``: the full row, shaped like the REST API.
+``reaction.changed``  ``message_id`` and the recomputed ``reactions`` for
+                      that one message. ``user_reacted`` is viewer specific
+                      and therefore left for the client to derive from
+                      ``users``.
+``read.updated``      ``user_id``, ``username`` and ``last_read_message_id``.
+``presence.changed``  ``online`` and ``offline``: ids of users whose last
+                      socket on the room opened or closed, coalesced (see
+                      chat.presence).
+``presence.state``    ``online``: everyone currently connected to the room.
+                      Sent only to a socket that has just connected.
+``membership.changed`` ``added`` and ``removed`` user ids and the new
+                      ``member_count``, one event per bulk change. Sockets
+                      of removed members are closed with 4403 instead.
+``typing``            ``user_id`` and ``username``. Ephemeral and rate
+                      limited (see chat.ephemeral); clients should expire
+                      the indicator after a few seconds on their own.
+
+Events are encoded once, when they are sent to a group, and each consumer
+writes the encoded frame as is; see ``encode``. Sockets on the binary
+subprotocol receive the same events in MessagePack, packed from the JSON
+only when such a socket exists (see chat.encoding).
+
+Inbox events go to the ``inbox_<room id>`` group, which every socket of
+every member joins whatever room it is viewing. They are encoded once per
+room, however many members it has:
+
+``unread.bumped``     ``count`` new messages in ``room``, and ``senders`` as
+                      ``[[user_id, n], ...]``. Clients add ``count`` minus
+                      their own ``n`` to the room's unread count.
+
+Per-user events go to the ``user_<id>`` group, which every socket of that
+user joins whatever room it is viewing:
+
+``unread.updated``    ``unread_count``: the user's new count for ``room``,
+                      sent when their read cursor moves.
+
+The ``user_<id>`` group also carries ``inbox.update`` control messages,
+which make that user's sockets join or leave a room's inbox group when
+their membership changes; they are not written to the socket.
+"""
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from . import metrics
+from .encoding import dumps
+
+EVENT_VERSION = 1
+
+
+def room_group_name(room_id):
+    return f'chat_{room_id}'
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def inbox_group_name(room_id):
+    return f'inbox_{room_id}'
+
+
+def _event(event_type, room_id, **fields):
+    return {'v': EVENT_VERSION, 'type': event_type, 'room': int(room_id), **fields}
+
+
+def message_created(message_data):
+    return _event('message.created', message_data['room'], message=message_data)
+
+
+def reaction_changed(room_id, message_id, reactions):
+    return _event('reaction.changed', room_id, message_id=int(message_id), reactions=[
+        {key: value for key, value in group.items() if key != 'user_reacted'}
+        for group in reactions
+    ])
+
+
+def read_updated(room_id, user_id, username, last_read_message_id):
+    return _event('read.updated', room_id, user_id=user_id, username=username,
+                  last_read_message_id=last_read_message_id)
+
+
+def presence_changed(room_id, online, offline):
+    return _event('presence.changed', room_id, online=online, offline=offline)
+
+
+def presence_state(room_id, online):
+    return _event('presence.state', room_id, online=list(online))
+
+
+def membership_changed(room_id, added, removed, member_count):
+    return _event('membership.changed', room_id, added=list(added), removed=list(removed),
+                  member_count=member_count)
+
+
+def ephemeral(event_type, room_id, user):
+    return _event(event_type, room_id, user_id=user.id, username=user.username)
+
+
+def unread_updated(room_id, unread_count):
+    return _event('unread.updated', room_id, unread_count=unread_count)
+
+
+def unread_bumped(room_id, sender_counts):
+    return _event('unread.bumped', room_id, count=sum(sender_counts.values()), senders=[
+        [int(user_id), count] for user_id, count in sender_counts.items()
+    ])
+
+
+def encode(event):
+    """
+    The ``chat.event`` message for ``event``, carrying it already encoded
+    as JSON so that consumers only have to write it.
+    """
+    message = {'type': 'chat.event', 'event': event['type'], 'text': dumps(event)}
+    if event['type'] == 'reaction.changed':
+        # A newer one for the same message supersedes it (chat.backpressure)
+        message['squash'] = f"reaction:{event['message_id']}"
+    elif event['type'] == 'membership.changed' and event['removed']:
+        # Consumers of these users drop their socket (ChatConsumer.chat_event)
+        message['revoke'] = event['removed']
+    return message
+
+
+async def _group_send(channel_layer, group, message):
+    start = time.perf_counter()
+    await channel_layer.group_send(group, message)
+    metrics.observe('group_send_seconds', time.perf_counter() - start)
+
+
+async def broadcast(event, channel_layer=None, ephemeral=False):
+    """
+    Deliver ``event`` to every socket connected to its room. Ephemeral
+    events are the ones that may be dropped under load.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    message = encode(event)
+    if ephemeral:
+        message['ephemeral'] = True
+    await _group_send(channel_layer, room_group_name(event['room']), message)
+
+
+def broadcast_sync(event):
+    async_to_sync(broadcast)(event)
+
+
+async def notify_new_messages(room_id, sender_counts, channel_layer=None):
+    """
+    Tell every member's sockets that ``room_id`` has new messages, where
+    ``sender_counts`` maps sender id to messages written: one event, encoded
+    once, whatever the size of the room.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    await _group_send(channel_layer, inbox_group_name(room_id), encode(unread_bumped(room_id, sender_counts)))
+
+
+async def update_inboxes(room_id, added=(), removed=(), channel_layer=None):
+    """Have the sockets of added and removed members join or leave the room's inbox"""
+    channel_layer = channel_layer or get_channel_layer()
+    await asyncio.gather(*(
+        channel_layer.group_send(user_group_name(user_id), {'type': 'inbox.update', 'room': int(room_id), 'join': join})
+        for user_ids, join in ((added, True), (removed, False))
+        for user_id in user_ids
+    ))
+
+
+def update_inboxes_sync(room_id, added=(), removed=()):
+    async_to_sync(update_inboxes)(room_id, added, removed)
+
+
+async def notify_unread(room_id, counts, channel_layer=None):
+    """Push ``{user_id: unread_count}`` for one room to each user's sockets"""
+    channel_layer = channel_layer or get_channel_layer()
+    await asyncio.gather(*(
+        _group_send(channel_layer, user_group_name(user_id), encode(unread_updated(room_id, count)))
+        for user_id, count in counts.items()
+    ))
+
+
+def notify_unread_sync(room_id, counts):
+    async_to_sync(notify_unread)(room_id, counts)
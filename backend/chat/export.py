@@ -0,0 +1,162 @@
+"""
+Streaming export of a room's history as NDJSON or CSV.
+
+``export_chunks`` yields the encoded export in blocks of about
+``BUFFER_SIZE`` bytes, optionally gzipped, while reading messages through a
+chunked ``.iterator()`` and their reactions one query per chunk. Memory use
+does not depend on the size of the room. Archived days (chat.archive) come
+first, a block at a time, followed by the rows still in ``chat_message``;
+both are ordered by id, so ``after_id`` resumes an interrupted export.
+
+One record per message::
+
+    {"id": 1, "room": 2, "sender_id": 3, "sender": "ann", "timestamp": "...",
+     "content": "...", "reactions": [{"user_id": 4, "username": "bob", "emoji": "👍"}]}
+
+CSV has the same columns, with ``reactions`` as a JSON string.
+"""
+import csv
+import io
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .archive import unpack_rows
+from .encoding import dumps
+from .models import Message, MessageArchive, Reaction
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+COLUMNS = ['id', 'room', 'sender_id', 'sender', 'timestamp', 'content', 'reactions']
+CHUNK_SIZE = 2000  # messages per query
+BUFFER_SIZE = 64 * 1024  # bytes per yielded block
+
+
+def _archived_records(room_id, after_id):
+    from users.models import User
+
+    blocks = MessageArchive.objects.filter(room_id=room_id).order_by('day')
+    for block_id in blocks.values_list('id', flat=True).iterator():
+        rows = unpack_rows(MessageArchive.objects.values_list('data', flat=True).get(pk=block_id))
+        rows = sorted((row for row in rows if row[0] > after_id), key=lambda row: row[0])
+        if not rows:
+            continue
+        users = dict(User.objects.filter(
+            id__in={row[1] for row in rows} | {u for row in rows for u, _ in row[4]}
+        ).values_list('id', 'username'))
+        for message_id, sender_id, timestamp, content, reactions in rows:
+            if sender_id not in users:
+                continue
+            yield {
+                'id': message_id,
+                'room': room_id,
+                'sender_id': sender_id,
+                'sender': users[sender_id],
+                'timestamp': timestamp.isoformat(),
+                'content': content,
+                'reactions': [
+                    {'user_id': u, 'username': users[u], 'emoji': emoji}
+                    for u, emoji in reactions if u in users
+                ],
+            }
+
+
+def _stored_records(room_id, after_id, chunk_size):
+    messages = (
+        Message.objects.filter(room_id=room_id, id__gt=after_id).order_by('id')
+        .values_list('id', 'sender_id', 'sender__username', 'timestamp', 'content')
+        .iterator(chunk_size=chunk_size)
+    )
+    while True:
+        chunk = list(islice(messages, chunk_size))
+        if not chunk:
+            return
+        reactions = {}
+        for message_id, user_id, username, emoji in (
+            Reaction.objects.filter(message_id__in=[row[0] for row in chunk]).order_by('id')
+            .values_list('message_id', 'user_id', 'user__username', 'emoji')
+        ):
+            reactions.setdefault(message_id, []).append({'user_id': user_id, 'username': username, 'emoji': emoji})
+        for message_id, sender_id, sender, timestamp, content in chunk:
+            yield {
+                'id': message_id,
+                'room': room_id,
+                'sender_id': sender_id,
+                'sender': sender,
+                'timestamp': timestamp.isoformat(),
+                'content': content,
+                'reactions': reactions.get(message_id, []),
+            }
+
+
+def export_records(room_id, after_id=0, chunk_size=CHUNK_SIZE):
+    """Every message in the room with an id above ``after_id``, in id order"""
+    yield from _archived_records(room_id, after_id)
+    yield from _stored_records(room_id, after_id, chunk_size)
+
+
+def _lines(records, fmt):
+    if fmt == 'ndjson':
+        for record in records:
+            yield dumps(record) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for record in records:
+        record['reactions'] = dumps(record['reactions'])
+        writer.writerow([record[column] for column in COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export_chunks(room_id, fmt='ndjson', compress=False, after_id=0, chunk_size=CHUNK_SIZE):
+    """The encoded export as a stream of byte strings"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format {fmt!r}')
+    return _chunks(room_id, fmt, compress, after_id, chunk_size)
+
+
+def _chunks(room_id, fmt, compress, after_id, chunk_size):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending = []
+    size = 0
+    for line in _lines(export_records(room_id, after_id, chunk_size), fmt):
+        data = line.encode()
+        pending.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            block = b''.join(pending)
+            pending, size = [], 0
+            if compressor is not None:
+                block = compressor.compress(block)
+            if block:
+                yield block
+    block = b''.join(pending)
+    if compressor is not None:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
+
+
+def aexport_chunks(*args, **kwargs):
+    """
+    ``export_chunks`` for ASGI. Django buffers a synchronous iterator whole
+    before sending it from an async handler, so pull one block at a time
+    from the worker thread instead.
+    """
+    return _pull(export_chunks(*args, **kwargs))
+
+
+async def _pull(chunks):
+    pull = sync_to_async(next, thread_sensitive=True)
+    while True:
+        block = await pull(chunks, None)
+        if block is None:
+            return
+        yield block
@@ -0,0 +1,275 @@
+"""
+Multi-process channel layer for a single machine.
+
+``UnixSocketChannelLayer`` keeps the in-memory layer's per-process queues
+and group tables, and relays traffic between the ASGI worker processes of
+one box over Unix datagram sockets:
+
+* every process binds ``<path>/<node>.sock``, where ``<node>`` is unique to
+  the process and is embedded in the names of the process's channels;
+* ``send`` to a channel owned by another process is forwarded to that
+  process's socket;
+* ``group_send`` delivers to local members and forwards the message once to
+  every peer, which delivers it to its own local members.
+
+Group membership never leaves the process that owns the channel, so there
+is no shared state to keep consistent. Frames over ``MAX_DATAGRAM`` bytes
+are dropped with a warning: a direct ``send`` raises ``ChannelFull`` as it
+does for a backed-up peer, and ``group_send`` skips the peers.
+
+Besides channel traffic, ``broadcast_signal`` sends a named payload to
+every other process, where the handlers registered with ``on_signal`` run
+in the receiver thread. Processes use it to drop per-process caches (see
+users.authentication). Frames are JSON, so they can only
+carry what the JSON encoder accepts plus ``bytes``. The socket directory
+is created with mode 0700 so only the owning user can inject traffic.
+"""
+import asyncio
+import atexit
+import base64
+import json
+import logging
+import os
+import random
+import socket
+import string
+import tempfile
+import threading
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Linux caps AF_UNIX datagrams by the socket buffer; stay well below it.
+MAX_DATAGRAM = 200 * 1024
+PEER_REFRESH_INTERVAL = 1.0
+CLEAN_INTERVAL = 1.0
+
+
+def _default(value):
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode()}
+    raise TypeError(f'{type(value).__name__} is not serializable over the channel layer')
+
+
+def _object_hook(value):
+    if len(value) == 1 and '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def encode_frame(frame):
+    return json.dumps(frame, default=_default, separators=(',', ':')).encode()
+
+
+def decode_frame(data):
+    return json.loads(data, object_hook=_object_hook)
+
+
+class UnixSocketChannelLayer(InMemoryChannelLayer):
+    def __init__(self, path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path or os.path.join(tempfile.gettempdir(), f'yap-channels-{os.getuid()}'))
+        self.node = 'n%d%s' % (os.getpid(), ''.join(random.choice(string.ascii_lowercase) for _ in range(6)))
+        self.address = os.path.join(self.path, f'{self.node}.sock')
+        self._loop = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._peers = []
+        self._peers_checked = 0.0
+        self._cleaned = 0.0
+        self._signal_handlers = {}
+
+    # Lifecycle
+
+    def _start(self):
+        """Bind this process's socket and start the receiver thread"""
+        with self._start_lock:
+            if self._started:
+                return
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            if os.stat(self.path).st_uid != os.getuid():
+                raise RuntimeError(f'Channel layer directory {self.path} is owned by another user')
+            self._recv_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._recv_sock.bind(self.address)
+            self._send_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._send_sock.setblocking(False)
+            atexit.register(self._unlink)
+            threading.Thread(target=self._receive_loop, name='channel-layer-receiver', daemon=True).start()
+            self._started = True
+
+    def _unlink(self):
+        try:
+            os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    async def close(self):
+        if self._started:
+            self._recv_sock.close()
+            self._send_sock.close()
+            self._unlink()
+            self._started = False
+
+    # Peer traffic
+
+    def _peer_addresses(self):
+        now = time.monotonic()
+        if now - self._peers_checked > PEER_REFRESH_INTERVAL:
+            self._peers = [
+                entry.path for entry in os.scandir(self.path)
+                if entry.name.endswith('.sock') and entry.path != self.address
+            ]
+            self._peers_checked = now
+        return self._peers
+
+    def _send_to(self, address, frame):
+        """Send one frame without blocking; returns False if it was dropped"""
+        return self._send_data(address, encode_frame(frame))
+
+    def _send_data(self, address, data):
+        if len(data) > MAX_DATAGRAM:
+            logger.warning('Dropping %d byte channel layer frame (limit %d)', len(data), MAX_DATAGRAM)
+            return False
+        try:
+            self._send_sock.sendto(data, address)
+        except BlockingIOError:
+            # Peer's receive buffer is full: same outcome as a full channel
+            metrics.increment('layer_peer_dropped')
+            return False
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Peer process is gone; forget its socket
+            try:
+                os.unlink(address)
+            except FileNotFoundError:
+                pass
+            self._peers_checked = 0.0
+            return False
+        return True
+
+    def _receive_loop(self):
+        sock = self._recv_sock
+        while True:
+            try:
+                data = sock.recv(MAX_DATAGRAM + 1)
+            except OSError:
+                return  # closed
+            try:
+                frame = decode_frame(data)
+            except ValueError:
+                logger.warning('Discarding malformed channel layer frame')
+                continue
+            if frame['op'] == 'signal':
+                self._handle_signal(frame['name'], frame['payload'])
+                continue
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                # Nothing in this process is listening yet
+                continue
+            asyncio.run_coroutine_threadsafe(self._deliver(frame), loop)
+
+    def _handle_signal(self, name, payload):
+        for handler in self._signal_handlers.get(name, ()):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception('Channel layer signal handler for %r failed', name)
+
+    async def _deliver(self, frame):
+        if frame['op'] == 'group':
+            await self._group_send_local(frame['group'], frame['message'])
+        else:
+            try:
+                await super().send(frame['channel'], frame['message'])
+            except ChannelFull:
+                metrics.increment('layer_channel_full')
+
+    def _clean_expired(self):
+        # The base layer walks every channel and group on each receive and
+        # group_send, which makes fan-out quadratic in room size. Expiry is
+        # measured in tens of seconds, so once a second is plenty.
+        now = time.monotonic()
+        if now - self._cleaned < CLEAN_INTERVAL:
+            return
+        self._cleaned = now
+        super()._clean_expired()
+
+    async def _group_send_local(self, group, message):
+        # Group members are always local channels. Unlike the base layer,
+        # don't create a task per member just to put onto its queue.
+        self.require_valid_group_name(group)
+        self._clean_expired()
+        for channel in list(self.groups.get(group, ())):
+            try:
+                await InMemoryChannelLayer.send(self, channel, message)
+            except ChannelFull:
+                # The consumer isn't keeping up with the layer at all
+                metrics.increment('layer_channel_full')
+
+    def _owner(self, channel):
+        if '!' not in channel:
+            return self.node
+        return channel.split('!', 1)[0].rsplit('.', 1)[-1]
+
+    # Process signals
+
+    def on_signal(self, name, handler):
+        """
+        Call ``handler(payload)`` whenever another process broadcasts
+        ``name``. Handlers run in the receiver thread, so they must be
+        thread-safe and quick.
+        """
+        self._signal_handlers.setdefault(name, []).append(handler)
+        self._start()
+
+    def broadcast_signal(self, name, payload):
+        """Send ``payload`` to the ``name`` handlers of every other process"""
+        self._start()
+        # Rescan now rather than once a second: signals are rare, and a
+        # process that has just started may already hold state to drop
+        self._peers_checked = 0.0
+        data = encode_frame({'op': 'signal', 'name': name, 'payload': payload})
+        for address in self._peer_addresses():
+            self._send_data(address, data)
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        self._start()
+        return '%s.%s!%s' % (
+            prefix,
+            self.node,
+            ''.join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    async def send(self, channel, message):
+        owner = self._owner(channel)
+        if owner == self.node:
+            return await super().send(channel, message)
+        self._start()
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        if not self._send_to(os.path.join(self.path, f'{owner}.sock'), {
+            'op': 'send', 'channel': channel, 'message': message,
+        }):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        # Remote deliveries are scheduled onto the loop consumers wait on
+        self._start()
+        self._loop = asyncio.get_running_loop()
+        return await super().receive(channel)
+
+    async def group_send(self, group, message):
+        self._start()
+        await self._group_send_local(group, message)
+        peers = self._peer_addresses()
+        if peers:
+            # Encode once for every peer
+            data = encode_frame({'op': 'group', 'group': group, 'message': message})
+            for address in peers:
+                self._send_data(address, data)
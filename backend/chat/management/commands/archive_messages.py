@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import DELETE_BATCH_SIZE, archive_before
+
+
+class Command(BaseCommand):
+    help = (
+        'Move messages older than a cutoff into compressed per-room, per-day archive blocks. '
+        'Safe to run from cron; an interrupted run is completed by the next one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 365),
+                            help='Archive whole days older than this many days')
+        parser.add_argument('--room', type=int, action='append', help='Only archive this room (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=DELETE_BATCH_SIZE,
+                            help='Messages deleted per transaction')
+
+    def handle(self, *args, **options):
+        def progress(room_id, day, count):
+            self.stdout.write(f'  room {room_id} {day}: {count} messages')
+
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        moved = archive_before(cutoff, room_ids=options['room'], batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} messages'))
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.core.management.base import BaseCommand
+
+from chat import backpressure, events
+from chat.consumers import ChatConsumer
+from chat.encoding import orjson
+
+
+class _Consumer(ChatConsumer):
+    """A consumer whose socket writes go nowhere"""
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        self.sent += 1
+
+
+class _LegacyConsumer(_Consumer):
+    # What every recipient used to do: encode the event itself
+    async def chat_event(self, event):
+        await self.send(text_data=json.dumps(event['event']))
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure CPU spent fanning one message out to rooms of increasing size: per-recipient '
+        'encoding on the stock in-memory layer versus encode-once on the configured layer'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,500,2000',
+                            help='Comma separated room sizes')
+        parser.add_argument('--messages', type=int, default=20,
+                            help='Messages broadcast per size')
+        parser.add_argument('--layer', default=settings.CHANNEL_LAYERS['default']['BACKEND'],
+                            help='Channel layer class (default: the configured one)')
+
+    def handle(self, *args, **options):
+        layer_class = import_string(options['layer'])
+        self.stdout.write(f'encoder: {"orjson" if orjson else "json"}, layer: {layer_class.__name__}')
+        for size in [int(s) for s in options['sizes'].split(',')]:
+            legacy = asyncio.run(self._run(
+                InMemoryChannelLayer, _LegacyConsumer, self._legacy_broadcast, size, options['messages']
+            ))
+            once = asyncio.run(self._run(layer_class, _Consumer, events.broadcast, size, options['messages']))
+            self.stdout.write(
+                f'{size:6d} members  before {legacy * 1000:8.2f} ms  '
+                f'after {once * 1000:8.2f} ms  CPU / message  ({legacy / once:.1f}x)'
+            )
+
+    @staticmethod
+    async def _legacy_broadcast(event, channel_layer):
+        await channel_layer.group_send(events.room_group_name(event['room']), {
+            'type': 'chat.event',
+            'event': event,
+        })
+
+    async def _run(self, layer_class, consumer_class, broadcast, size, count):
+        layer = layer_class(capacity=count + 1)
+        consumers = []
+        for _ in range(size):
+            consumer = consumer_class()
+            consumer.sent = 0
+            consumer.binary = False
+            consumer._outbox = backpressure.OutboundQueue(limit=count + 1)
+            consumer._has_outbound = asyncio.Event()
+            consumer._writer = asyncio.ensure_future(consumer._write_outbox())
+            consumer.channel_layer = layer
+            consumer.channel_name = await layer.new_channel()
+            await layer.group_add(events.room_group_name(1), consumer.channel_name)
+            consumers.append(consumer)
+
+        start = time.process_time()
+        for i in range(count):
+            await broadcast(events.message_created(_message(i)), channel_layer=layer)
+            for consumer in consumers:
+                await consumer.chat_event(await layer.receive(consumer.channel_name))
+            # Let the socket writers run
+            while consumers[-1].sent <= i:
+                await asyncio.sleep(0)
+        elapsed = time.process_time() - start
+        assert all(consumer.sent == count for consumer in consumers)
+        for consumer in consumers:
+            if consumer._writer is not None:
+                consumer._writer.cancel()
+        await layer.close()
+        return elapsed / count
+
+
+def _message(i):
+    return {
+        'id': i,
+        'sender': {'id': 1, 'username': 'bench', 'email': 'bench@example.com', 'role': 'FREE',
+                   'status': 'ACTIVE', 'is_approved': True},
+        'room': 1,
+        'content': 'The quick brown fox jumps over the lazy dog. ' * 4,
+        'timestamp': '2026-01-01T12:00:00.000000Z',
+        'is_read': False,
+        'reactions': [{'emoji': '👍', 'count': 2, 'users': [{'id': 2, 'username': 'x'}, {'id': 3, 'username': 'y'}]}],
+    }
@@ -0,0 +1,84 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from chat.models import ChatRoom, Message, Reaction
+from chat.serializers import MessageSerializer, serialize_messages
+from users.models import User
+
+EMOJIS = ['👍', '❤️', '😂', '😮', '😢', '🔥']
+
+
+class _Request:
+    def __init__(self, user):
+        self.user = user
+
+
+class Command(BaseCommand):
+    help = 'Compare MessageSerializer with the bulk serialization path on a seeded room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--reactions', type=float, default=0.5,
+                            help='Average reactions per message')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Seed inside a transaction that is rolled back, so the benchmark
+        # never leaves data behind.
+        with transaction.atomic():
+            room, viewer = self._seed(options)
+            self._run(room, viewer, options)
+            transaction.set_rollback(True)
+
+    def _seed(self, options):
+        users = User.objects.bulk_create([
+            User(username=f'bench_{i}_{random.getrandbits(32)}', email=f'bench{i}@example.com',
+                 status=User.Status.ACTIVE, is_approved=True)
+            for i in range(options['users'])
+        ])
+        room = ChatRoom.objects.create(name='bench', type='GROUP')
+        room.members.add(*users)
+        messages = Message.objects.bulk_create([
+            Message(room=room, sender=random.choice(users), content=f'message {i}')
+            for i in range(options['messages'])
+        ])
+        reactions = set()
+        for _ in range(int(options['messages'] * options['reactions'])):
+            reactions.add((random.choice(messages).id, random.choice(users).id, random.choice(EMOJIS)))
+        Reaction.objects.bulk_create([
+            Reaction(message_id=m, user_id=u, emoji=e) for m, u, e in reactions
+        ])
+        return room, users[0]
+
+    def _run(self, room, viewer, options):
+        count = options['messages']
+
+        def serializer_path():
+            messages = room.messages.all().order_by('timestamp')
+            return MessageSerializer(messages, many=True, context={'request': _Request(viewer), 'read_horizon': []}).data
+
+        def bulk_path():
+            return serialize_messages(room.messages.select_related('sender').order_by('timestamp'), viewer)
+
+        results = {}
+        for name, func in (('MessageSerializer', serializer_path), ('serialize_messages', bulk_path)):
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                func()
+            timings = []
+            for _ in range(options['rounds']):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            results[name] = (min(timings), len(ctx.captured_queries))
+
+        for name, (best, queries) in results.items():
+            per_thousand = best * 1000 / count * 1000
+            self.stdout.write(f'{name:<20} {per_thousand:8.1f} ms / 1000 messages  {queries:6d} queries')
+        speedup = results['MessageSerializer'][0] / results['serialize_messages'][0]
+        self.stdout.write(self.style.SUCCESS(f'speedup: {speedup:.1f}x'))
@@ -0,0 +1,96 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import ChatRoom, Message
+from chat.search import get_backend
+from users.models import User
+
+SYLLABLES = 'ka lo mi ne ru ta vo zi pe sa do fu ge hi ja'.split()
+
+# A few thousand synthetic words with Zipf-like frequencies, like real chat:
+# a handful are everywhere, most are rare.
+_rng = random.Random(0)
+WORDS = sorted({''.join(_rng.choices(SYLLABLES, k=_rng.randint(3, 5))) for _ in range(6000)})
+_rng.shuffle(WORDS)
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(WORDS))))
+
+
+class Command(BaseCommand):
+    help = 'Compare indexed full-text search with a content__icontains scan on a seeded corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--rooms', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=20000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Seed inside a transaction that is rolled back, so the benchmark
+        # never leaves data behind.
+        with transaction.atomic():
+            viewer = self._seed(options)
+            self._run(viewer, options)
+            transaction.set_rollback(True)
+
+    def _seed(self, options):
+        viewer = User.objects.create(username=f'bench_{random.getrandbits(32)}',
+                                     status=User.Status.ACTIVE, is_approved=True)
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(name=f'bench {i}', type='GROUP') for i in range(options['rooms'])
+        ])
+        # The viewer belongs to a tenth of the rooms, so scoping matters
+        ChatRoom.members.through.objects.bulk_create([
+            ChatRoom.members.through(chatroom_id=room.id, user_id=viewer.id) for room in rooms[::10]
+        ])
+        start = time.perf_counter()
+        remaining = options['messages']
+        while remaining:
+            size = min(remaining, options['batch_size'])
+            Message.objects.bulk_create([
+                Message(room=random.choice(rooms), sender=viewer,
+                        content=' '.join(random.choices(WORDS, cum_weights=CUM_WEIGHTS, k=random.randint(3, 12))))
+                for _ in range(size)
+            ])
+            remaining -= size
+        self.stdout.write(f'seeded {options["messages"]} messages (indexed on insert) '
+                          f'in {time.perf_counter() - start:.1f}s')
+        return viewer
+
+    def _run(self, viewer, options):
+        backend = get_backend()
+        room_ids = list(ChatRoom.objects.filter(members=viewer).values_list('id', flat=True))
+        queries = {
+            'common': WORDS[5],
+            'mid': WORDS[200],
+            'rare': WORDS[4000],
+            'two words': f'{WORDS[20]} {WORDS[60]}',
+            'prefix': WORDS[300][:4],
+            'no match': 'zzzz',
+        }
+        for label, query in queries.items():
+            def scan():
+                qs = Message.objects.filter(room_id__in=room_ids)
+                for word in query.split():
+                    qs = qs.filter(content__icontains=word)
+                return list(qs.order_by('-id').values_list('id', flat=True)[:20])
+
+            def indexed():
+                return backend.search(viewer.id, query, limit=20)
+
+            results = {}
+            for name, func in (('icontains', scan), ('indexed', indexed)):
+                timings = []
+                for _ in range(options['rounds']):
+                    start = time.perf_counter()
+                    func()
+                    timings.append(time.perf_counter() - start)
+                results[name] = min(timings)
+            self.stdout.write(
+                f'{label:<10} {query!r:<20} icontains {results["icontains"] * 1000:8.1f} ms  '
+                f'indexed {results["indexed"] * 1000:8.1f} ms  '
+                f'({results["icontains"] / results["indexed"]:.1f}x)'
+            )
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import CHUNK_SIZE, FORMATS, export_chunks
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Stream a room's messages and reactions to a file (or stdout) as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_id', type=int)
+        parser.add_argument('--output', '-o', default='-', help='File to write, or - for stdout')
+        parser.add_argument('--format', dest='fmt', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--after-id', type=int, default=0, help='Resume after this message id')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if not ChatRoom.objects.filter(pk=options['room_id']).exists():
+            raise CommandError(f"Room {options['room_id']} does not exist")
+        chunks = export_chunks(
+            options['room_id'], fmt=options['fmt'], compress=options['gzip'],
+            after_id=options['after_id'], chunk_size=options['chunk_size'],
+        )
+        out = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        written = 0
+        try:
+            for block in chunks:
+                out.write(block)
+                written += len(block)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat import writebehind
+from chat.models import ChatRoom, Message
+from stats import counters
+from users.models import User
+
+
+class CommunicatorClient:
+    """Drives the ASGI application in this process"""
+
+    def __init__(self, room_id, token):
+        from channels.testing import WebsocketCommunicator
+        from yap_project.asgi import application
+
+        self.communicator = WebsocketCommunicator(application, f'/ws/chat/{room_id}/?token={token}')
+
+    async def connect(self):
+        connected, code = await self.communicator.connect()
+        if not connected:
+            raise CommandError(f'WebSocket rejected with {code}')
+
+    async def send(self, payload):
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def receive(self):
+        while True:
+            output = await self.communicator.receive_output()
+            if output['type'] == 'websocket.send':
+                return json.loads(output['text'])
+            if output['type'] == 'websocket.close':
+                raise ConnectionError(f"closed with {output.get('code')}")
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """Talks to a running server over the network"""
+
+    def __init__(self, url, room_id, token):
+        self.url = f"{url.rstrip('/')}/ws/chat/{room_id}/"
+        self.token = token
+
+    async def connect(self):
+        try:
+            import websockets
+        except ImportError:
+            raise CommandError('--url needs the websockets package')
+        self.socket = await websockets.connect(self.url, subprotocols=['jwt', self.token], max_queue=None)
+
+    async def send(self, payload):
+        await self.socket.send(json.dumps(payload))
+
+    async def receive(self):
+        return json.loads(await self.socket.recv())
+
+    async def close(self):
+        await self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test ChatConsumer: N rooms x M clients sending at a fixed rate. Prints a JSON '
+        'report with throughput, end-to-end latency, queries per message and peak RSS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=5)
+        parser.add_argument('--clients', type=int, default=10, help='Clients per room')
+        parser.add_argument('--rate', type=float, default=1.0, help='Messages per second per client')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of sending')
+        parser.add_argument('--drain', type=float, default=10.0,
+                            help='Seconds to wait for outstanding messages after sending stops')
+        parser.add_argument('--write-behind', action='store_true',
+                            help='Enable CHAT_WRITE_BEHIND for this run (in-process mode)')
+        parser.add_argument('--url', help='Drive a running server (e.g. ws://127.0.0.1:8000) '
+                                          'instead of the application in this process')
+        parser.add_argument('--server-pid', type=int, help='Report peak RSS of this server process')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        if options['write_behind']:
+            settings.CHAT_WRITE_BEHIND = True
+        users, rooms = self._seed(options)
+        try:
+            if options['url']:
+                report = asyncio.run(self._run(users, rooms, options))
+                report['queries_per_message'] = None  # the server's connection isn't ours
+            else:
+                # Under async_to_sync, database_sync_to_async runs every query
+                # on this thread, where CaptureQueriesContext can see it.
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as ctx:
+                    report = async_to_sync(self._run)(users, rooms, options)
+                stored = Message.objects.filter(room__in=rooms).count()
+                report['queries_per_message'] = round(len(ctx.captured_queries) / stored, 2) if stored else None
+        finally:
+            # The consumers write through their own connections (or another
+            # process's), so the run can't be rolled back; take its messages
+            # back out of the stats counters before deleting them instead.
+            with transaction.atomic():
+                counters.discount_messages(Message.objects.filter(room__in=rooms).only('timestamp'))
+                ChatRoom.objects.filter(id__in=[room.id for room in rooms]).delete()
+                User.objects.filter(id__in=[user.id for user in users]).delete()
+
+        report['peak_rss_kb'] = {
+            'client': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'server': _peak_rss(options['server_pid']) if options['server_pid'] else None,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        self.stdout.write(text)
+
+    def _seed(self, options):
+        tag = random.getrandbits(32)
+        users = User.objects.bulk_create([
+            User(username=f'loadtest_{tag}_{i}', status=User.Status.ACTIVE, is_approved=True)
+            for i in range(options['rooms'] * options['clients'])
+        ])
+        rooms = []
+        for r in range(options['rooms']):
+            room = ChatRoom.objects.create(name=f'loadtest {tag} {r}', type='GROUP')
+            room.members.add(*users[r * options['clients']:(r + 1) * options['clients']])
+            rooms.append(room)
+        return users, rooms
+
+    async def _run(self, users, rooms, options):
+        clients = []
+        for r, room in enumerate(rooms):
+            for user in users[r * options['clients']:(r + 1) * options['clients']]:
+                token = str(AccessToken.for_user(user))
+                if options['url']:
+                    client = SocketClient(options['url'], room.id, token)
+                else:
+                    client = CommunicatorClient(room.id, token)
+                clients.append((client, room.id))
+        await asyncio.gather(*(client.connect() for client, _ in clients))
+
+        sent_at = {}
+        latencies = []
+        persisted = set()
+        errors = []
+
+        async def sender(index, client):
+            interval = 1 / options['rate']
+            # Spread the clients over the first interval
+            await asyncio.sleep(random.random() * interval)
+            deadline = time.monotonic() + options['duration']
+            seq = 0
+            while time.monotonic() < deadline:
+                tag = f'lt:{index}:{seq}'
+                sent_at[tag] = time.monotonic()
+                await client.send({'message': tag})
+                seq += 1
+                await asyncio.sleep(interval)
+
+        async def receiver(client):
+            try:
+                while True:
+                    event = await client.receive()
+                    if event.get('type') != 'message.created':
+                        continue
+                    tag = event['message']['content']
+                    if tag in sent_at:
+                        latencies.append(time.monotonic() - sent_at[tag])
+                        persisted.add(tag)
+            except ConnectionError as e:
+                errors.append(str(e))
+
+        receivers = [asyncio.ensure_future(receiver(client)) for client, _ in clients]
+        start = time.monotonic()
+        await asyncio.gather(*(sender(i, client) for i, (client, _) in enumerate(clients)))
+        # Wait until every message has come back or the drain time is up
+        deadline = time.monotonic() + options['drain']
+        while len(persisted) < len(sent_at) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - start
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        await asyncio.gather(*(client.close() for client, _ in clients), return_exceptions=True)
+        if writebehind.is_enabled():
+            await writebehind.get_write_buffer().flush()
+
+        latencies.sort()
+        # Every member of the room, sender included, should see each message
+        expected = len(sent_at) * options['clients']
+        return {
+            'config': {
+                'mode': 'server' if options['url'] else 'in-process',
+                'rooms': options['rooms'],
+                'clients_per_room': options['clients'],
+                'rate_per_client': options['rate'],
+                'duration': options['duration'],
+                'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+                'write_behind': writebehind.is_enabled(),
+                'python': platform.python_version(),
+                'platform': sys.platform,
+            },
+            'messages': {
+                'sent': len(sent_at),
+                'persisted': len(persisted),
+                'deliveries': len(latencies),
+                'expected_deliveries': expected,
+                'per_second': round(len(persisted) / elapsed, 2),
+                'deliveries_per_second': round(len(latencies) / elapsed, 2),
+            },
+            'latency_ms': {
+                'p50': _percentile(latencies, 50),
+                'p99': _percentile(latencies, 99),
+                'max': round(latencies[-1] * 1000, 2) if latencies else None,
+                'mean': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+            },
+            'errors': errors,
+        }
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def _peak_rss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
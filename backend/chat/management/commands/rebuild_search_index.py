@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from chat.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text message search index from the message table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        def progress(last_id):
+            self.stdout.write(f'  indexed up to message {last_id}')
+
+        backend = get_backend()
+        if not hasattr(backend, 'reindex'):
+            self.stdout.write('This database has no search index to rebuild')
+            return
+        backend.reindex(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from chat.models import ChatRoom, Message, RoomReadState
+
+
+class Command(BaseCommand):
+    help = 'Repair materialized unread counters by recounting them from the message table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--room', type=int, help='Only repair this room')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        memberships = ChatRoom.members.through.objects.order_by('pk')
+        states = RoomReadState.objects.order_by('pk')
+        if options['room']:
+            memberships = memberships.filter(chatroom_id=options['room'])
+            states = states.filter(room_id=options['room'])
+
+        # Members without a row have never read the room
+        has_state = RoomReadState.objects.filter(room_id=OuterRef('chatroom_id'), user_id=OuterRef('user_id'))
+        missing = memberships.exclude(Exists(has_state)).values_list('pk', 'user_id', 'chatroom_id')
+        created = 0
+        for batch in self._batches(missing, batch_size):
+            created += len(RoomReadState.objects.bulk_create([
+                RoomReadState(user_id=user_id, room_id=room_id) for _, user_id, room_id in batch
+            ], ignore_conflicts=True))
+
+        # Rows for people who are no longer members
+        is_member = ChatRoom.members.through.objects.filter(
+            chatroom_id=OuterRef('room_id'), user_id=OuterRef('user_id')
+        )
+        removed, _ = states.exclude(Exists(is_member)).delete()
+
+        fixed = 0
+        for batch in self._batches(states, batch_size):
+            changed = []
+            for state in batch:
+                count = Message.objects.filter(
+                    room_id=state.room_id, id__gt=state.last_read_message_id
+                ).exclude(sender_id=state.user_id).count()
+                if count != state.unread_count:
+                    state.unread_count = count
+                    changed.append(state)
+            RoomReadState.objects.bulk_update(changed, ['unread_count'])
+            fixed += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} missing, removed {removed} stale, corrected {fixed} counters'
+        ))
+
+    def _batches(self, queryset, size):
+        """Walk a pk-ordered queryset in keyset batches"""
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1][0] if isinstance(batch[-1], tuple) else batch[-1].pk
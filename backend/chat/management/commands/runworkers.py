@@ -0,0 +1,73 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Run several Daphne ASGI workers that share one listening socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--bind', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--backlog', type=int, default=2048)
+        parser.add_argument('--application', default=settings.ASGI_APPLICATION.replace('.application', ':application'))
+
+    def handle(self, *args, **options):
+        backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+        if options['workers'] > 1 and backend.endswith('InMemoryChannelLayer'):
+            self.stderr.write(self.style.WARNING(
+                'InMemoryChannelLayer does not cross processes; group messages will only '
+                'reach sockets on the worker that sent them.'
+            ))
+
+        # The parent owns the listening socket; every worker accepts on the
+        # inherited descriptor, so the kernel spreads connections across them.
+        listener = socket.socket(socket.AF_INET6 if ':' in options['bind'] else socket.AF_INET)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((options['bind'], options['port']))
+        listener.listen(options['backlog'])
+        listener.set_inheritable(True)
+        fd = listener.fileno()
+
+        def spawn():
+            return subprocess.Popen(
+                [sys.executable, '-m', 'daphne', '--fd', str(fd), options['application']],
+                pass_fds=(fd,),
+            )
+
+        workers = [spawn() for _ in range(options['workers'])]
+        self.stdout.write(f"Started {len(workers)} workers on {options['bind']}:{options['port']}")
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        try:
+            while not stopping:
+                for i, worker in enumerate(workers):
+                    if worker.poll() is not None:
+                        self.stderr.write(f'Worker {worker.pid} exited with {worker.returncode}; restarting')
+                        workers[i] = spawn()
+                time.sleep(0.5)
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+            for worker in workers:
+                try:
+                    worker.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+            listener.close()
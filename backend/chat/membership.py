@@ -0,0 +1,55 @@
+"""
+Bulk room membership changes.
+
+``m2m_changed`` fires once per ``members.add``/``remove`` call, and the
+handler in chat.signals then does per-room bookkeeping. For thousands of
+users in one request, ``update_members`` diffs the request against the
+through table instead. It writes the difference with one ``bulk_create``
+and one delete, and does the same bookkeeping itself: read states,
+``member_count`` and the members' inbox groups. Then it broadcasts a single
+``membership.changed`` event.
+"""
+from django.db import transaction
+
+from . import events
+from .models import ChatRoom, RoomReadState
+
+
+def update_members(room, members=None, add=(), remove=()):
+    """
+    Make ``members`` (if given) the room's exact member set, or else add
+    and remove the given user ids. Unknown user ids are ignored. Returns
+    ``(added, removed)`` as sorted lists of user ids.
+    """
+    from users.models import User
+
+    Membership = ChatRoom.members.through
+    add, remove = set(add), set(remove)
+    if add & remove:
+        raise ValueError('A user cannot be both added and removed')
+
+    with transaction.atomic():
+        # Lock the room so concurrent changes apply one after the other
+        room = ChatRoom.objects.select_for_update().get(pk=room.pk)
+        current = set(Membership.objects.filter(chatroom_id=room.pk).values_list('user_id', flat=True))
+        if members is not None:
+            wanted = set(User.objects.filter(id__in=set(members)).values_list('id', flat=True))
+            added, removed = wanted - current, current - wanted
+        else:
+            new = add - current
+            added = set(User.objects.filter(id__in=new).values_list('id', flat=True)) if new else set()
+            removed = remove & current
+
+        if added:
+            Membership.objects.bulk_create([Membership(chatroom_id=room.pk, user_id=user_id) for user_id in added])
+            RoomReadState.join(room, added)
+        if removed:
+            Membership.objects.filter(chatroom_id=room.pk, user_id__in=removed).delete()
+            RoomReadState.leave(room.pk, removed)
+        if added or removed:
+            room.member_count = len(current) + len(added) - len(removed)
+            ChatRoom.objects.filter(pk=room.pk).update(member_count=room.member_count)
+            event = events.membership_changed(room.pk, sorted(added), sorted(removed), room.member_count)
+            transaction.on_commit(lambda: events.broadcast_sync(event))
+            transaction.on_commit(lambda: events.update_inboxes_sync(room.pk, added, removed))
+    return sorted(added), sorted(removed)
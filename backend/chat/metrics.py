@@ -0,0 +1,201 @@
+"""
+Process-wide metrics for the realtime layer.
+
+Cheap enough to leave on in production: counters and histogram buckets are
+single dict or list updates under one uncontended lock (sync views and
+database_sync_to_async threads count too, not just the event loop).
+Gauges (open sockets, groups, channel buffers, thread-pool queues) cost
+nothing until scraped, because ``render`` reads them from the live objects.
+
+``snapshot`` returns a copy of the counters; ``render`` produces the
+Prometheus text exposition format served by ``views.prometheus_metrics``.
+"""
+import asyncio
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+PREFIX = 'yap_'
+
+# Seconds; group_send on the local layer is usually well under a millisecond
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+GROUP_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+DESCRIPTIONS = {
+    'ws_connections_opened': 'WebSocket connections accepted',
+    'ws_connections_closed': 'WebSocket connections closed after being accepted',
+    'ws_events_received': 'Frames received from clients, by type',
+    'ws_events_sent': 'Events written to sockets, by type',
+    'ws_ephemeral_dropped': 'Ephemeral events dropped from full outbound queues',
+    'ws_events_squashed': 'Superseded events removed from full outbound queues',
+    'ws_slow_consumer_disconnects': 'Sockets closed because their outbound queue overflowed',
+    'layer_channel_full': 'Channel layer deliveries dropped because a channel was full',
+    'layer_peer_dropped': 'Channel layer frames dropped because a peer process was backed up',
+    'group_send_seconds': 'Time spent in channel_layer.group_send',
+}
+
+_counters = Counter()  # name, or (name, labels), -> value
+_histograms = {}  # name -> Histogram
+_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items()))) if labels else name
+
+
+def increment(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += amount
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels=''):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}le="{bound}"}}', cumulative
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels}le="+Inf"}}', cumulative
+        yield f'{name}_sum', self.sum
+        yield f'{name}_count', cumulative
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+
+# Exposition
+
+def _labels(labels):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"')) for k, v in labels)
+
+
+def _family(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {PREFIX}{name} {help_text}')
+    lines.append(f'# TYPE {PREFIX}{name} {kind}')
+    for sample, value in samples:
+        lines.append(f'{PREFIX}{sample} {value}')
+
+
+def _counter_families(lines):
+    families = {}
+    for key, value in snapshot().items():
+        name, labels = key if isinstance(key, tuple) else (key, ())
+        families.setdefault(name, []).append((labels, value))
+    for name in sorted(families):
+        # The text format names a counter family after its samples
+        family = f'{name}_total'
+        samples = [
+            (f'{family}{{{_labels(labels)}}}' if labels else family, value)
+            for labels, value in sorted(families[name])
+        ]
+        _family(lines, family, 'counter', DESCRIPTIONS.get(name, name), samples)
+
+
+def _layer_families(lines, layer):
+    groups = getattr(layer, 'groups', None)
+    if groups is not None:
+        sizes = Histogram(GROUP_SIZE_BUCKETS)
+        for members in list(groups.values()):
+            sizes.observe(len(members))
+        _family(lines, 'channel_layer_groups', 'gauge', 'Groups with local members', [
+            ('channel_layer_groups', len(groups)),
+        ])
+        _family(lines, 'channel_layer_group_members', 'histogram', 'Local members per group',
+                sizes.samples('channel_layer_group_members'))
+
+    channels = getattr(layer, 'channels', None)
+    if channels is not None:
+        depths = [queue.qsize() for queue in list(channels.values())]
+        _family(lines, 'channel_layer_channels', 'gauge', 'Channels with a receive buffer', [
+            ('channel_layer_channels', len(depths)),
+        ])
+        _family(lines, 'channel_layer_buffered_messages', 'gauge', 'Messages waiting in channel buffers', [
+            ('channel_layer_buffered_messages', sum(depths)),
+        ])
+        _family(lines, 'channel_layer_buffer_max_occupancy', 'gauge',
+                'Fullest channel buffer as a fraction of its capacity', [
+                    ('channel_layer_buffer_max_occupancy', round(max(depths, default=0) / layer.capacity, 4)),
+                ])
+
+
+def _pending(executor):
+    """
+    Work items waiting in ``executor``. These are private attributes:
+    ``ThreadPoolExecutor`` keeps a ``_work_queue``, asgiref's
+    ``CurrentThreadExecutor`` a ``_work_items`` deque, and anything else
+    (or a future version of either) counts as 0 rather than failing the
+    scrape.
+    """
+    queue = getattr(executor, '_work_queue', None)
+    if queue is not None and hasattr(queue, 'qsize'):
+        return queue.qsize()
+    items = getattr(executor, '_work_items', None)
+    if items is not None:
+        try:
+            return len(items)
+        except TypeError:
+            return 0
+    return 0
+
+
+def _executor_queue_depths():
+    """Pending work items in the pools that run database_sync_to_async"""
+    from asgiref.sync import AsyncToSync, SyncToAsync
+
+    thread_sensitive = [getattr(SyncToAsync, 'single_thread_executor', None)]
+    thread_sensitive += list(getattr(SyncToAsync, 'context_to_thread_executor', {}).values())
+    # Copied: async_to_sync calls add and remove entries from other threads
+    thread_sensitive += list(dict(getattr(AsyncToSync, 'loop_thread_executors', {})).values())
+    depths = {'thread_sensitive': sum(_pending(executor) for executor in thread_sensitive)}
+    try:
+        default = asyncio.get_running_loop()._default_executor
+    except (RuntimeError, AttributeError):
+        default = None
+    depths['default'] = _pending(default)
+    return depths
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    from channels.layers import get_channel_layer
+
+    from .presence import registry
+
+    lines = []
+    _counter_families(lines)
+    _family(lines, 'ws_connections_open', 'gauge', 'Open authenticated WebSocket connections', [
+        ('ws_connections_open', registry.connection_count()),
+    ])
+    _family(lines, 'ws_users_online', 'gauge', 'Users with at least one open connection', [
+        ('ws_users_online', registry.online_count()),
+    ])
+    with _lock:
+        histograms = {name: list(histogram.samples(name)) for name, histogram in _histograms.items()}
+    for name in sorted(histograms):
+        _family(lines, name, 'histogram', DESCRIPTIONS.get(name, name), histograms[name])
+    _layer_families(lines, get_channel_layer())
+    _family(lines, 'sync_to_async_queue_depth', 'gauge', 'Calls waiting for a database_sync_to_async thread', [
+        (f'sync_to_async_queue_depth{{executor="{kind}"}}', depth)
+        for kind, depth in _executor_queue_depths().items()
+    ])
+    return '\n'.join(lines) + '\n'
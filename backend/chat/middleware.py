@@ -0,0 +1,54 @@
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from users.authentication import CachedJWTAuthentication
+
+# Browsers cannot set headers on a WebSocket, so the access token travels
+# either as ``?token=<jwt>`` or as the subprotocol pair ``["jwt", <jwt>]``.
+# The latter keeps the token out of URLs and access logs.
+JWT_SUBPROTOCOL = 'jwt'
+
+
+def get_token(scope):
+    subprotocols = scope.get('subprotocols') or []
+    if JWT_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(JWT_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1]
+    query = parse_qs(scope.get('query_string', b'').decode())
+    tokens = query.get('token')
+    return tokens[0] if tokens else None
+
+
+@database_sync_to_async
+def get_user(raw_token):
+    authentication = CachedJWTAuthentication()
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        return authentication.get_user(validated_token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Resolve ``scope['user']`` from a JWT access token when one is sent"""
+
+    async def __call__(self, scope, receive, send):
+        token = get_token(scope)
+        if token:
+            scope = dict(scope)
+            user = await get_user(token)
+            if user is not None:
+                scope['user'] = user
+            else:
+                scope['user'] = AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    # Session auth still applies when no token is sent (e.g. the admin)
+    return AuthMiddlewareStack(JWTAuthMiddleware(inner))
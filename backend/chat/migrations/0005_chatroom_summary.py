@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:55
+
+from django.db import migrations, models
+
+
+def backfill_summaries(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    for room in ChatRoom.objects.all().iterator():
+        last = Message.objects.filter(room=room).order_by('-id').first()
+        if last is not None:
+            room.last_message_id = last.id
+            room.last_message_preview = last.content[:255]
+            room.last_message_at = last.timestamp
+        room.member_count = room.members.count()
+        room.save(update_fields=['last_message_id', 'last_message_preview', 'last_message_at', 'member_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_room_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
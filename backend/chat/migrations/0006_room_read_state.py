@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_read_states(apps, schema_editor):
+    # is_read only said "someone else has read this", so the best available
+    # cursor for a member is the newest read message they did not send.
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    RoomReadState = apps.get_model('chat', 'RoomReadState')
+    states = []
+    for room in ChatRoom.objects.all().iterator():
+        for user_id in room.members.values_list('id', flat=True):
+            last_read = Message.objects.filter(room=room, is_read=True).exclude(
+                sender_id=user_id
+            ).aggregate(last=Max('id'))['last']
+            if last_read:
+                states.append(RoomReadState(user_id=user_id, room=room, last_read_message_id=last_read))
+    RoomReadState.objects.bulk_create(states, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_chatroom_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', '-last_read_message_id'], name='chat_readstate_room_cur_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'room'), name='chat_readstate_user_room_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
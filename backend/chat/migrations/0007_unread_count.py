@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+
+def backfill_unread_counts(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    RoomReadState = apps.get_model('chat', 'RoomReadState')
+    for room in ChatRoom.objects.all().iterator():
+        # Every member gets a row; members who never opened the room start at 0
+        RoomReadState.objects.bulk_create([
+            RoomReadState(user_id=user_id, room=room)
+            for user_id in room.members.values_list('id', flat=True)
+        ], ignore_conflicts=True)
+        for state in RoomReadState.objects.filter(room=room):
+            state.unread_count = Message.objects.filter(
+                room=room, id__gt=state.last_read_message_id
+            ).exclude(sender_id=state.user_id).count()
+            state.save(update_fields=['unread_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_room_read_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomreadstate',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
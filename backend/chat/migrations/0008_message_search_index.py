@@ -0,0 +1,58 @@
+from django.db import migrations
+
+# The DDL is frozen here as it was when this migration was written;
+# chat.search may change without changing what this migration does.
+INSTALL_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5("
+        "content, content='chat_message', content_rowid='id', tokenize='unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS chat_message_fts_ai AFTER INSERT ON chat_message BEGIN "
+        "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS chat_message_fts_ad AFTER DELETE ON chat_message BEGIN "
+        "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS chat_message_fts_au AFTER UPDATE OF content ON chat_message BEGIN "
+        "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); "
+        "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+        # Index messages written before the triggers existed
+        "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+    ],
+    'postgresql': [
+        "CREATE INDEX IF NOT EXISTS chat_message_fts_idx ON chat_message "
+        "USING GIN (to_tsvector('simple', content))",
+    ],
+}
+
+UNINSTALL_SQL = {
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS chat_message_fts_ai',
+        'DROP TRIGGER IF EXISTS chat_message_fts_ad',
+        'DROP TRIGGER IF EXISTS chat_message_fts_au',
+        'DROP TABLE IF EXISTS chat_message_fts',
+    ],
+    'postgresql': [
+        'DROP INDEX IF EXISTS chat_message_fts_idx',
+    ],
+}
+
+
+def install_search_index(apps, schema_editor):
+    for sql in INSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def uninstall_search_index(apps, schema_editor):
+    for sql in UNINSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_unread_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:49
+
+import json
+import zlib
+from collections import defaultdict
+from datetime import datetime
+
+from django.db import migrations, models
+
+
+# Frozen copies of chat.archive's block codec as of this migration, so that
+# later changes to the archive format can't change what this migration does
+
+def pack_rows(rows):
+    return zlib.compress(json.dumps([
+        [message_id, sender_id, timestamp.isoformat(), content, reactions]
+        for message_id, sender_id, timestamp, content, reactions in rows
+    ], separators=(',', ':'), ensure_ascii=False).encode())
+
+
+def unpack_rows(data):
+    rows = json.loads(zlib.decompress(bytes(data)))
+    for row in rows:
+        row[2] = datetime.fromisoformat(row[2])
+    return rows
+
+
+def merge_into(apps, room, duplicate):
+    """Move ``duplicate``'s history and read state into ``room``"""
+    Message = apps.get_model('chat', 'Message')
+    MessageArchive = apps.get_model('chat', 'MessageArchive')
+    RoomReadState = apps.get_model('chat', 'RoomReadState')
+
+    Message.objects.filter(room=duplicate).update(room=room)
+
+    for block in MessageArchive.objects.filter(room=duplicate):
+        existing = MessageArchive.objects.filter(room=room, day=block.day).first()
+        if existing is None:
+            block.room = room
+            block.save(update_fields=['room'])
+            continue
+        rows = sorted(unpack_rows(existing.data) + unpack_rows(block.data), key=lambda row: (row[2], row[0]))
+        existing.data = pack_rows(rows)
+        existing.message_count = len(rows)
+        existing.first_timestamp = rows[0][2]
+        existing.last_timestamp = rows[-1][2]
+        existing.save()
+        block.delete()
+
+    states = {state.user_id: state for state in RoomReadState.objects.filter(room=room)}
+    for other in RoomReadState.objects.filter(room=duplicate):
+        state = states.get(other.user_id)
+        if state is not None:
+            state.last_read_message_id = max(state.last_read_message_id, other.last_read_message_id)
+    # The two histories interleave, so count again from the merged cursor
+    for state in states.values():
+        state.unread_count = Message.objects.filter(
+            room=room, id__gt=state.last_read_message_id
+        ).exclude(sender_id=state.user_id).count()
+        state.save(update_fields=['last_read_message_id', 'unread_count'])
+
+    if (duplicate.last_message_id or 0) > (room.last_message_id or 0):
+        room.last_message_id = duplicate.last_message_id
+        room.last_message_preview = duplicate.last_message_preview
+        room.last_message_at = duplicate.last_message_at
+    if duplicate.archived_until and (room.archived_until is None or duplicate.archived_until > room.archived_until):
+        room.archived_until = duplicate.archived_until
+    room.save()
+    duplicate.delete()
+
+
+def backfill_direct_keys(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    members = defaultdict(list)
+    for room_id, user_id in ChatRoom.members.through.objects.filter(
+        chatroom__type='DIRECT'
+    ).values_list('chatroom_id', 'user_id'):
+        members[room_id].append(user_id)
+
+    rooms_by_key = defaultdict(list)
+    for room_id, user_ids in members.items():
+        # A DIRECT room with one member is a user's chat with themself
+        if len(user_ids) in (1, 2):
+            low, high = min(user_ids), max(user_ids)
+            rooms_by_key[f'{low}:{high}'].append(room_id)
+
+    for key, room_ids in rooms_by_key.items():
+        # Keep the oldest room of a pair and fold any later ones into it
+        room_ids.sort()
+        room = ChatRoom.objects.get(pk=room_ids[0])
+        for duplicate in ChatRoom.objects.filter(pk__in=room_ids[1:]).order_by('pk'):
+            merge_into(apps, room, duplicate)
+        room.direct_key = key
+        room.save(update_fields=['direct_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='direct_key',
+            field=models.CharField(blank=True, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_direct_keys, migrations.RunPython.noop),
+    ]
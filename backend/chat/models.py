@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
+from django.utils import timezone
+
+PREVIEW_LENGTH = 255
 
 class ChatRoom(models.Model):
     ROOM_TYPES = (
@@ -12,19 +15,75 @@ class ChatRoom(models.Model):
     is_paid = models.BooleanField(default=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    # Denormalized summary, kept current by chat.signals so the room list
+    # never has to look at the message table.
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    member_count = models.PositiveIntegerField(default=0)
+    # Timestamp of the newest archived message (chat.archive); null while
+    # the whole history is in chat_message, so reads skip the archive.
+    archived_until = models.DateTimeField(null=True, blank=True)
+    # "<lower user id>:<higher user id>" for DIRECT rooms, null for groups;
+    # unique, so there is one room per pair (see get_or_create_direct)
+    direct_key = models.CharField(max_length=41, null=True, blank=True, unique=True)
     
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def direct_key_for(user_id, other_user_id):
+        low, high = sorted((int(user_id), int(other_user_id)))
+        return f'{low}:{high}'
+
+    @classmethod
+    def get_or_create_direct(cls, user_id, other_user_id):
+        """
+        The DIRECT room between two users, created with both as members if
+        there is none; returns ``(room, created)``. Safe against concurrent
+        calls for the same pair: the loser of the insert reads the winner's
+        room.
+        """
+        key = cls.direct_key_for(user_id, other_user_id)
+        room = cls.objects.filter(direct_key=key).first()
+        if room is not None:
+            return room, False
+        try:
+            with transaction.atomic():
+                room = cls.objects.create(type='DIRECT', name='Chat', direct_key=key)
+                room.members.add(user_id, other_user_id)
+        except IntegrityError:
+            return cls.objects.get(direct_key=key), False
+        return room, True
+
+    @classmethod
+    def record_message(cls, message):
+        """Move the room summary forward to ``message`` (never backwards)"""
+        cls.objects.filter(pk=message.room_id).filter(
+            models.Q(last_message_id__isnull=True) | models.Q(last_message_id__lt=message.id)
+        ).update(
+            last_message_id=message.id,
+            last_message_preview=message.content[:PREVIEW_LENGTH],
+            last_message_at=message.timestamp,
+        )
+
+    def refresh_member_count(self):
+        self.member_count = self.members.count()
+        ChatRoom.objects.filter(pk=self.pk).update(member_count=self.member_count)
+
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination over a room's history
+            models.Index(fields=['room', 'timestamp', 'id'], name='chat_msg_room_ts_id_idx'),
+        ]
 
     def __str__(self):
         return f'{self.sender.username}: {self.content[:50]}'
@@ -40,3 +99,123 @@ class Reaction(models.Model):
     
     def __str__(self):
         return f'{self.user.username} {self.emoji} on {self.message.id}'
+
+class MessageArchive(models.Model):
+    """
+    One room's messages for one (local) day, with their reactions, moved out
+    of chat_message into a single compressed block by ``archive_messages``.
+    See chat.archive for the format.
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archives')
+    day = models.DateField()
+    message_count = models.PositiveIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'day'], name='chat_archive_room_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.room_id} {self.day} ({self.message_count} messages)'
+
+class RoomReadState(models.Model):
+    """
+    Per-member read cursor: everything in ``room`` up to and including
+    ``last_read_message_id`` has been read by ``user``.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='read_states')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    # Materialized count of messages from others after the cursor; kept
+    # current on write and reset on read, rebuilt by rebuild_unread_counts.
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room'], name='chat_readstate_user_room_uniq'),
+        ]
+        indexes = [
+            # Furthest cursors in a room, for computing "read by"
+            models.Index(fields=['room', '-last_read_message_id'], name='chat_readstate_room_cur_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} read {self.room_id} up to {self.last_read_message_id}'
+
+    @classmethod
+    def join(cls, room, user_ids):
+        """Create read state for new members, starting at the current message"""
+        cls.objects.bulk_create([
+            cls(user_id=user_id, room=room, last_read_message_id=room.last_message_id or 0)
+            for user_id in user_ids
+        ], ignore_conflicts=True)
+
+    @classmethod
+    def leave(cls, room_id, user_ids):
+        cls.objects.filter(room_id=room_id, user_id__in=user_ids).delete()
+
+    @classmethod
+    def mark_read(cls, user, room, message_id):
+        """
+        Advance ``user``'s cursor in ``room`` and reset their unread count;
+        returns True if the cursor moved.
+        """
+        if message_id >= (room.last_message_id or 0):
+            unread = 0
+        else:
+            unread = room.messages.filter(id__gt=message_id).exclude(sender=user).count()
+        if cls.objects.filter(user=user, room=room, last_read_message_id__lt=message_id).update(
+            last_read_message_id=message_id, unread_count=unread, updated_at=timezone.now()
+        ):
+            return True
+        _, created = cls.objects.get_or_create(
+            user=user, room=room, defaults={'last_read_message_id': message_id, 'unread_count': unread}
+        )
+        return created
+
+    @classmethod
+    def record_messages(cls, room_id, sender_counts):
+        """
+        Count new messages as unread for every member but their sender, in
+        one UPDATE. ``sender_counts`` maps sender id to messages written.
+        """
+        total = sum(sender_counts.values())
+        own = models.Case(
+            *[models.When(user_id=sender_id, then=count) for sender_id, count in sender_counts.items()],
+            default=0,
+        )
+        cls.objects.filter(room_id=room_id).update(
+            unread_count=models.F('unread_count') + total - own
+        )
+
+    @classmethod
+    def unread_for(cls, user_id, room_id):
+        """One member's current count in a room"""
+        return cls.objects.filter(user_id=user_id, room_id=room_id).values_list('unread_count', flat=True).first() or 0
+
+    @classmethod
+    def horizon(cls, room_id):
+        """
+        The two furthest read cursors in a room as ``[(user_id, message_id)]``.
+
+        A message counts as read once any member other than its sender has
+        read past it, and two cursors are enough to answer that for every
+        sender; see :func:`is_read`.
+        """
+        return list(
+            cls.objects.filter(room_id=room_id)
+            .order_by('-last_read_message_id')
+            .values_list('user_id', 'last_read_message_id')[:2]
+        )
+
+
+def is_read(horizon, message_id, sender_id):
+    for user_id, last_read in horizon:
+        if user_id != sender_id:
+            return last_read >= message_id
+    return False
@@ -0,0 +1,76 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(message):
+    """Encode a message's (timestamp, id) position as an opaque cursor"""
+    raw = f'{message.timestamp.isoformat()}|{message.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, message_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor('Invalid limit')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def paginate_messages(queryset, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Keyset pagination over (timestamp, id).
+
+    Without a cursor the newest page is returned. ``before`` walks back
+    through older history, ``after`` walks forward towards the present.
+    Results are always returned oldest first, together with the cursors
+    for the neighbouring pages (``None`` when there is nothing more).
+    """
+    if after:
+        timestamp, message_id = decode_cursor(after)
+        queryset = queryset.filter(
+            Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+        ).order_by('timestamp', 'id')
+        page = list(queryset[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        return {
+            'results': page,
+            'before': encode_cursor(page[0]) if page else after,
+            'after': encode_cursor(page[-1]) if has_more else None,
+        }
+
+    if before:
+        timestamp, message_id = decode_cursor(before)
+        queryset = queryset.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+        )
+    queryset = queryset.order_by('-timestamp', '-id')
+    page = list(queryset[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return {
+        'results': page,
+        'before': encode_cursor(page[0]) if has_more else None,
+        'after': encode_cursor(page[-1]) if page and before else None,
+    }
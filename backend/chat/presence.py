@@ -0,0 +1,211 @@
+"""
+In-memory presence: who has a socket open, per user and per room.
+
+The registry counts connections, so a user with three tabs on a room stays
+online until the last one closes. Every lookup is a dict access; nothing
+here touches the database. Sockets that die without a close frame are
+expired once they have not been heard from for ``CHAT_PRESENCE_TTL``
+seconds (clients send a ``heartbeat`` frame well within that).
+
+Room groups are told about changes through ``presence.changed`` events
+that are coalesced per room over ``CHAT_PRESENCE_COALESCE`` seconds, so a
+page reload (offline then online again) sends nothing at all.
+
+The registry belongs to one process. With several workers each one knows
+about the sockets it serves, and publishes its online user count every
+``CHAT_PRESENCE_PUBLISH_INTERVAL`` seconds (when it changed) to a stats
+counter, where the dashboard adds up the workers' counts.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from django.conf import settings
+
+from stats import counters
+
+from . import events
+
+logger = logging.getLogger(__name__)
+
+# Names this process's counter; unique per worker, and short enough for Counter.name
+NODE = f'{socket.gethostname()[:40]}.{os.getpid()}'
+
+
+def _ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+
+
+def _coalesce_interval():
+    return getattr(settings, 'CHAT_PRESENCE_COALESCE', 1.0)
+
+
+def _publish_interval():
+    return getattr(settings, 'CHAT_PRESENCE_PUBLISH_INTERVAL', 5.0)
+
+
+class PresenceRegistry:
+    def __init__(self):
+        self._connections = {}  # channel name -> [user id, room id, last seen]
+        self._users = {}  # user id -> open connections
+        self._rooms = {}  # room id -> {user id: open connections}
+
+    def connect(self, channel_name, user_id, room_id):
+        """Register a socket; returns True if the user just came online in the room"""
+        self._connections[channel_name] = [user_id, room_id, time.monotonic()]
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        room = self._rooms.setdefault(room_id, {})
+        room[user_id] = room.get(user_id, 0) + 1
+        return room[user_id] == 1
+
+    def disconnect(self, channel_name):
+        """
+        Forget a socket. Returns ``(user_id, room_id, left_room)``, or None if
+        the socket was not registered (e.g. it has already expired).
+        """
+        entry = self._connections.pop(channel_name, None)
+        if entry is None:
+            return None
+        user_id, room_id, _ = entry
+        if self._users[user_id] == 1:
+            del self._users[user_id]
+        else:
+            self._users[user_id] -= 1
+        room = self._rooms[room_id]
+        left_room = room[user_id] == 1
+        if left_room:
+            del room[user_id]
+            if not room:
+                del self._rooms[room_id]
+        else:
+            room[user_id] -= 1
+        return user_id, room_id, left_room
+
+    def touch(self, channel_name):
+        entry = self._connections.get(channel_name)
+        if entry is not None:
+            entry[2] = time.monotonic()
+
+    def expired(self, ttl=None):
+        """Channel names of sockets not heard from within ``ttl`` seconds"""
+        deadline = time.monotonic() - (ttl if ttl is not None else _ttl())
+        return [name for name, (_, _, seen) in self._connections.items() if seen < deadline]
+
+    def is_online(self, user_id):
+        return user_id in self._users
+
+    def online_count(self):
+        return len(self._users)
+
+    def connection_count(self):
+        return len(self._connections)
+
+    def online_in_room(self, room_id):
+        """The ids of users with a socket on ``room_id`` (a live view; copy before mutating)"""
+        return self._rooms.get(room_id, {}).keys()
+
+
+registry = PresenceRegistry()
+
+
+class PresenceNotifier:
+    """Coalesces per-room online/offline transitions into one event per interval"""
+
+    def __init__(self, interval=None, channel_layer=None):
+        self.interval = interval if interval is not None else _coalesce_interval()
+        self.channel_layer = channel_layer
+        self._pending = {}  # room id -> {user id: [was online, is online]}
+        self._timer = None
+
+    def changed(self, room_id, user_id, online):
+        room = self._pending.setdefault(room_id, {})
+        if user_id in room:
+            room[user_id][1] = online
+        else:
+            room[user_id] = [not online, online]
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        pending, self._pending = self._pending, {}
+        asyncio.ensure_future(self._flush(pending))
+
+    async def _flush(self, pending):
+        for room_id, users in pending.items():
+            online = [user_id for user_id, (was, now) in users.items() if now and not was]
+            offline = [user_id for user_id, (was, now) in users.items() if was and not now]
+            if online or offline:
+                await events.broadcast(events.presence_changed(room_id, online, offline), self.channel_layer)
+
+
+class PresenceSweeper:
+    """Periodically expires sockets that stopped sending heartbeats"""
+
+    def __init__(self, notifier, channel_layer):
+        self.notifier = notifier
+        self.channel_layer = channel_layer
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(_ttl() / 2)
+            for channel_name in registry.expired():
+                gone = registry.disconnect(channel_name)
+                if gone is None:
+                    continue
+                user_id, room_id, left_room = gone
+                if left_room:
+                    self.notifier.changed(room_id, user_id, online=False)
+                # Close the socket too, in case it is merely silent
+                try:
+                    await self.channel_layer.send(channel_name, {'type': 'presence.expired'})
+                except (ChannelFull, OSError):
+                    # Backed up, or its worker is gone; it is forgotten either way
+                    logger.warning('Could not close expired socket %s', channel_name, exc_info=True)
+
+
+class PresencePublisher:
+    """Periodically publishes this process's online user count (see stats.counters)"""
+
+    def __init__(self):
+        self._published = None
+        self._refresh_at = 0
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(_publish_interval())
+            count = registry.online_count()
+            # An unchanged count is published again before it expires
+            if count == self._published and time.monotonic() < self._refresh_at:
+                continue
+            try:
+                await database_sync_to_async(counters.put_online_users)(NODE, count, _ttl())
+            except Exception:
+                logger.exception('Could not publish the online user count')
+                continue
+            self._published = count
+            self._refresh_at = time.monotonic() + _ttl() / 2
+
+
+_notifiers = {}
+
+
+def get_notifier(channel_layer=None):
+    """Return the notifier for the running event loop, starting its sweeper"""
+    loop = asyncio.get_running_loop()
+    notifier = _notifiers.get(loop)
+    if notifier is None:
+        # Drop notifiers left behind by closed loops (e.g. in tests)
+        for stale in [l for l in _notifiers if l.is_closed()]:
+            del _notifiers[stale]
+        notifier = _notifiers[loop] = PresenceNotifier(channel_layer=channel_layer)
+        if channel_layer is not None:
+            notifier.sweeper = PresenceSweeper(notifier, channel_layer)
+            notifier.publisher = PresencePublisher()
+    return notifier
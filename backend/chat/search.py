@@ -0,0 +1,180 @@
+"""
+Indexed full-text search over chat messages.
+
+One interface, two engines:
+
+* SQLite: an external-content FTS5 table (``chat_message_fts``) kept in sync
+  by triggers on ``chat_message``, ranked with ``bm25``.
+* PostgreSQL: a GIN index on ``to_tsvector('simple', content)``, ranked with
+  ``ts_rank_cd``. The index is maintained by PostgreSQL itself.
+
+Other databases fall back to an unindexed, unranked scan that matches every
+word with ``icontains``; it answers correctly but reads the user's messages
+in full, so it is meant for development rather than production.
+
+Because both are maintained by the database, every insert path (including
+``bulk_create``) and every delete (including cascades) keeps the index
+current. Results are ordered by ``score`` (lower is better) and then by id,
+which is also the keyset used for the cursor.
+"""
+import base64
+import re
+
+from django.db import connection
+
+from .models import ChatRoom, Message
+from .pagination import InvalidCursor
+
+FTS_TABLE = 'chat_message_fts'
+PG_INDEX = 'chat_message_fts_idx'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def encode_cursor(score, message_id):
+    return base64.urlsafe_b64encode(f'{score!r}|{message_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        score, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return float(score), int(message_id)
+    except (ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+class SearchBackend:
+    """
+    Ranked search over a database's full-text engine. Subclasses provide
+    ``_query`` (user text to the engine's query syntax) and ``_ranked_sql``
+    (SQL selecting ``id, room_id, score`` for params ``(query, user_id)``).
+    """
+
+    def search(self, user_id, text, room_id=None, cursor=None, limit=20):
+        """
+        Return ``(ids_with_scores, next_cursor)`` for messages matching
+        ``text`` in rooms that ``user_id`` belongs to.
+        """
+        query = self._query(text)
+        if not query:
+            return [], None
+        sql = self._ranked_sql()
+        params = [query, user_id]
+        filters = []
+        if room_id is not None:
+            filters.append('ranked.room_id = %s')
+            params.append(room_id)
+        if cursor:
+            score, message_id = decode_cursor(cursor)
+            filters.append('(ranked.score > %s OR (ranked.score = %s AND ranked.id > %s))')
+            params.extend([score, score, message_id])
+        where = f"WHERE {' AND '.join(filters)}" if filters else ''
+        with connection.cursor() as c:
+            c.execute(
+                f'SELECT ranked.id, ranked.score FROM ({sql}) ranked {where} '
+                f'ORDER BY ranked.score, ranked.id LIMIT %s',
+                params + [limit + 1],
+            )
+            rows = c.fetchall()
+        next_cursor = encode_cursor(*rows[limit - 1][::-1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+
+class SQLiteFTSBackend(SearchBackend):
+    def reindex(self, batch_size=10000, progress=None):
+        with connection.cursor() as c:
+            c.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+            last_id = 0
+            while True:
+                c.execute(
+                    'SELECT MAX(id) FROM (SELECT id FROM chat_message WHERE id > %s ORDER BY id LIMIT %s)',
+                    [last_id, batch_size],
+                )
+                upper = c.fetchone()[0]
+                if upper is None:
+                    break
+                c.execute(
+                    f'INSERT INTO {FTS_TABLE}(rowid, content) '
+                    f'SELECT id, content FROM chat_message WHERE id > %s AND id <= %s',
+                    [last_id, upper],
+                )
+                last_id = upper
+                if progress:
+                    progress(last_id)
+            c.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+    def _query(self, text):
+        # Quote every token so user input can't use FTS5 syntax; the last
+        # token is a prefix match to support search-as-you-type.
+        tokens = _TOKEN_RE.findall(text)
+        if not tokens:
+            return ''
+        quoted = ['"%s"' % token.replace('"', '""') for token in tokens]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def _ranked_sql(self):
+        return (
+            f'SELECT m.id AS id, m.room_id AS room_id, bm25({FTS_TABLE}) AS score '
+            f'FROM {FTS_TABLE} JOIN chat_message m ON m.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s AND m.room_id IN '
+            f'(SELECT chatroom_id FROM chat_chatroom_members WHERE user_id = %s)'
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    def reindex(self, batch_size=10000, progress=None):
+        # The index is derived from the column, so rebuilding it is the
+        # whole job; PostgreSQL does it without reading rows into Python.
+        with connection.cursor() as c:
+            c.execute(f'REINDEX INDEX {PG_INDEX}')
+
+    def _query(self, text):
+        tokens = _TOKEN_RE.findall(text)
+        if not tokens:
+            return ''
+        tokens[-1] += ':*'
+        return ' & '.join(tokens)
+
+    def _ranked_sql(self):
+        return (
+            "SELECT m.id AS id, m.room_id AS room_id, "
+            "-ts_rank_cd(to_tsvector('simple', m.content), q.query) AS score "
+            "FROM chat_message m, to_tsquery('simple', %s) AS q(query) "
+            "WHERE to_tsvector('simple', m.content) @@ q.query AND m.room_id IN "
+            "(SELECT chatroom_id FROM chat_chatroom_members WHERE user_id = %s)"
+        )
+
+
+class ContainsSearchBackend:
+    """Fallback for databases without a full-text engine: no index, no ranking"""
+
+    def search(self, user_id, text, room_id=None, cursor=None, limit=20):
+        tokens = _TOKEN_RE.findall(text)
+        if not tokens:
+            return [], None
+        messages = Message.objects.filter(
+            room_id__in=ChatRoom.members.through.objects.filter(user_id=user_id).values('chatroom_id')
+        )
+        for token in tokens:
+            messages = messages.filter(content__icontains=token)
+        if room_id is not None:
+            messages = messages.filter(room_id=room_id)
+        if cursor:
+            # Every score is 0, so the id alone is the keyset
+            _, message_id = decode_cursor(cursor)
+            messages = messages.filter(id__gt=message_id)
+        rows = [(message_id, 0.0) for message_id in messages.order_by('id').values_list('id', flat=True)[:limit + 1]]
+        next_cursor = encode_cursor(*rows[limit - 1][::-1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    vendor = vendor or connection.vendor
+    return BACKENDS.get(vendor, ContainsSearchBackend)()
@@ -1,6 +1,8 @@
+from django.db.models import F
 from rest_framework import serializers
-from .models import ChatRoom, Message, Reaction
+from .models import ChatRoom, Message, Reaction, RoomReadState, is_read
 from users.serializers import UserSerializer
+from yap_project.timing import timed
 
 class ReactionSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -12,12 +14,19 @@ class ReactionSerializer(serializers.ModelSerializer):
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     reactions = serializers.SerializerMethodField()
+    is_read = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ['id', 'sender', 'room', 'content', 'timestamp', 'is_read', 'reactions']
         read_only_fields = ['timestamp']
     
+    def get_is_read(self, obj):
+        horizon = self.context.get('read_horizon')
+        if horizon is None:
+            horizon = RoomReadState.horizon(obj.room_id)
+        return is_read(horizon, obj.id, obj.sender_id)
+
     def get_reactions(self, obj):
         # Group reactions by emoji
         reactions_data = {}
@@ -42,35 +51,114 @@ class MessageSerializer(serializers.ModelSerializer):
         
         return list(reactions_data.values())
 
+
+_timestamp_field = serializers.DateTimeField()
+
+def summarize_reactions(rows, user_id=None):
+    """
+    Group reaction rows (dicts with message_id, emoji, user_id, username)
+    into per-message summaries in a single pass.
+    """
+    summaries = {}
+    for row in rows:
+        by_emoji = summaries.setdefault(row['message_id'], {})
+        group = by_emoji.get(row['emoji'])
+        if group is None:
+            group = by_emoji[row['emoji']] = {
+                'emoji': row['emoji'],
+                'count': 0,
+                'users': [],
+                'user_reacted': False
+            }
+        group['count'] += 1
+        group['users'].append({'id': row['user_id'], 'username': row['username']})
+        if row['user_id'] == user_id:
+            group['user_reacted'] = True
+    return {message_id: list(by_emoji.values()) for message_id, by_emoji in summaries.items()}
+
+def fetch_reactions(message_ids, user_id=None):
+    """Load and group the reactions for many messages with one query"""
+    rows = Reaction.objects.filter(message_id__in=message_ids).order_by('id').values(
+        'message_id', 'emoji', 'user_id', username=F('user__username')
+    )
+    return summarize_reactions(rows, user_id)
+
+@timed('serialize')
+def serialize_messages(messages, user=None, reactions=None, read_horizon=None):
+    """
+    Bulk equivalent of ``MessageSerializer(messages, many=True).data``.
+
+    ``messages`` should be fetched with ``select_related('sender')``; the
+    reactions for the whole page are loaded with one extra query, so a page
+    costs a constant number of queries regardless of its size. Pass
+    ``reactions={}`` for messages that were just created.
+
+    ``is_read`` is computed from ``read_horizon`` (see
+    ``RoomReadState.horizon``); without one every message is unread.
+    """
+    messages = list(messages)
+    user_id = user.id if user is not None else None
+    if reactions is None:
+        reactions = fetch_reactions([m.id for m in messages], user_id) if messages else {}
+    senders = {}
+    data = []
+    for message in messages:
+        sender = senders.get(message.sender_id)
+        if sender is None:
+            u = message.sender
+            sender = senders[message.sender_id] = {
+                'id': u.id,
+                'username': u.username,
+                'email': u.email,
+                'role': u.role,
+                'status': u.status,
+                'is_approved': u.is_approved,
+            }
+        data.append({
+            'id': message.id,
+            'sender': sender,
+            'room': message.room_id,
+            'content': message.content,
+            'timestamp': _timestamp_field.to_representation(message.timestamp),
+            'is_read': is_read(read_horizon, message.id, message.sender_id) if read_horizon else False,
+            'reactions': reactions.get(message.id, []),
+        })
+    return data
+
 class ChatRoomSerializer(serializers.ModelSerializer):
-    last_message = serializers.SerializerMethodField()
+    last_message = serializers.CharField(source='last_message_preview', read_only=True)
     members = UserSerializer(many=True, read_only=True)
     display_name = serializers.SerializerMethodField()
     
-    last_message_time = serializers.SerializerMethodField()
+    last_message_time = serializers.DateTimeField(source='last_message_at', read_only=True)
     
     class Meta:
         model = ChatRoom
-        fields = ['id', 'name', 'display_name', 'type', 'is_paid', 'price', 'members', 'last_message', 'last_message_time', 'created_at']
-    
-    def get_last_message(self, obj):
-        last_msg = obj.messages.order_by('-timestamp').first()
-        if last_msg:
-            return last_msg.content
-        return None
+        fields = ['id', 'name', 'display_name', 'type', 'is_paid', 'price', 'members', 'member_count', 'last_message_id', 'last_message', 'last_message_time', 'created_at']
+        read_only_fields = ['member_count', 'last_message_id']
 
-    def get_last_message_time(self, obj):
-        last_msg = obj.messages.order_by('-timestamp').first()
-        if last_msg:
-            return last_msg.timestamp
-        return None
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.last_message_id is None:
+            data['last_message'] = None
+        return data
     
     def get_display_name(self, obj):
         # For direct chats, show the other user's name
         if obj.type == 'DIRECT':
+            # Annotated by ChatRoomViewSet.get_queryset for list views
+            if hasattr(obj, 'other_member_name'):
+                return obj.other_member_name or obj.name
             request = self.context.get('request')
             if request and request.user:
                 other_user = obj.members.exclude(id=request.user.id).first()
                 if other_user:
                     return other_user.username
         return obj.name
+
+class ChatRoomListSerializer(ChatRoomSerializer):
+    """Room list entry: served from the denormalized summary, without members"""
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta(ChatRoomSerializer.Meta):
+        fields = [f for f in ChatRoomSerializer.Meta.fields if f != 'members'] + ['unread_count']
@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import Signal, receiver
+
+from . import events
+from .models import ChatRoom, Message, RoomReadState
+
+# Sent with ``messages=[...]`` after new messages are saved, whether one at a
+# time or through bulk_create (which does not send post_save).
+messages_created = Signal()
+
+
+@receiver(post_save, sender=Message)
+def update_room_summary(sender, instance, created, **kwargs):
+    if created:
+        ChatRoom.record_message(instance)
+        RoomReadState.record_messages(instance.room_id, {instance.sender_id: 1})
+        messages_created.send(sender=Message, messages=[instance])
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def update_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    # Forward: instance is the room and pk_set the users.
+    # Reverse (user.chat_rooms.add(...)): instance is the user, pk_set the rooms.
+    if action == 'pre_clear':
+        # Clears don't report pk_set; remember what is about to go
+        related = instance.chat_rooms if reverse else instance.members
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', set())
+
+    if reverse:
+        memberships = [(room, [instance.pk]) for room in ChatRoom.objects.filter(pk__in=pk_set)]
+    else:
+        memberships = [(instance, pk_set)]
+
+    for room, user_ids in memberships:
+        if action == 'post_add':
+            RoomReadState.join(room, user_ids)
+        else:
+            RoomReadState.leave(room.pk, user_ids)
+        room.refresh_member_count()
+        # Connected sockets of these users join or leave the room's inbox
+        joined = action == 'post_add'
+        transaction.on_commit(lambda room_id=room.pk, user_ids=list(user_ids): events.update_inboxes_sync(
+            room_id, added=user_ids if joined else (), removed=() if joined else user_ids,
+        ))
@@ -0,0 +1,625 @@
+import asyncio
+import importlib
+import json
+import sqlite3
+import tempfile
+import threading
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.db import IntegrityError, connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from chat import backpressure, ephemeral, events, metrics, presence, writebehind
+from chat.consumers import ChatConsumer
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+from chat.layers import MAX_DATAGRAM, UnixSocketChannelLayer
+from chat.membership import update_members
+from chat.models import PREVIEW_LENGTH, ChatRoom, Message, RoomReadState, is_read
+from chat.pagination import InvalidCursor, paginate_messages
+from chat.search import ContainsSearchBackend, SQLiteFTSBackend, get_backend
+from chat.signals import messages_created
+from users.models import User
+
+
+@override_settings(METRICS_TOKEN=None, METRICS_ALLOW_LOCALHOST=True, ALLOWED_HOSTS=['testserver'])
+class PrometheusMetricsTests(SimpleTestCase):
+    """Scrape /api/chat/metrics/ the way Prometheus would"""
+
+    def scrape(self):
+        # Client defaults to REMOTE_ADDR 127.0.0.1, which is let in without a token
+        return Client().get('/api/chat/metrics/')
+
+    def test_scrape(self):
+        metrics.increment('ws_events_received', type='message')
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE yap_ws_connections_open gauge', body)
+        self.assertIn('yap_sync_to_async_queue_depth{executor="thread_sensitive"}', body)
+        # Counter families are named after their samples
+        self.assertRegex(
+            body,
+            r'# TYPE yap_ws_events_received_total counter\n'
+            r'yap_ws_events_received_total\{type="message"\} \d+\n',
+        )
+
+    def test_token_required_by_default(self):
+        with self.settings(METRICS_ALLOW_LOCALHOST=False):
+            self.assertEqual(self.scrape().status_code, 403)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.scrape().status_code, 403)
+            response = Client().get('/api/chat/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+    def test_scrape_during_async_to_sync(self):
+        # AsyncToSync registers a CurrentThreadExecutor for the duration of
+        # the call, which the queue-depth gauge has to be able to read
+        async def scrape_from_loop():
+            return await sync_to_async(self.scrape)()
+
+        response = async_to_sync(scrape_from_loop)()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('yap_sync_to_async_queue_depth', response.content.decode())
+
+
+class CrossProcessLayerTests(SimpleTestCase):
+    """Two layers on one directory stand in for two worker processes"""
+
+    def test_delivery_between_layers(self):
+        async def run():
+            path = tempfile.mkdtemp()
+            sender, receiver = UnixSocketChannelLayer(path=path), UnixSocketChannelLayer(path=path)
+            channel = await receiver.new_channel()
+
+            async def receive(timeout=2):
+                return await asyncio.wait_for(receiver.receive(channel), timeout)
+
+            try:
+                await receiver.group_add('room_1', channel)
+                pending = asyncio.ensure_future(receive())
+                await asyncio.sleep(0.05)  # receive() tells the layer which loop to deliver on
+                await sender.group_send('room_1', {'type': 'chat.message', 'n': 1})
+                self.assertEqual(await pending, {'type': 'chat.message', 'n': 1})
+
+                await sender.send(channel, {'type': 'chat.message', 'n': 2})
+                self.assertEqual(await receive(), {'type': 'chat.message', 'n': 2})
+
+                # Too big for one datagram: a direct send reports it, a group send drops it
+                huge = {'type': 'chat.message', 'text': 'x' * MAX_DATAGRAM}
+                with self.assertRaises(ChannelFull):
+                    await sender.send(channel, huge)
+                await sender.group_send('room_1', huge)
+                with self.assertRaises(asyncio.TimeoutError):
+                    await receive(0.2)
+
+                await receiver.group_discard('room_1', channel)
+                await sender.group_send('room_1', {'type': 'chat.message', 'n': 3})
+                with self.assertRaises(asyncio.TimeoutError):
+                    await receive(0.2)
+            finally:
+                await sender.close()
+                await receiver.close()
+
+        with self.assertLogs('chat.layers', 'WARNING'):
+            async_to_sync(run)()
+
+
+class LayerSignalTests(SimpleTestCase):
+    def test_broadcast_reaches_other_layers_only(self):
+        # Two layers on one directory stand in for two worker processes
+        path = tempfile.mkdtemp()
+        sender, receiver = UnixSocketChannelLayer(path=path), UnixSocketChannelLayer(path=path)
+        received, own = [], []
+        arrived = threading.Event()
+
+        def handle(payload):
+            received.append(payload)
+            arrived.set()
+
+        receiver.on_signal('test', handle)
+        sender.on_signal('test', own.append)
+        sender.broadcast_signal('test', ['15'])
+        self.assertTrue(arrived.wait(2))
+        self.assertEqual(received, [['15']])
+        self.assertEqual(own, [])
+        async_to_sync(sender.close)()
+        async_to_sync(receiver.close)()
+
+
+def _has_fts5():
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(content)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+@skipUnless(_has_fts5(), 'needs SQLite with FTS5')
+class SQLiteFTSSearchTests(TestCase):
+    def test_index_follows_writes(self):
+        user = User.objects.create(username='reader')
+        room = ChatRoom.objects.create(name='a', type='GROUP')
+        room.members.add(user)
+        kept = Message.objects.create(room=room, sender=user, content='The quarterly report is ready')
+        gone = Message.objects.create(room=room, sender=user, content='Draft report, ignore')
+
+        backend = SQLiteFTSBackend()
+        self.assertEqual({row[0] for row in backend.search(user.id, 'report')[0]}, {kept.id, gone.id})
+        # The last word is a prefix, for search-as-you-type
+        self.assertEqual([row[0] for row in backend.search(user.id, 'quart')[0]], [kept.id])
+        gone.delete()
+        self.assertEqual([row[0] for row in backend.search(user.id, 'report')[0]], [kept.id])
+        self.assertEqual(backend.search(User.objects.create(username='outsider').id, 'report')[0], [])
+
+
+class ContainsSearchTests(TestCase):
+    def test_unsupported_database_falls_back(self):
+        self.assertIsInstance(get_backend('mysql'), ContainsSearchBackend)
+
+    def test_search(self):
+        user, other = User.objects.create(username='reader'), User.objects.create(username='other')
+        room, hidden = ChatRoom.objects.create(name='a', type='GROUP'), ChatRoom.objects.create(name='b', type='GROUP')
+        room.members.add(user)
+        hidden.members.add(other)
+        first = Message.objects.create(room=room, sender=user, content='Deploy went fine')
+        second = Message.objects.create(room=room, sender=user, content='deployment is done')
+        Message.objects.create(room=room, sender=user, content='deploy failed')
+        Message.objects.create(room=hidden, sender=other, content='deploy done')
+
+        backend = ContainsSearchBackend()
+        rows, cursor = backend.search(user.id, 'deploy', limit=1)
+        self.assertEqual(rows, [(first.id, 0.0)])
+        rows, _ = backend.search(user.id, 'deploy', cursor=cursor, limit=1)
+        self.assertEqual(rows, [(second.id, 0.0)])
+        rows, _ = backend.search(user.id, 'DONE deploy')
+        self.assertEqual(rows, [(second.id, 0.0)])
+
+
+# Transactional: SQLite checks foreign keys at commit, and
+# database_sync_to_async closes the connection inside an atomic block
+class WriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'writer{i}') for i in range(3)]
+        self.room = ChatRoom.objects.create(name='busy', type='GROUP')
+        self.room.members.add(*self.users)
+
+    def messages(self, count, room_id=None):
+        return [
+            Message(sender=self.users[i % 3], room_id=room_id or self.room.id, content=f'message {i}')
+            for i in range(count)
+        ]
+
+    def write(self, messages):
+        with CaptureQueriesContext(connection) as ctx:
+            results, written = writebehind.write_messages(messages)
+        other = [q for q in ctx.captured_queries if not q['sql'].startswith('INSERT INTO "chat_message"')]
+        return results, written, len(other)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        created = []
+        messages_created.connect(lambda messages, **kwargs: created.extend(messages), weak=False, dispatch_uid='t')
+        self.addCleanup(messages_created.disconnect, dispatch_uid='t')
+        self.write(self.messages(10))  # creates the day's stats rows
+        _, _, small = self.write(self.messages(100))
+        results, written, large = self.write(self.messages(1000))
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(results), 1000)
+        self.assertTrue(all(row['id'] for row in results))
+        self.assertEqual(written, {self.room.id: {user.id: count for user, count in zip(self.users, (334, 333, 333))}})
+        self.assertEqual(len(created), 1110)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_id, max(row['id'] for row in results))
+        self.assertEqual(self.room.last_message_preview, 'message 999')
+        # Every message from the others is unread
+        for user in self.users:
+            own = sum(1 for message in created if message.sender_id == user.id)
+            self.assertEqual(RoomReadState.unread_for(user.id, self.room.id), 1110 - own)
+
+    def test_bad_row_fails_only_its_sender(self):
+        buffer = writebehind.MessageWriteBuffer(max_batch=100, max_delay=60)
+
+        async def send():
+            submits = [
+                buffer.submit(self.users[0], self.room.id, 'hello'),
+                buffer.submit(self.users[1], self.room.id + 1000, 'lost'),
+                buffer.submit(self.users[2], self.room.id, 'there'),
+            ]
+            tasks = [asyncio.ensure_future(submit) for submit in submits]
+            await asyncio.sleep(0)
+            await buffer.flush()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        first, lost, last = async_to_sync(send)()
+        self.assertIsInstance(lost, IntegrityError)
+        self.assertEqual([first['content'], last['content']], ['hello', 'there'])
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 2)
+
+
+class PresenceSweeperTests(SimpleTestCase):
+    @override_settings(CHAT_PRESENCE_TTL=0.05)
+    def test_expiry_survives_failed_sends(self):
+        changes = []
+        notifier = type('Notifier', (), {'changed': lambda self, *args, **kwargs: changes.append((args, kwargs))})()
+
+        class Layer:
+            sent = []
+
+            async def send(self, channel_name, message):
+                self.sent.append(channel_name)
+                raise ChannelFull(channel_name)
+
+        async def run():
+            presence.registry.connect('specific.a!dead', 101, 7)
+            presence.registry.connect('specific.b!dead', 102, 7)
+            sweeper = presence.PresenceSweeper(notifier, Layer())
+            await asyncio.sleep(0.2)
+            # The same sweeper still expires sockets after the failed sends
+            presence.registry.connect('specific.c!dead', 103, 7)
+            await asyncio.sleep(0.2)
+            sweeper._task.cancel()
+
+        with self.assertLogs('chat.presence', 'WARNING'):
+            async_to_sync(run)()
+        self.assertEqual(list(presence.registry.online_in_room(7)), [])
+        self.assertEqual(sorted(args for args, _ in changes), [(7, 101), (7, 102), (7, 103)])
+        self.assertTrue(all(kwargs == {'online': False} for _, kwargs in changes))
+        self.assertEqual(sorted(Layer.sent), ['specific.a!dead', 'specific.b!dead', 'specific.c!dead'])
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='writer')
+        self.room = ChatRoom.objects.create(name='history', type='GROUP')
+        messages = [Message.objects.create(room=self.room, sender=user, content=str(i)) for i in range(7)]
+        # Ties: bulk writes give many messages the same timestamp
+        for group, timestamp in ((messages[:3], messages[0].timestamp), (messages[3:], messages[3].timestamp)):
+            Message.objects.filter(id__in=[m.id for m in group]).update(timestamp=timestamp)
+        self.ids = [m.id for m in messages]
+
+    def page(self, **kwargs):
+        return paginate_messages(self.room.messages.all(), limit=2, **kwargs)
+
+    def test_before_walks_back_through_ties(self):
+        page = self.page()
+        seen = [m.id for m in page['results']]
+        while page['before']:
+            page = self.page(before=page['before'])
+            seen = [m.id for m in page['results']] + seen
+        self.assertEqual(seen, self.ids)
+
+    def test_after_walks_forward_through_ties(self):
+        page = self.page()
+        while page['before']:
+            page = self.page(before=page['before'])
+        seen = [m.id for m in page['results']]
+        self.assertIsNotNone(page['after'])
+        while page['after']:
+            page = self.page(after=page['after'])
+            seen += [m.id for m in page['results']]
+        self.assertEqual(seen, self.ids)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            self.page(before='not a cursor')
+
+
+class RoomSummaryTests(TestCase):
+    def test_summary_never_moves_backwards(self):
+        user = User.objects.create(username='writer')
+        room = ChatRoom.objects.create(name='summary', type='GROUP')
+        older = Message.objects.create(room=room, sender=user, content='older')
+        newer = Message.objects.create(room=room, sender=user, content='newer')
+        room.refresh_from_db()
+        self.assertEqual((room.last_message_id, room.last_message_preview), (newer.id, 'newer'))
+
+        # e.g. a write-behind batch that commits after a later single write
+        ChatRoom.record_message(older)
+        room.refresh_from_db()
+        self.assertEqual((room.last_message_id, room.last_message_preview), (newer.id, 'newer'))
+        self.assertEqual(room.last_message_at, newer.timestamp)
+
+    def test_preview_is_truncated(self):
+        user = User.objects.create(username='writer')
+        room = ChatRoom.objects.create(name='summary', type='GROUP')
+        Message.objects.create(room=room, sender=user, content='x' * 1000)
+        room.refresh_from_db()
+        self.assertEqual(len(room.last_message_preview), PREVIEW_LENGTH)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ReadCursorTests(TestCase):
+    def setUp(self):
+        self.reader, self.writer = User.objects.create(username='reader'), User.objects.create(username='writer')
+        self.room = ChatRoom.objects.create(name='reading', type='GROUP')
+        self.room.members.add(self.reader, self.writer)
+        self.messages = [Message.objects.create(room=self.room, sender=self.writer, content=str(i)) for i in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def read(self, message_id):
+        return self.client.post(f'/api/chat/rooms/{self.room.id}/read/', {'message_id': message_id}, format='json')
+
+    def cursor(self):
+        return RoomReadState.objects.get(user=self.reader, room=self.room).last_read_message_id
+
+    def test_mark_read_is_monotonic(self):
+        self.room.refresh_from_db()
+        self.assertTrue(RoomReadState.mark_read(self.reader, self.room, self.messages[2].id))
+        self.assertEqual(RoomReadState.unread_for(self.reader.id, self.room.id), 1)
+        self.assertFalse(RoomReadState.mark_read(self.reader, self.room, self.messages[0].id))
+        self.assertEqual(self.cursor(), self.messages[2].id)
+        self.assertEqual(RoomReadState.unread_for(self.reader.id, self.room.id), 1)
+
+    def test_read_clamps_to_the_newest_message(self):
+        response = self.read(self.messages[-1].id + 1000)
+        self.assertEqual(response.data['last_read_message_id'], self.messages[-1].id)
+        self.assertEqual(self.cursor(), self.messages[-1].id)
+        # A message written later is still unread
+        Message.objects.create(room=self.room, sender=self.writer, content='later')
+        self.assertEqual(RoomReadState.unread_for(self.reader.id, self.room.id), 1)
+
+    def test_read_rejects_other_rooms_messages(self):
+        elsewhere = ChatRoom.objects.create(name='elsewhere', type='GROUP')
+        foreign = Message.objects.create(room=elsewhere, sender=self.writer, content='not here')
+        self.assertEqual(self.read(foreign.id).status_code, 400)
+        self.assertEqual(self.read(-1).status_code, 400)
+        self.assertEqual(self.read('abc').status_code, 400)
+        self.assertEqual(self.cursor(), 0)
+
+    def test_is_read(self):
+        first, second = self.messages[0].id, self.messages[1].id
+        # A sender's own cursor doesn't make their message read
+        self.assertFalse(is_read([(self.writer.id, second)], first, self.writer.id))
+        self.assertTrue(is_read([(self.reader.id, second)], first, self.writer.id))
+        # The furthest cursor is the sender's: the second one decides
+        horizon = [(self.writer.id, second), (self.reader.id, first)]
+        self.assertTrue(is_read(horizon, first, self.writer.id))
+        self.assertFalse(is_read(horizon, second, self.writer.id))
+        self.assertTrue(is_read(horizon, second, self.reader.id))
+        self.assertFalse(is_read([], first, self.writer.id))
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'member{i}') for i in range(3)]
+        self.room = ChatRoom.objects.create(name='unread', type='GROUP')
+        self.room.members.add(*self.users)
+
+    def counts(self):
+        return [RoomReadState.unread_for(user.id, self.room.id) for user in self.users]
+
+    def test_record_messages_skips_each_sender(self):
+        a, b, _ = self.users
+        RoomReadState.record_messages(self.room.id, {a.id: 2, b.id: 1})
+        self.assertEqual(self.counts(), [1, 2, 3])
+        RoomReadState.record_messages(self.room.id, {a.id: 1})
+        self.assertEqual(self.counts(), [1, 3, 4])
+
+    def test_mark_read_resets_to_what_is_left(self):
+        a, b, c = self.users
+        messages = [Message.objects.create(room=self.room, sender=sender, content='hi') for sender in (a, b, a, b)]
+        self.assertEqual(self.counts(), [2, 2, 4])
+        self.room.refresh_from_db()
+        RoomReadState.mark_read(c, self.room, messages[1].id)
+        RoomReadState.mark_read(a, self.room, messages[-1].id)
+        self.assertEqual(self.counts(), [0, 2, 2])
+        Message.objects.create(room=self.room, sender=b, content='again')
+        self.assertEqual(self.counts(), [1, 2, 3])
+
+    def test_one_event_per_room(self):
+        layer = InMemoryChannelLayer()
+        a, b, _ = self.users
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add(events.inbox_group_name(self.room.id), channel)
+            await events.notify_new_messages(self.room.id, {a.id: 2, b.id: 1}, layer)
+            message = await layer.receive(channel)
+            self.assertNotIn(channel, layer.channels)  # nothing else was queued
+            return message
+
+        message = async_to_sync(run)()
+        self.assertEqual(message['event'], 'unread.bumped')
+        event = json.loads(message['text'])
+        self.assertEqual((event['room'], event['count']), (self.room.id, 3))
+        self.assertEqual(sorted(event['senders']), sorted([[a.id, 2], [b.id, 1]]))
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def event(self, n, **extra):
+        return {'type': 'chat.event', 'event': 'message.created', 'text': str(n), **extra}
+
+    def test_overflow_policy(self):
+        queue = backpressure.OutboundQueue(limit=3)
+        self.assertTrue(queue.push(self.event(1)))
+        self.assertTrue(queue.push(self.event(2, ephemeral=True)))
+        self.assertTrue(queue.push(self.event(3, squash='reaction:1')))
+        # Full: a new typing event is dropped, then queued ones make room
+        self.assertTrue(queue.push(self.event(4, ephemeral=True)))
+        self.assertTrue(queue.push(self.event(5, squash='reaction:1')))
+        self.assertEqual(len(queue), 3)
+        # Still full: the older of two updates to one message goes
+        self.assertTrue(queue.push(self.event(6)))
+        self.assertEqual([m['text'] for m in queue.take_all()], ['1', '5', '6'])
+
+        for n in range(3):
+            queue.push(self.event(n))
+        self.assertFalse(queue.push(self.event(3)))
+
+    def test_slow_consumer_is_closed(self):
+        consumer = ChatConsumer()
+        consumer._outbox = backpressure.OutboundQueue(limit=2)
+        closed = []
+
+        async def close(code=None, reason=None):
+            closed.append((code, reason))
+
+        consumer.close = close
+
+        async def run():
+            consumer._has_outbound = asyncio.Event()
+            for n in range(3):
+                await consumer.send_encoded(self.event(n))
+            # Gone: later events are ignored
+            await consumer.send_encoded(self.event(4))
+
+        async_to_sync(run)()
+        self.assertEqual(closed, [(backpressure.SLOW_CONSUMER_CLOSE_CODE, backpressure.RESYNC_REASON)])
+        self.assertIsNone(consumer._outbox)
+
+
+class MembershipTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'member{i}') for i in range(4)]
+        self.room = ChatRoom.objects.create(name='team', type='GROUP')
+        self.room.members.add(*self.users[:2])
+
+    def update(self, **kwargs):
+        with mock.patch('chat.events.broadcast_sync') as broadcast, mock.patch('chat.events.update_inboxes_sync'):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = update_members(self.room, **kwargs)
+        self.room.refresh_from_db()
+        return result, [call.args[0] for call in broadcast.call_args_list]
+
+    def test_add_and_remove(self):
+        a, b, c, d = self.users
+        (added, removed), sent = self.update(add=[c.id, d.id, b.id, 10_000], remove=[a.id])
+        self.assertEqual((added, removed), ([c.id, d.id], [a.id]))
+        self.assertEqual(self.room.member_count, 3)
+        self.assertEqual(set(self.room.members.values_list('id', flat=True)), {b.id, c.id, d.id})
+        self.assertFalse(RoomReadState.objects.filter(room=self.room, user=a).exists())
+        self.assertEqual(RoomReadState.objects.filter(room=self.room).count(), 3)
+
+        # One event, which makes the removed users' sockets close
+        self.assertEqual(len(sent), 1)
+        self.assertEqual((sent[0]['added'], sent[0]['removed'], sent[0]['member_count']), ([c.id, d.id], [a.id], 3))
+        self.assertEqual(events.encode(sent[0])['revoke'], [a.id])
+
+    def test_exact_member_set(self):
+        a, b, c, _ = self.users
+        (added, removed), _ = self.update(members=[b.id, c.id])
+        self.assertEqual((added, removed), ([c.id], [a.id]))
+        self.assertEqual(self.room.member_count, 2)
+        (added, removed), sent = self.update(members=[b.id, c.id])
+        self.assertEqual((added, removed, sent), ([], [], []))
+        with self.assertRaises(ValueError):
+            update_members(self.room, add=[a.id], remove=[a.id])
+
+    def test_revoked_socket_is_closed(self):
+        a = self.users[0]
+        consumer = ChatConsumer()
+        consumer.user = a
+        consumer._outbox = backpressure.OutboundQueue()
+        closed = []
+
+        async def close(code=None, reason=None):
+            closed.append(code)
+
+        consumer.close = close
+        event = events.encode(events.membership_changed(self.room.id, [], [a.id], 1))
+        async_to_sync(consumer.chat_event)(event)
+        self.assertEqual(closed, [4403])
+
+
+class DirectRoomTests(TestCase):
+    def setUp(self):
+        self.a, self.b = User.objects.create(username='a'), User.objects.create(username='b')
+
+    def test_one_room_per_pair(self):
+        room, created = ChatRoom.get_or_create_direct(self.a.id, self.b.id)
+        self.assertTrue(created)
+        self.assertEqual(ChatRoom.get_or_create_direct(self.b.id, self.a.id), (room, False))
+        self.assertEqual(set(room.members.values_list('id', flat=True)), {self.a.id, self.b.id})
+        self.assertEqual(room.direct_key, ChatRoom.direct_key_for(self.b.id, str(self.a.id)))
+
+    def test_backfill_merges_duplicates(self):
+        migration = importlib.import_module('chat.migrations.0010_chatroom_direct_key')
+        rooms = []
+        for _ in range(2):
+            room = ChatRoom.objects.create(name='Chat', type='DIRECT')
+            room.members.add(self.a, self.b)
+            rooms.append(room)
+        first, second = rooms
+        # Interleaved histories; a has read everything in the second room
+        for room, sender in ((first, self.b), (second, self.b), (first, self.b), (second, self.a)):
+            Message.objects.create(room=room, sender=sender, content='hi')
+        second.refresh_from_db()
+        RoomReadState.mark_read(self.a, second, second.last_message_id)
+
+        migration.backfill_direct_keys(apps, None)
+
+        self.assertEqual(list(ChatRoom.objects.filter(type='DIRECT')), [first])
+        first.refresh_from_db()
+        self.assertEqual(first.direct_key, ChatRoom.direct_key_for(self.a.id, self.b.id))
+        self.assertEqual(first.messages.count(), 4)
+        self.assertEqual(first.last_message_id, Message.objects.latest('id').id)
+        # a's cursor is the newest message, so nothing is left unread; b has
+        # read nothing and a sent one message
+        self.assertEqual(RoomReadState.unread_for(self.a.id, first.id), 0)
+        self.assertEqual(RoomReadState.unread_for(self.b.id, first.id), 1)
+
+
+class TypingTests(TestCase):
+    def test_typing_is_coalesced_and_never_stored(self):
+        user = User.objects.create(username='typist')
+        room = ChatRoom.objects.create(name='quiet', type='GROUP')
+        layer = InMemoryChannelLayer()
+        consumer = ChatConsumer()
+        consumer.user, consumer.room, consumer.channel_layer, consumer.channel_name = user, room, layer, 'typist'
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add(events.room_group_name(room.id), channel)
+            for _ in range(20):
+                await consumer.receive(text_data=json.dumps({'type': 'typing'}))
+            received = [await layer.receive(channel)]
+            while channel in layer.channels:
+                received.append(await layer.receive(channel))
+            return received
+
+        with mock.patch.object(ephemeral, 'coalescer', ephemeral.RateCoalescer(interval=60)):
+            with CaptureQueriesContext(connection) as ctx:
+                received = async_to_sync(run)()
+        self.assertEqual(ctx.captured_queries, [])
+        self.assertEqual(len(received), 1)
+        self.assertTrue(received[0]['ephemeral'])
+        self.assertEqual(json.loads(received[0]['text'])['user_id'], user.id)
+        self.assertFalse(Message.objects.exists())
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class RoomListTests(TestCase):
+    def test_queries_do_not_grow_with_rooms_or_members(self):
+        viewer = User.objects.create(username='viewer')
+        client = APIClient()
+        client.force_authenticate(viewer)
+
+        def add_rooms(count, members):
+            for i in range(count):
+                room = ChatRoom.objects.create(name=f'room {i}', type='GROUP')
+                others = [User.objects.create(username=f'u{room.id}_{j}') for j in range(members)]
+                room.members.add(viewer, *others)
+                Message.objects.create(room=room, sender=others[0], content='hello')
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get('/api/chat/rooms/')
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries), response.data
+
+        add_rooms(1, 1)
+        few, _ = list_queries()
+        add_rooms(10, 5)
+        many, rooms = list_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(rooms), 11)
+        self.assertTrue(all(room['last_message'] for room in rooms))
@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ChatRoomViewSet, AdminChatRoomViewSet
+from .views import ChatRoomViewSet, AdminChatRoomViewSet, prometheus_metrics
 
 router = DefaultRouter()
 router.register(r'rooms', ChatRoomViewSet, basename='chatroom')
 router.register(r'admin/rooms', AdminChatRoomViewSet, basename='admin-chatroom')
 
 urlpatterns = [
+    path('metrics/', prometheus_metrics, name='chat-metrics'),
     path('', include(router.urls)),
 ]
@@ -1,8 +1,20 @@
+import hmac
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.db.models.functions import Coalesce
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import ChatRoom, Message, Reaction
-from .serializers import ChatRoomSerializer, MessageSerializer
+from .models import ChatRoom, Message, Reaction, RoomReadState
+from .serializers import ChatRoomSerializer, ChatRoomListSerializer, fetch_reactions, serialize_messages
+from . import archive, events, export, metrics, presence
+from .membership import update_members
+from .pagination import InvalidCursor, paginate_messages, parse_limit
+from .search import get_backend as get_search_backend
+from users.models import User
 from users.permissions import IsAdmin
 
 class ChatRoomViewSet(viewsets.ModelViewSet):
@@ -12,7 +24,25 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Users can only see rooms they're members of
-        return ChatRoom.objects.filter(members=self.request.user)
+        queryset = ChatRoom.objects.filter(members=self.request.user)
+        if self.action == 'list':
+            # Resolve DIRECT display names and unread counts in the same query
+            other_member = User.objects.filter(
+                chat_rooms=OuterRef('pk')
+            ).exclude(id=self.request.user.id).values('username')[:1]
+            unread = RoomReadState.objects.filter(
+                room=OuterRef('pk'), user=self.request.user
+            ).values('unread_count')[:1]
+            queryset = queryset.annotate(
+                other_member_name=Subquery(other_member),
+                unread_count=Coalesce(Subquery(unread), 0),
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ChatRoomListSerializer
+        return ChatRoomSerializer
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -23,29 +53,109 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     def messages(self, request, pk=None):
         room = self.get_object()
         
-        # Mark unread messages from other users as read
-        unread_messages = room.messages.filter(is_read=False).exclude(sender=request.user)
-        if unread_messages.exists():
-            unread_messages.update(is_read=True)
-            
-            # Notify group about read receipt
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f'chat_{room.id}',
-                {
-                    'type': 'messages_read',
-                    'user_id': request.user.id,
-                    'username': request.user.username
-                }
-            )
+        # Opening the newest page advances this member's read cursor
+        is_first_page = not (request.query_params.get('before') or request.query_params.get('after'))
+        if is_first_page and room.last_message_id:
+            if RoomReadState.mark_read(request.user, room, room.last_message_id):
+                # Notify group about read receipt
+                events.broadcast_sync(events.read_updated(
+                    room.id, request.user.id, request.user.username, room.last_message_id
+                ))
+                events.notify_unread_sync(room.id, {request.user.id: 0})
 
-        messages = room.messages.all().order_by('timestamp')
-        serializer = MessageSerializer(messages, many=True, context={'request': request})
-        return Response(serializer.data)
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        try:
+            limit = parse_limit(request.query_params.get('limit'))
+            page = paginate_messages(room.messages.select_related('sender'), before=before, after=after, limit=limit)
+            # Paging past the oldest stored message continues in the archive
+            page = archive.fall_through(room, page, before=before, after=after, limit=limit, user_id=request.user.id)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'results': serialize_messages(
+                page['results'], request.user,
+                reactions=page.get('reactions'), read_horizon=RoomReadState.horizon(room.id),
+            ),
+            'before': page['before'],
+            'after': page['after'],
+        })
     
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Mark the room as read up to message_id (default: the latest message)"""
+        room = self.get_object()
+        message_id = request.data.get('message_id') or room.last_message_id
+        try:
+            message_id = int(message_id or 0)
+        except (TypeError, ValueError):
+            return Response({'error': 'invalid message_id'}, status=status.HTTP_400_BAD_REQUEST)
+        if message_id < 0:
+            return Response({'error': 'invalid message_id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        last_message_id = room.last_message_id or 0
+        if message_id and message_id != last_message_id and not room.messages.filter(id=message_id).exists():
+            if message_id < last_message_id or Message.objects.filter(id=message_id).exists():
+                return Response({'error': 'message_id is not a message in this room'}, status=status.HTTP_400_BAD_REQUEST)
+            # A cursor past the newest message would count every later
+            # message as read; stop at the newest one
+            message_id = last_message_id
+
+        if message_id and RoomReadState.mark_read(request.user, room, message_id):
+            events.broadcast_sync(events.read_updated(
+                room.id, request.user.id, request.user.username, message_id
+            ))
+            unread = RoomReadState.unread_for(request.user.id, room.id)
+            events.notify_unread_sync(room.id, {request.user.id: unread})
+        return Response({'last_read_message_id': message_id})
+
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        """Unread counts for all of the user's rooms as {room_id: count}"""
+        counts = RoomReadState.objects.filter(user=request.user).values_list('room_id', 'unread_count')
+        return Response({room_id: count for room_id, count in counts})
+
+    @action(detail=True, methods=['get'])
+    def presence(self, request, pk=None):
+        """Ids of users connected to this room right now"""
+        room = self.get_object()
+        return Response({'online': list(presence.registry.online_in_room(room.id))})
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search over messages in the user's rooms"""
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'q required'}, status=status.HTTP_400_BAD_REQUEST)
+        room_id = request.query_params.get('room')
+        try:
+            room_id = int(room_id) if room_id else None
+            hits, next_cursor = get_search_backend().search(
+                request.user.id, text,
+                room_id=room_id,
+                cursor=request.query_params.get('cursor'),
+                limit=parse_limit(request.query_params.get('limit')),
+            )
+        except (InvalidCursor, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = [message_id for message_id, _ in hits]
+        messages = Message.objects.select_related('sender').in_bulk(ids)
+        reactions = fetch_reactions(ids, request.user.id)
+        horizons = {}
+        results = []
+        for message_id in ids:
+            message = messages.get(message_id)
+            if message is None:
+                continue
+            if message.room_id not in horizons:
+                horizons[message.room_id] = RoomReadState.horizon(message.room_id)
+            results.extend(serialize_messages(
+                [message], request.user, reactions=reactions, read_horizon=horizons[message.room_id]
+            ))
+        return Response({'results': results, 'next': next_cursor})
+
     @action(detail=True, methods=['post', 'delete'], url_path='messages/(?P<message_id>[^/.]+)/react')
     def react_to_message(self, request, pk=None, message_id=None):
         """Add or remove emoji reaction to/from a message"""
@@ -56,7 +166,7 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             return Response({'error': 'emoji required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            message = Message.objects.get(id=message_id, room=room)
+            message = Message.objects.select_related('sender').get(id=message_id, room=room)
         except Message.DoesNotExist:
             return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
         
@@ -78,25 +188,13 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             except Reaction.DoesNotExist:
                 pass
         
-        # Broadcast reaction update via WebSocket
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'chat_{room.id}',
-            {
-                'type': 'reaction_update',
-                'message_id': message_id,
-                'emoji': emoji,
-                'user_id': request.user.id,
-                'action': 'add' if request.method == 'POST' else 'remove'
-            }
-        )
+        data = serialize_messages([message], request.user, read_horizon=RoomReadState.horizon(room.id))[0]
+
+        # Broadcast the recomputed reactions for this message via WebSocket
+        events.broadcast_sync(events.reaction_changed(room.id, message.id, data['reactions']))
         
         # Return updated message
-        serializer = MessageSerializer(message, context={'request': request})
-        return Response(serializer.data)
+        return Response(data)
 
     @action(detail=False, methods=['post'])
     def create_direct(self, request):
@@ -105,21 +203,18 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         if not other_user_id:
             return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if room already exists
-        existing_room = ChatRoom.objects.filter(
-            type='DIRECT',
-            members=request.user
-        ).filter(members__id=other_user_id).first()
-        
-        if existing_room:
-            serializer = self.get_serializer(existing_room)
-            return Response(serializer.data)
-        
-        # Create new room
-        room = ChatRoom.objects.create(type='DIRECT', name=f'Chat')
-        room.members.add(request.user, other_user_id)
+        try:
+            other_user_id = int(other_user_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'invalid user_id'}, status=status.HTTP_400_BAD_REQUEST)
+        if not User.objects.filter(pk=other_user_id).exists():
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        # One indexed lookup on the pair's key; concurrent requests for the
+        # same pair get the same room
+        room, created = ChatRoom.get_or_create_direct(request.user.id, other_user_id)
         serializer = self.get_serializer(room)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'], permission_classes=[IsAdmin])
     def create_group(self, request):
@@ -140,7 +235,6 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         
         # Add selected members
         if member_ids:
-            from users.models import User
             members = User.objects.filter(id__in=member_ids)
             room.members.add(*members)
         
@@ -161,6 +255,48 @@ class AdminChatRoomViewSet(viewsets.ModelViewSet):
         serializer = UserSerializer(members, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Stream the room's history (archived and stored) as NDJSON or CSV.
+        Query params: ``output`` (ndjson|csv), ``gzip=1``, ``after`` (message id
+        to resume after).
+        """
+        room = self.get_object()
+        fmt = request.query_params.get('output', 'ndjson')
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        try:
+            after_id = int(request.query_params.get('after') or 0)
+            chunks = (export.aexport_chunks if isinstance(request._request, ASGIRequest) else export.export_chunks)(
+                room.id, fmt=fmt, compress=compress, after_id=after_id
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(chunks, content_type=export.FORMATS[fmt])
+        filename = f'room-{room.id}.{fmt}' + ('.gz' if compress else '')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=True, methods=['post'], url_path='members/bulk')
+    def bulk_members(self, request, pk=None):
+        """
+        Change many memberships at once. Send ``members`` (the complete new
+        member list) or ``add`` and/or ``remove`` lists of user ids.
+        """
+        room = self.get_object()
+        try:
+            if 'members' in request.data:
+                added, removed = update_members(room, members=_user_ids(request.data['members']))
+            else:
+                added, removed = update_members(
+                    room, add=_user_ids(request.data.get('add', [])), remove=_user_ids(request.data.get('remove', []))
+                )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        room.refresh_from_db(fields=['member_count'])
+        return Response({'added': added, 'removed': removed, 'member_count': room.member_count})
+
     @action(detail=True, methods=['post'])
     def add_member(self, request, pk=None):
         """Add a member to a chat room"""
@@ -171,9 +307,8 @@ class AdminChatRoomViewSet(viewsets.ModelViewSet):
             return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            from users.models import User
             user = User.objects.get(id=user_id)
-            room.members.add(user)
+            update_members(room, add=[user.id])
             return Response({'status': 'member added'}, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -188,9 +323,39 @@ class AdminChatRoomViewSet(viewsets.ModelViewSet):
             return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            from users.models import User
             user = User.objects.get(id=user_id)
-            room.members.remove(user)
+            update_members(room, remove=[user.id])
             return Response({'status': 'member removed'}, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+def _user_ids(value):
+    if not isinstance(value, list):
+        raise ValueError('expected a list of user ids')
+    try:
+        return [int(user_id) for user_id in value]
+    except (TypeError, ValueError):
+        raise ValueError('user ids must be integers')
+
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
+
+async def prometheus_metrics(request):
+    """
+    Realtime-layer metrics for Prometheus. Runs on the event loop so it reads
+    the same sockets, groups and buffers as the consumers it reports on.
+
+    Scrapers authenticate with ``Authorization: Bearer <METRICS_TOKEN>``.
+    Without a token configured the endpoint is closed, unless
+    ``METRICS_ALLOW_LOCALHOST`` opens it to loopback clients.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        authorized = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        authorized = (
+            getattr(settings, 'METRICS_ALLOW_LOCALHOST', False)
+            and request.META.get('REMOTE_ADDR') in LOCAL_ADDRESSES
+        )
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
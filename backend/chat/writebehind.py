@@ -0,0 +1,143 @@
+"""
+Write-behind persistence for chat messages.
+
+Instead of one thread hop and INSERT per inbound message, consumers
+hand messages to a per-event-loop buffer. The buffer flushes with a single
+``bulk_create`` once ``CHAT_WRITE_BEHIND_MAX_BATCH`` messages are waiting or
+``CHAT_WRITE_BEHIND_MAX_DELAY`` seconds have passed since the first one,
+then resolves each sender's future with the persisted row (including its
+database id) so the consumer can broadcast it.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import ChatRoom, Message, RoomReadState
+from .serializers import serialize_messages
+from .signals import messages_created
+from . import events
+
+logger = logging.getLogger(__name__)
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+
+class MessageWriteBuffer:
+    def __init__(self, max_batch=None, max_delay=None):
+        self.max_batch = max_batch or getattr(settings, 'CHAT_WRITE_BEHIND_MAX_BATCH', 100)
+        self.max_delay = max_delay if max_delay is not None else getattr(settings, 'CHAT_WRITE_BEHIND_MAX_DELAY', 0.02)
+        self._pending = []
+        self._timer = None
+        self._flushing = set()
+
+    async def submit(self, sender, room_id, content):
+        """Queue a message from an already resolved user and wait until it has been written"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((Message(sender=sender, room_id=room_id, content=content), future))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._start_flush)
+        return await future
+
+    async def flush(self):
+        """Write everything queued so far and wait for in-flight batches"""
+        self._start_flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._flush_batch(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush_batch(self, batch):
+        written = {}
+        try:
+            results, written = await database_sync_to_async(write_messages)([message for message, _ in batch])
+        except Exception as e:
+            logger.exception('Write-behind flush of %d messages failed', len(batch))
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        for room_id, sender_counts in written.items():
+            await events.notify_new_messages(room_id, sender_counts)
+
+
+def write_messages(messages):
+    """
+    Persist a batch of unsaved messages.
+
+    Returns the serialized rows and, for the unread bumps, the messages
+    written per room and sender as ``{room_id: {sender_id: count}}``. The
+    happy path is one ``bulk_create`` plus a summary update and an unread
+    update per room in the batch; senders come attached to the messages. If
+    the batch violates a constraint (e.g. an unknown room) it is retried row
+    by row so that a single bad message only fails its own sender.
+    """
+    try:
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+    except IntegrityError:
+        results = [_write_one(message) for message in messages]
+        written = {}
+        for message, result in zip(messages, results):
+            if not isinstance(result, Exception):
+                counts = written.setdefault(message.room_id, {})
+                counts[message.sender_id] = counts.get(message.sender_id, 0) + 1
+        return results, written
+
+    latest = {}
+    sender_counts = {}
+    for message in messages:
+        if message.room_id not in latest or message.id > latest[message.room_id].id:
+            latest[message.room_id] = message
+        counts = sender_counts.setdefault(message.room_id, {})
+        counts[message.sender_id] = counts.get(message.sender_id, 0) + 1
+    # bulk_create does not send post_save, so do its work here per room
+    for room_id, message in latest.items():
+        ChatRoom.record_message(message)
+        RoomReadState.record_messages(room_id, sender_counts[room_id])
+    messages_created.send(sender=Message, messages=messages)
+    return serialize_messages(messages, reactions={}), sender_counts
+
+
+def _write_one(message):
+    # Forget any id handed out by the rolled back bulk insert
+    message.pk = None
+    try:
+        message.save()
+    except IntegrityError as e:
+        return e
+    return serialize_messages([Message.objects.select_related('sender').get(pk=message.pk)], reactions={})[0]
+
+
+_buffers = {}
+
+
+def get_write_buffer():
+    """Return the buffer for the running event loop"""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        # Drop buffers left behind by closed loops (e.g. in tests)
+        for stale in [l for l in _buffers if l.is_closed()]:
+            del _buffers[stale]
+        buffer = _buffers[loop] = MessageWriteBuffer()
+    return buffer
@@ -0,0 +1,11 @@
+from django.contrib import admin
+from .models import Counter, HourlyMessageCount
+
+@admin.register(Counter)
+class CounterAdmin(admin.ModelAdmin):
+    list_display = ['name', 'value', 'valid_until', 'updated_at']
+    search_fields = ['name']
+
+@admin.register(HourlyMessageCount)
+class HourlyMessageCountAdmin(admin.ModelAdmin):
+    list_display = ['hour', 'count']
@@ -0,0 +1,187 @@
+"""
+Write-maintained dashboard counters.
+
+``messages.<date>``  messages sent on that (local) day, bumped on every new
+                     message together with its hour in HourlyMessageCount.
+``users.approved``   approved users, recounted when a user is saved or
+                     deleted.
+``streams.active``   live streams. Streams go live and end with the clock
+                     rather than with a write, so the count is stored with
+                     ``valid_until`` set to the next start or end time and
+                     recomputed lazily once that passes (and on any stream
+                     write).
+``users.online.<node>``  users with an open socket on one worker process,
+                     published by chat.presence every few seconds and
+                     valid for ``CHAT_PRESENCE_TTL`` so that a worker that
+                     dies stops counting. The dashboard sums them.
+
+Deleted messages are not subtracted, because a receiver on Message deletes
+would turn every cascading room delete into a row-by-row one; code that
+deletes messages it created itself (the benchmarks) calls
+``discount_messages`` first, and the ``reconcile_stats`` command corrects
+drift of any kind.
+"""
+from collections import Counter as Tally
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import Counter, HourlyMessageCount
+
+APPROVED_USERS = 'users.approved'
+ACTIVE_STREAMS = 'streams.active'
+ONLINE_USERS = 'users.online.'  # a prefix; one counter per worker process
+
+
+def messages_key(day):
+    return f'messages.{day.isoformat()}'
+
+
+def _hour(timestamp):
+    return timezone.localtime(timestamp).replace(minute=0, second=0, microsecond=0)
+
+
+def _add_messages(messages, sign):
+    days = Tally(timezone.localdate(m.timestamp) for m in messages)
+    hours = Tally(_hour(m.timestamp) for m in messages)
+    for day, count in days.items():
+        Counter.increment(messages_key(day), sign * count)
+    for hour, count in hours.items():
+        HourlyMessageCount.increment(hour, sign * count)
+
+
+def record_messages(messages):
+    """Count newly created messages into their day and hour"""
+    _add_messages(messages, 1)
+
+
+def discount_messages(messages):
+    """Take messages that are about to be deleted back out of their day and hour"""
+    _add_messages(messages, -1)
+
+
+def refresh_approved_users():
+    from users.models import User
+
+    Counter.put(APPROVED_USERS, User.objects.filter(is_approved=True).count())
+
+
+def refresh_active_streams(now=None):
+    """Recount live streams and remember when the answer next changes"""
+    from streaming.models import StreamEvent
+
+    now = now or timezone.now()
+    live = StreamEvent.objects.filter(start_time__lte=now).filter(
+        Q(end_time__isnull=True) | Q(end_time__gte=now)
+    ).count()
+    boundaries = StreamEvent.objects.aggregate(
+        next_start=Min('start_time', filter=Q(start_time__gt=now)),
+        next_end=Min('end_time', filter=Q(end_time__gte=now)),
+    )
+    candidates = [boundaries['next_start']]
+    if boundaries['next_end'] is not None:
+        # A stream is still live at end_time itself
+        candidates.append(boundaries['next_end'] + timedelta(microseconds=1))
+    candidates = [c for c in candidates if c is not None]
+    Counter.put(ACTIVE_STREAMS, live, valid_until=min(candidates) if candidates else None)
+    return live
+
+
+def put_online_users(node, count, ttl):
+    """Publish worker ``node``'s online user count for ``ttl`` seconds"""
+    now = timezone.now()
+    Counter.put(ONLINE_USERS + node, count, valid_until=now + timedelta(seconds=ttl))
+    # Drop the counts of workers that have gone away
+    Counter.objects.filter(name__startswith=ONLINE_USERS, valid_until__lte=now).delete()
+
+
+def dashboard_stats():
+    """Current counters with one read (plus a recount when streams changed state)"""
+    now = timezone.now()
+    today = messages_key(timezone.localdate(now))
+    counters = {c.name: c for c in Counter.objects.filter(
+        Q(name__in=[APPROVED_USERS, today, ACTIVE_STREAMS])
+        | Q(name__startswith=ONLINE_USERS, valid_until__gt=now)
+    )}
+
+    streams = counters.get(ACTIVE_STREAMS)
+    if streams is None or (streams.valid_until is not None and streams.valid_until <= now):
+        active_streams = refresh_active_streams(now)
+    else:
+        active_streams = streams.value
+
+    return {
+        'approved_users': counters[APPROVED_USERS].value if APPROVED_USERS in counters else 0,
+        'messages_today': counters[today].value if today in counters else 0,
+        'active_streams': active_streams,
+        # A user with sockets on two workers is counted by both
+        'online_users': sum(c.value for name, c in counters.items() if name.startswith(ONLINE_USERS)),
+    }
+
+
+def reconcile(days=None):
+    """
+    Recompute every counter from the source tables.
+
+    ``days`` limits the message recount to that many recent days; the
+    default rebuilds the whole history. Returns ``{name: (old, new)}`` for
+    every value that changed.
+    """
+    from chat.models import Message, MessageArchive
+
+    changes = {}
+    old = {c.name: c.value for c in Counter.objects.all()}
+
+    messages = Message.objects.all()
+    hourly = HourlyMessageCount.objects.all()
+    archives = MessageArchive.objects.all()
+    if days is not None:
+        start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+        messages = messages.filter(timestamp__gte=start)
+        hourly = hourly.filter(hour__gte=start)
+        archives = archives.filter(day__gte=start.date())
+    # Archived days are counted from their blocks. Their hours would mean
+    # unpacking every block, so the rollups for those days are kept.
+    hot = messages
+    last_archived_day = archives.aggregate(Max('day'))['day__max']
+    if last_archived_day is not None:
+        boundary = timezone.make_aware(datetime.combine(last_archived_day + timedelta(days=1), time.min))
+        hourly = hourly.filter(hour__gte=boundary)
+        hot = messages.filter(timestamp__gte=boundary)
+
+    # Rebuild the rollups in the database rather than in Python
+    per_hour = hot.annotate(bucket=TruncHour('timestamp')).values('bucket').annotate(n=Count('id'))
+    per_day = messages.annotate(bucket=TruncDate('timestamp')).values('bucket').annotate(n=Count('id'))
+    old_hours = {h.hour: h.count for h in hourly}
+    new_hours = {row['bucket']: row['n'] for row in per_hour}
+    if old_hours != new_hours:
+        changes['hourly'] = (sum(old_hours.values()), sum(new_hours.values()))
+        hourly.delete()
+        HourlyMessageCount.objects.bulk_create([
+            HourlyMessageCount(hour=hour, count=count) for hour, count in new_hours.items()
+        ], batch_size=1000)
+
+    expected = Tally({messages_key(row['bucket']): row['n'] for row in per_day})
+    for row in archives.values('day').annotate(n=Sum('message_count')):
+        expected[messages_key(row['day'])] += row['n']
+    if days is None:
+        stale = [name for name in old if name.startswith('messages.') and name not in expected]
+    else:
+        recent = {messages_key(timezone.localdate() - timedelta(days=i)) for i in range(days)}
+        stale = [name for name in recent if name in old and name not in expected]
+    Counter.objects.filter(name__in=stale).delete()
+    changes.update({name: (old[name], 0) for name in stale})
+    for name, value in expected.items():
+        if old.get(name) != value:
+            Counter.put(name, value)
+            changes[name] = (old.get(name), value)
+
+    refresh_approved_users()
+    refresh_active_streams()
+    for name in (APPROVED_USERS, ACTIVE_STREAMS):
+        value = Counter.objects.get(name=name).value
+        if old.get(name) != value:
+            changes[name] = (old.get(name), value)
+    return changes
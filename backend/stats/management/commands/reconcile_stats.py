@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from stats.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute dashboard counters and hourly rollups from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only recount messages from the last N days')
+
+    def handle(self, *args, **options):
+        changes = reconcile(days=options['days'])
+        for name, (old, new) in sorted(changes.items()):
+            self.stdout.write(f'  {name}: {old} -> {new}')
+        self.stdout.write(self.style.SUCCESS(f'Corrected {len(changes)} counters'))
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:19
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate, TruncHour
+
+
+def backfill_counters(apps, schema_editor):
+    Counter = apps.get_model('stats', 'Counter')
+    HourlyMessageCount = apps.get_model('stats', 'HourlyMessageCount')
+    Message = apps.get_model('chat', 'Message')
+    User = apps.get_model('users', 'User')
+
+    Counter.objects.create(name='users.approved', value=User.objects.filter(is_approved=True).count())
+    per_day = Message.objects.annotate(day=TruncDate('timestamp')).values('day').annotate(n=Count('id'))
+    Counter.objects.bulk_create([
+        Counter(name=f"messages.{row['day'].isoformat()}", value=row['n']) for row in per_day
+    ])
+    per_hour = Message.objects.annotate(hour=TruncHour('timestamp')).values('hour').annotate(n=Count('id'))
+    HourlyMessageCount.objects.bulk_create([
+        HourlyMessageCount(hour=row['hour'], count=row['n']) for row in per_hour
+    ], batch_size=1000)
+    # streams.active is computed on first read
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('chat', '0008_message_search_index'),
+        ('users', '0002_user_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+                ('valid_until', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyMessageCount',
+            fields=[
+                ('hour', models.DateTimeField(primary_key=True, serialize=False)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['hour'],
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+
+
+class Counter(models.Model):
+    """
+    A named running total, kept current by stats.signals so that dashboards
+    read a few rows instead of counting tables.
+
+    ``valid_until`` marks values that go stale with time rather than with a
+    write (e.g. streams going live); ``None`` means the value never expires.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    valid_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} = {self.value}'
+
+    @classmethod
+    def increment(cls, name, amount=1):
+        updated = cls.objects.filter(name=name).update(value=F('value') + amount, updated_at=timezone.now())
+        if not updated:
+            # First write for this key; a concurrent creator makes us fall
+            # back to the update
+            counter, created = cls.objects.get_or_create(name=name, defaults={'value': amount})
+            if not created:
+                cls.objects.filter(name=name).update(value=F('value') + amount, updated_at=timezone.now())
+
+    @classmethod
+    def put(cls, name, value, valid_until=None):
+        cls.objects.update_or_create(name=name, defaults={'value': value, 'valid_until': valid_until})
+
+
+class HourlyMessageCount(models.Model):
+    """Messages sent per hour, for history charts"""
+    hour = models.DateTimeField(primary_key=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['hour']
+
+    def __str__(self):
+        return f'{self.hour:%Y-%m-%d %H:00} {self.count}'
+
+    @classmethod
+    def increment(cls, hour, amount=1):
+        if not cls.objects.filter(hour=hour).update(count=F('count') + amount):
+            bucket, created = cls.objects.get_or_create(hour=hour, defaults={'count': amount})
+            if not created:
+                cls.objects.filter(hour=hour).update(count=F('count') + amount)
@@ -0,0 +1,29 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chat.signals import messages_created
+from streaming.models import StreamEvent
+from users.models import User
+
+from . import counters
+
+
+@receiver(messages_created)
+def count_messages(sender, messages, **kwargs):
+    counters.record_messages(messages)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def count_approved_users(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'status', 'is_approved'} & set(update_fields):
+        # e.g. last_login updates
+        return
+    counters.refresh_approved_users()
+
+
+@receiver(post_save, sender=StreamEvent)
+@receiver(post_delete, sender=StreamEvent)
+def count_active_streams(sender, instance, **kwargs):
+    counters.refresh_active_streams()
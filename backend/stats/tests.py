@@ -0,0 +1,48 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from chat.models import ChatRoom, Message
+from users.models import User
+
+from stats import counters
+from stats.models import Counter, HourlyMessageCount
+
+
+class CounterTests(TestCase):
+    def value(self, name):
+        counter = Counter.objects.filter(name=name).first()
+        return counter.value if counter else 0
+
+    def test_writes_bump_counters(self):
+        today = counters.messages_key(timezone.localdate())
+        user = User.objects.create(username='writer', status=User.Status.ACTIVE)
+        self.assertEqual(self.value(counters.APPROVED_USERS), 1)
+        User.objects.create(username='pending')
+        self.assertEqual(self.value(counters.APPROVED_USERS), 1)
+
+        room = ChatRoom.objects.create(name='a', type='GROUP')
+        Message.objects.create(room=room, sender=user, content='one')
+        Message.objects.create(room=room, sender=user, content='two')
+        self.assertEqual(self.value(today), 2)
+        self.assertEqual(sum(HourlyMessageCount.objects.values_list('count', flat=True)), 2)
+        self.assertEqual(counters.dashboard_stats()['messages_today'], 2)
+
+    def test_reconcile_repairs_drift(self):
+        today = counters.messages_key(timezone.localdate())
+        user = User.objects.create(username='writer', status=User.Status.ACTIVE)
+        room = ChatRoom.objects.create(name='a', type='GROUP')
+        Message.objects.create(room=room, sender=user, content='one')
+        Message.objects.create(room=room, sender=user, content='two')
+        # Deletes aren't subtracted, and a counter can be off for any reason
+        Message.objects.filter(content='two').delete()
+        Counter.put(counters.APPROVED_USERS, 40)
+        Counter.put(counters.messages_key(timezone.localdate() - timezone.timedelta(days=3)), 5)
+
+        changes = counters.reconcile()
+        self.assertEqual(changes[today], (2, 1))
+        self.assertEqual(changes[counters.APPROVED_USERS], (40, 1))
+        self.assertEqual(self.value(today), 1)
+        self.assertEqual(self.value(counters.APPROVED_USERS), 1)
+        self.assertFalse(Counter.objects.filter(name__startswith='messages.').exclude(name=today).exists())
+        self.assertEqual(sum(HourlyMessageCount.objects.values_list('count', flat=True)), 1)
+        self.assertEqual(counters.reconcile(), {})
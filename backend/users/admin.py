@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from . import authentication
 from .models import User
 
 @admin.register(User)
@@ -16,8 +17,11 @@ class UserAdmin(BaseUserAdmin):
 
     def approve_users(self, request, queryset):
         queryset.update(is_approved=True)
+        # update() sends no post_save
+        authentication.invalidate(*queryset.values_list('pk', flat=True))
     approve_users.short_description = "Approve selected users"
 
     def make_paid(self, request, queryset):
         queryset.update(role='PAID')
+        authentication.invalidate(*queryset.values_list('pk', flat=True))
     make_paid.short_description = "Make selected users PAID"
@@ -0,0 +1,187 @@
+"""
+JWT authentication that resolves the token's user through a cache.
+
+A user's role and status rarely change, so instead of a SELECT on every
+request the user is kept in a per-process LRU for ``AUTH_USER_CACHE_TTL``
+seconds. With ``AUTH_USER_CACHE_SHARED``, misses are also looked up in (and
+written to) Django's default cache, so processes sharing a cache backend
+share their lookups.
+
+Saving or deleting a user drops it at once everywhere (users.signals), as
+do the admin actions that update users in bulk. Saves that only write
+``last_login``, as every sign-in does, are ignored. Dropping happens:
+
+* in this process, from the LRU;
+* in the other processes of a ``runworkers`` deployment, by a signal over
+  the channel layer (chat.layers). A process subscribes before it caches
+  its first user, so every process holding an entry hears about changes;
+* with ``AUTH_USER_CACHE_SHARED``, from the shared cache, and a per-user
+  version there is bumped. Every hit in a process's LRU is checked against
+  that version, which covers deployments whose processes don't share a
+  channel layer, at the price of one cache read per request.
+
+The TTL only bounds the rare case of a signal datagram being dropped.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def _ttl():
+    return getattr(settings, 'AUTH_USER_CACHE_TTL', 30)
+
+
+def _shared():
+    return getattr(settings, 'AUTH_USER_CACHE_SHARED', False)
+
+
+def _key(user_id):
+    return f'auth.user:{user_id}'
+
+
+def _version_key(user_id):
+    return f'auth.user.version:{user_id}'
+
+
+SIGNAL = 'auth.user.invalidate'
+
+
+class UserCache:
+    """
+    LRU of user id -> (expiry, value), safe to use from several threads. Ids
+    are kept as strings, since tokens may carry them either way.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, value, ttl):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(getattr(settings, 'AUTH_USER_CACHE_SIZE', 10_000))
+_subscribed = False
+_subscribe_lock = threading.Lock()
+
+
+def _peer_layer():
+    """The channel layer, if it can signal the other processes"""
+    from channels.layers import get_channel_layer
+
+    layer = get_channel_layer()
+    return layer if hasattr(layer, 'broadcast_signal') else None
+
+
+def _forget(user_ids):
+    for user_id in user_ids:
+        user_cache.discard(str(user_id))
+
+
+def _subscribe():
+    """Hear about changes made in other processes; once per process"""
+    global _subscribed
+    if _subscribed:
+        return
+    with _subscribe_lock:
+        if not _subscribed:
+            layer = _peer_layer()
+            if layer is not None:
+                layer.on_signal(SIGNAL, _forget)
+            _subscribed = True
+
+
+def _shared_version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # add() keeps the first writer's version if two processes race
+        cache.add(_version_key(user_id), time.time_ns(), None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def invalidate(*user_ids):
+    """Forget cached users in every process, and in the shared cache"""
+    if not user_ids:
+        return
+    user_ids = [str(user_id) for user_id in user_ids]
+    _forget(user_ids)
+    layer = _peer_layer()
+    if layer is not None:
+        layer.broadcast_signal(SIGNAL, user_ids)
+    if _shared():
+        cache.delete_many([_key(user_id) for user_id in user_ids])
+        cache.set_many({_version_key(user_id): time.time_ns() for user_id in user_ids}, None)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` with the token's user read through the cache"""
+
+    def get_user(self, validated_token):
+        ttl = _ttl()
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if ttl <= 0 or user_id is None:
+            return super().get_user(validated_token)
+        user_id = str(user_id)
+        shared = _shared()
+        version = _shared_version(user_id) if shared else None
+
+        entry = user_cache.get(user_id)
+        if entry is not None and entry[0] != version:
+            entry = None  # changed by a process this one can't hear from
+        if entry is None and shared:
+            entry = cache.get(_key(user_id))
+            if entry is not None and entry[0] != version:
+                entry = None
+            if entry is not None:
+                _subscribe()
+                user_cache.set(user_id, entry, ttl)
+        if entry is not None:
+            user = entry[1]
+            if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                # Checked per token: an old token may meet a freshly cached user
+                raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        else:
+            _subscribe()
+            # Runs the inactive-user check; inactive users aren't cached
+            user = super().get_user(validated_token)
+            entry = (version, user)
+            user_cache.set(user_id, entry, ttl)
+            if shared:
+                cache.set(_key(user_id), entry, ttl)
+        # Requests may change request.user; never hand out the cached object
+        return copy.copy(user)
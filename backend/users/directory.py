@@ -0,0 +1,119 @@
+"""
+Prefix search over approved users, for people pickers.
+
+A query matches users whose username or email starts with it, ignoring
+case. Results are ordered by lowercased username and then id, which is also
+the keyset for the cursor, and carry only what a picker shows.
+
+Indexes (migration 0003):
+
+* every database: B-tree indexes on ``LOWER(username)`` and ``LOWER(email)``.
+  On SQLite the prefix is matched as the range ``[prefix, next prefix)``, so
+  both sides of the OR are index range scans. SQLite's ``LIKE`` can't use an
+  index here.
+* PostgreSQL: trigram GIN indexes on the same expressions, which serve
+  ``LIKE 'prefix%'`` whatever the column's collation is.
+
+Short prefixes match the most rows and are typed by everyone, so their
+pages are cached for ``USER_SEARCH_CACHE_TTL`` seconds. Longer prefixes are
+selective enough to query every time.
+"""
+import base64
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .models import User
+
+FIELDS = ('id', 'username', 'email', 'role')
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+CACHED_PREFIX_LENGTH = 3
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(username_lower, user_id):
+    return base64.urlsafe_b64encode(f'{username_lower}\x00{user_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        username_lower, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('\x00')
+        return username_lower, int(user_id)
+    except (ValueError, UnicodeError):
+        raise InvalidQuery('Invalid cursor')
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return DEFAULT_LIMIT
+    try:
+        return max(1, min(int(value), MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise InvalidQuery('Invalid limit')
+
+
+def _prefix_match(alias, prefix):
+    if connection.vendor == 'postgresql':
+        return Q(**{f'{alias}__startswith': prefix})
+    # Every string that starts with ``prefix`` sorts in [prefix, upper)
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{f'{alias}__gte': prefix, f'{alias}__lt': upper})
+
+
+def _search(prefix, cursor, limit):
+    users = User.objects.filter(is_approved=True).annotate(
+        username_lower=Lower('username'), email_lower=Lower('email'),
+    )
+    if prefix:
+        users = users.filter(_prefix_match('username_lower', prefix) | _prefix_match('email_lower', prefix))
+    if cursor:
+        username_lower, user_id = decode_cursor(cursor)
+        users = users.filter(
+            Q(username_lower__gt=username_lower) | Q(username_lower=username_lower, id__gt=user_id)
+        )
+    rows = list(users.order_by('username_lower', 'id').values(*FIELDS, 'username_lower')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['username_lower'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def search_users(text, cursor=None, limit=DEFAULT_LIMIT, exclude_id=None):
+    """
+    Return ``(results, next_cursor)`` for approved users whose username or
+    email starts with ``text``. ``exclude_id`` (the viewer) is dropped from
+    the page after the lookup, so cached pages are shared by everyone.
+    """
+    prefix = text.strip().lower()
+    fetch = limit + 1 if exclude_id is not None else limit
+    if len(prefix) <= CACHED_PREFIX_LENGTH:
+        # Hashed: the prefix and cursor are user input, and cache backends
+        # reject keys with spaces, control characters or over 250 bytes
+        digest = hashlib.sha1(f'{prefix}\x00{cursor or ""}\x00{fetch}'.encode()).hexdigest()
+        key = f'users.search:{digest}'
+        page = cache.get(key)
+        if page is None:
+            page = _search(prefix, cursor, fetch)
+            cache.set(key, page, getattr(settings, 'USER_SEARCH_CACHE_TTL', 30))
+    else:
+        page = _search(prefix, cursor, fetch)
+
+    results, next_cursor = page
+    if exclude_id is not None:
+        kept = [row for row in results if row['id'] != exclude_id]
+        if len(kept) > limit:
+            # The viewer wasn't on this page: return ``limit`` rows and
+            # continue after the last one shown
+            kept = kept[:limit]
+            next_cursor = encode_cursor(kept[-1]['username_lower'], kept[-1]['id'])
+        results = kept
+    return [{field: row[field] for field in FIELDS} for row in results], next_cursor
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:46
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+TRIGRAM_INDEXES = {
+    'users_username_trgm_idx': 'username',
+    'users_email_trgm_idx': 'email',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Only PostgreSQL has pg_trgm; elsewhere the LOWER() indexes serve search
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('users', 'User')._meta.db_table
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (LOWER({column}) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0002_user_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='users_username_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='users_email_lower_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 
 class User(AbstractUser):
     class Roles(models.TextChoices):
@@ -25,7 +26,21 @@ class User(AbstractUser):
         default=Status.PENDING,
     )
     is_approved = models.BooleanField(default=False)  # Keep for backwards compatibility
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive prefix search (users.directory)
+            models.Index(Lower('username'), name='users_username_lower_idx'),
+            models.Index(Lower('email'), name='users_email_lower_idx'),
+        ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What was read, so users.signals can tell which fields a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
         # Sync is_approved with status
         self.is_approved = (self.status == self.Status.ACTIVE)
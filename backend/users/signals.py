@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import authentication
+from .models import User
+
+# Saves that change nothing but these leave cached users alone; the login
+# path writes last_login on every sign-in
+IGNORED_FIELDS = {'last_login'}
+
+
+def _changed_fields(instance, update_fields):
+    """The fields a save may have changed, or None if that isn't known"""
+    if update_fields is not None:
+        return set(update_fields)
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        return None
+    changed = {name for name, value in loaded.items() if getattr(instance, name) != value}
+    # Compare the next save of this instance with what this one wrote
+    instance._loaded_values = {name: getattr(instance, name) for name in loaded}
+    return changed
+
+
+def _invalidate(user_id):
+    # Now, and again once committed, in case a request re-cached the old row
+    # in between
+    authentication.invalidate(user_id)
+    transaction.on_commit(lambda: authentication.invalidate(user_id))
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, created, update_fields=None, **kwargs):
+    changed = _changed_fields(instance, update_fields)
+    if created or (changed is not None and not changed - IGNORED_FIELDS):
+        return
+    _invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    # Taken now: a deleted instance has lost its pk by commit time
+    _invalidate(instance.pk)
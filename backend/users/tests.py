@@ -0,0 +1,97 @@
+import warnings
+
+from django.contrib.auth.models import update_last_login
+from django.core.cache import CacheKeyWarning, cache
+from django.test import TestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users import directory
+from users.authentication import CachedJWTAuthentication, user_cache
+from users.models import User
+
+
+class DirectorySearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for username, email in [
+            ('alice', 'alice@example.com'),
+            ('Albert', 'bert@example.com'),
+            ('albertine', 'tina@example.com'),
+            ('bob', 'al.bob@example.com'),
+            ('alfred', 'fred@example.com'),
+            ('carol', 'carol@example.com'),
+        ]:
+            User.objects.create(username=username, email=email, status=User.Status.ACTIVE)
+        User.objects.create(username='alpending', email='pending@example.com')
+
+    def usernames(self, results):
+        return [row['username'] for row in results]
+
+    def test_prefix_ordering(self):
+        # Username or email, any case; ordered by lowercased username
+        results, next_cursor = directory.search_users('AL')
+        self.assertEqual(self.usernames(results), ['Albert', 'albertine', 'alfred', 'alice', 'bob'])
+        self.assertIsNone(next_cursor)
+
+    def test_cursor_continuation(self):
+        for query in ('al', 'albe'):  # a cached and an uncached prefix length
+            pages, cursor = [], None
+            while True:
+                results, cursor = directory.search_users(query, cursor=cursor, limit=1)
+                pages.append(self.usernames(results))
+                if cursor is None:
+                    break
+            self.assertEqual(sum(pages, []), self.usernames(directory.search_users(query)[0]))
+            self.assertTrue(all(len(page) == 1 for page in pages))
+
+    def test_viewer_excluded(self):
+        viewer = User.objects.get(username='alfred')
+        results, next_cursor = directory.search_users('al', limit=2, exclude_id=viewer.id)
+        self.assertEqual(self.usernames(results), ['Albert', 'albertine'])
+        results, next_cursor = directory.search_users('al', cursor=next_cursor, limit=2, exclude_id=viewer.id)
+        self.assertEqual(self.usernames(results), ['alice', 'bob'])
+        self.assertIsNone(next_cursor)
+
+    def test_cache_keys_are_safe_for_any_input(self):
+        long_cursor = directory.encode_cursor('x' * 300, 1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            directory.search_users('a b')
+            directory.search_users('\x01')
+            self.assertEqual(directory.search_users('a', cursor=long_cursor)[0], [])
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create(username='cached', status=User.Status.ACTIVE)
+        self.token = AccessToken.for_user(self.user)
+
+    def authenticate(self):
+        return CachedJWTAuthentication().get_user(self.token)
+
+    def test_deactivation_is_seen_at_once(self):
+        self.assertTrue(self.authenticate().is_active)
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_role_change_is_seen_at_once(self):
+        self.assertEqual(self.authenticate().role, User.Roles.FREE)
+        user = User.objects.get(pk=self.user.pk)
+        user.role = User.Roles.ADMIN
+        user.save(update_fields=['role'])
+        self.assertEqual(self.authenticate().role, User.Roles.ADMIN)
+
+    def test_logins_keep_the_cached_user(self):
+        self.authenticate()
+        key = str(self.user.pk)
+        cached = user_cache.get(key)
+        update_last_login(None, User.objects.get(pk=self.user.pk))
+        # A full save that changes nothing else doesn't evict either
+        user = User.objects.get(pk=self.user.pk)
+        user.save()
+        self.assertIs(user_cache.get(key), cached)
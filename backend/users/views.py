@@ -4,6 +4,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import User
 from .serializers import UserSerializer, RegisterSerializer
 from .auth_serializers import CustomTokenObtainPairSerializer
+from . import directory
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -20,15 +21,25 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
-class UserListView(generics.ListAPIView):
-    """List all users (for starting new chats)"""
-    queryset = User.objects.filter(is_approved=True)
-    serializer_class = UserSerializer
+class UserListView(generics.GenericAPIView):
+    """
+    Search approved users (for starting new chats). ``q`` is a prefix of
+    the username or email; pages of ``limit`` users follow ``cursor``.
+    """
     permission_classes = [permissions.IsAuthenticated]
-    
-    def get_queryset(self):
-        # Exclude the current user from the list
-        return User.objects.filter(is_approved=True).exclude(id=self.request.user.id)
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        try:
+            results, next_cursor = directory.search_users(
+                params.get('q', ''),
+                cursor=params.get('cursor') or None,
+                limit=directory.parse_limit(params.get('limit')),
+                exclude_id=request.user.id,
+            )
+        except directory.InvalidQuery as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': results, 'next': next_cursor})
 
 from rest_framework import viewsets
 from rest_framework.decorators import action
@@ -64,34 +75,19 @@ class AdminUserViewSet(viewsets.ModelViewSet):
         user.save()
         return Response({'status': 'user activated'}, status=status.HTTP_200_OK)
 
-from django.utils import timezone
-from django.db.models import Q
-from chat.models import Message
-from streaming.models import StreamEvent
+from stats.counters import dashboard_stats
 
 class DashboardStatsView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        today = timezone.now().date()
-        
-        # Online Users (Using total approved users for now as proxy)
-        online_users = User.objects.filter(is_approved=True).count()
-
-        # Messages Today
-        messages_today = Message.objects.filter(timestamp__date=today).count()
-
-        # Active Streams
-        now = timezone.now()
-        active_streams = StreamEvent.objects.filter(
-            start_time__lte=now
-        ).filter(
-            Q(end_time__isnull=True) | Q(end_time__gte=now)
-        ).count()
+        # Counters are maintained on write by the stats app; this is one read
+        stats = dashboard_stats()
 
         return Response({
-            'online_users': online_users,
-            'messages_today': messages_today,
-            'active_streams': active_streams,
+            # Users with an open socket, summed over the worker processes
+            'online_users': stats['online_users'],
+            'messages_today': stats['messages_today'],
+            'active_streams': stats['active_streams'],
             'system_health': 'Operational'
         })
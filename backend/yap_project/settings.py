@@ -37,9 +37,11 @@ INSTALLED_APPS = [
     'users',
     'chat',
     'streaming',
+    'stats',
 ]
 
 MIDDLEWARE = [
+    'yap_project.timing.TimingMiddleware', # removes itself unless REQUEST_TIMING
     'corsheaders.middleware.CorsMiddleware', # CORS first
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -126,22 +128,83 @@ AUTH_USER_MODEL = 'users.User'
 # DRF Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
 }
 
+# Users behind JWTs are cached per process for this many seconds (0 turns the
+# cache off). Saving a user evicts it at once in every runworkers process,
+# over the channel layer. With AUTH_USER_CACHE_SHARED, lookups also go through
+# Django's default cache, checked against a per-user version on every hit, for
+# deployments whose processes share a cache but not the channel layer.
+# See users/authentication.py
+AUTH_USER_CACHE_TTL = 30
+AUTH_USER_CACHE_SIZE = 10_000
+AUTH_USER_CACHE_SHARED = False
+
 # JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
 
-# Channel Layers (In-Memory for Development - No Redis needed)
+# Channel Layers (No Redis needed)
+# UnixSocketChannelLayer behaves like the in-memory layer in a single
+# process and relays group traffic between processes started with
+# `manage.py runworkers`.
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        'BACKEND': 'chat.layers.UnixSocketChannelLayer'
     }
 }
 
+# Chat write-behind: buffer inbound messages and persist them with one
+# bulk_create per batch instead of one INSERT per message.
+CHAT_WRITE_BEHIND = False
+CHAT_WRITE_BEHIND_MAX_BATCH = 100  # messages
+CHAT_WRITE_BEHIND_MAX_DELAY = 0.02  # seconds
+
+# Presence: sockets silent for longer than the TTL are dropped (clients
+# heartbeat every 25s); online/offline events are batched per interval.
+# Each worker publishes its online user count for the dashboard.
+CHAT_PRESENCE_TTL = 60  # seconds
+CHAT_PRESENCE_COALESCE = 1.0  # seconds
+CHAT_PRESENCE_PUBLISH_INTERVAL = 5.0  # seconds
+
+# Optional MessagePack subprotocol (needs msgpack installed); events for a
+# binary socket within one window are sent as a single frame.
+CHAT_BINARY_PROTOCOL = True
+CHAT_BINARY_BATCH_WINDOW = 0.01  # seconds
+
+# Events waiting to be written to one socket before a slow client loses
+# typing events, then superseded reaction updates, then its connection
+CHAT_OUTBOUND_QUEUE_LIMIT = 256
+
+# Typing indicators: at most one relayed per user and room per interval
+CHAT_EPHEMERAL_INTERVAL = 2.0  # seconds
+
+# History older than this is moved to compressed blocks by
+# `manage.py archive_messages` (run it from cron)
+CHAT_ARCHIVE_AFTER_DAYS = 365
+
+# Seconds a page of user search results for a short prefix (up to three
+# characters) is cached; see users/directory.py
+USER_SEARCH_CACHE_TTL = 30
+
+# Bearer token for /api/chat/metrics/ (Prometheus); when unset the endpoint
+# refuses every request, unless METRICS_ALLOW_LOCALHOST=1 lets loopback
+# clients in. Behind a reverse proxy on the same host every request comes
+# from 127.0.0.1, so only allow localhost when the server isn't proxied.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_ALLOW_LOCALHOST = os.environ.get('METRICS_ALLOW_LOCALHOST') == '1'
+
+# Opt-in timing: Server-Timing headers on responses, and requests or
+# WebSocket handlers slower than the threshold logged with their slowest SQL
+REQUEST_TIMING = False
+REQUEST_TIMING_SLOW_MS = 500
+REQUEST_TIMING_LOG = BASE_DIR / 'slow_requests.log'
+REQUEST_TIMING_LOG_MAX_BYTES = 10 * 1024 * 1024
+REQUEST_TIMING_LOG_BACKUPS = 5
+
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True # For development only
@@ -0,0 +1,197 @@
+"""
+Opt-in timing breakdown for HTTP requests and WebSocket handlers.
+
+With ``REQUEST_TIMING = True`` every API response carries a ``Server-Timing``
+header (``db``, ``serialize``, ``render`` and ``total``, in milliseconds), and
+any request or ``ChatConsumer`` handler slower than ``REQUEST_TIMING_SLOW_MS``
+is written to a rotating log together with its slowest SQL statements.
+
+Queries are attributed through a context variable rather than the
+connection, so statements run by ``database_sync_to_async`` in a worker
+thread still count towards the handler that awaited them. When timing is
+off the middleware removes itself and nothing is patched.
+"""
+import contextvars
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('yap.slow')
+
+SLOWEST_QUERIES = 5  # statements kept per slow log entry
+MAX_SQL_LENGTH = 1000  # characters of each statement written to the log
+
+_current = contextvars.ContextVar('yap_timing', default=None)
+_installed = False
+
+
+def enabled():
+    return getattr(settings, 'REQUEST_TIMING', False)
+
+
+class Timing:
+    """Everything measured for one request or handler invocation"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = []  # (seconds, sql)
+        self.phases = {}  # phase name -> seconds
+        self._active = set()
+        self.finished = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def sql_time(self):
+        return sum(duration for duration, _ in self.queries)
+
+    @contextmanager
+    def phase(self, name):
+        # Nested timers for the same phase (a serializer inside a
+        # serializer) count once, at the outermost level.
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def server_timing(self, total):
+        parts = [f'db;dur={self.sql_time() * 1000:.1f};desc="{len(self.queries)} queries"']
+        for name in ('serialize', 'render'):
+            if name in self.phases:
+                parts.append(f'{name};dur={self.phases[name] * 1000:.1f}')
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+    def log_if_slow(self, label, total):
+        if total * 1000 < getattr(settings, 'REQUEST_TIMING_SLOW_MS', 500):
+            return
+        phases = ' '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in sorted(self.phases.items()))
+        lines = [
+            f'{label} total={total * 1000:.1f}ms db={self.sql_time() * 1000:.1f}ms '
+            f'queries={len(self.queries)} {phases}'.rstrip()
+        ]
+        for duration, sql in sorted(self.queries, key=lambda q: q[0], reverse=True)[:SLOWEST_QUERIES]:
+            lines.append(f'  {duration * 1000:.1f}ms {sql[:MAX_SQL_LENGTH]}')
+        logger.warning('\n'.join(lines))
+
+
+def _record_sql(execute, sql, params, many, context):
+    timing = _current.get()
+    # Tasks started during a handler (e.g. the write-behind flusher) inherit
+    # its context but outlive it; their queries are not the handler's.
+    if timing is None or timing.finished:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.queries.append((time.perf_counter() - start, sql))
+
+
+def _wrap_connection(connection, **kwargs):
+    if _record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_sql)
+
+
+def _time_property(cls, attr, phase):
+    fget = getattr(cls, attr).fget
+
+    @functools.wraps(fget)
+    def timed_fget(self):
+        timing = _current.get()
+        if timing is None:
+            return fget(self)
+        with timing.phase(phase):
+            return fget(self)
+
+    setattr(cls, attr, property(timed_fget))
+
+
+def install():
+    """Hook SQL execution, DRF serialization and rendering (once per process)"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    connection_created.connect(_wrap_connection)
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
+
+    from rest_framework.response import Response
+    from rest_framework.serializers import BaseSerializer
+    _time_property(BaseSerializer, 'data', 'serialize')
+    _time_property(Response, 'rendered_content', 'render')
+
+    path = getattr(settings, 'REQUEST_TIMING_LOG', None)
+    if path and not logger.handlers:
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=getattr(settings, 'REQUEST_TIMING_LOG_MAX_BYTES', 10 * 1024 * 1024),
+            backupCount=getattr(settings, 'REQUEST_TIMING_LOG_BACKUPS', 5),
+        )
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+
+def timed(phase):
+    """Count calls of the decorated function towards ``phase``"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timing = _current.get()
+            if timing is None:
+                return func(*args, **kwargs)
+            with timing.phase(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track(label):
+    """Time the enclosed block as one unit, logging it if it is slow"""
+    install()
+    timing = Timing()
+    token = _current.set(timing)
+    try:
+        yield timing
+    finally:
+        _current.reset(token)
+        timing.finished = True
+        timing.log_if_slow(label, timing.elapsed())
+
+
+class TimingMiddleware:
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = Timing()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            timing.finished = True
+        total = timing.elapsed()
+        response['Server-Timing'] = timing.server_timing(total)
+        timing.log_if_slow(f'{request.method} {request.get_full_path()} {response.status_code}', total)
+        return response
@@ -19,7 +19,7 @@ interface ManageMembersModalProps {
 export default function ManageMembersModal({ isOpen, onClose, roomId, roomName }: ManageMembersModalProps) {
     const [members, setMembers] = useState<User[]>([]);
     const [allUsers, setAllUsers] = useState<User[]>([]);
-    const [selectedUserId, setSelectedUserId] = useState('');
+    const [selectedUserIds, setSelectedUserIds] = useState<string[]>([]);
     const [loading, setLoading] = useState(false);
 
     useEffect(() => {
@@ -47,19 +47,20 @@ export default function ManageMembersModal({ isOpen, onClose, roomId, roomName }
         }
     };
 
-    const addMember = async () => {
-        if (!selectedUserId) return;
+    const addMembers = async () => {
+        if (selectedUserIds.length === 0) return;
 
         setLoading(true);
         try {
-            await api.post(`/chat/admin/rooms/${roomId}/add_member/`, {
-                user_id: selectedUserId
+            // One request however many users are selected
+            await api.post(`/chat/admin/rooms/${roomId}/members/bulk/`, {
+                add: selectedUserIds.map(Number)
             });
             await fetchMembers();
-            setSelectedUserId('');
+            setSelectedUserIds([]);
         } catch (error) {
-            console.error('Error adding member:', error);
-            alert('Failed to add member');
+            console.error('Error adding members:', error);
+            alert('Failed to add members');
         } finally {
             setLoading(false);
         }
@@ -70,8 +71,8 @@ export default function ManageMembersModal({ isOpen, onClose, roomId, roomName }
 
         setLoading(true);
         try {
-            await api.post(`/chat/admin/rooms/${roomId}/remove_member/`, {
-                user_id: userId
+            await api.post(`/chat/admin/rooms/${roomId}/members/bulk/`, {
+                remove: [userId]
             });
             await fetchMembers();
         } catch (error) {
@@ -87,19 +88,19 @@ export default function ManageMembersModal({ isOpen, onClose, roomId, roomName }
     return (
         <Modal isOpen={isOpen} onClose={onClose} title={`Manage Members - ${roomName}`}>
             <div className="space-y-4">
-                {/* Add Member */}
+                {/* Add Members */}
                 <div>
                     <label className="block text-sm font-medium text-gray-700 dark:text-gray-300 mb-2">
-                        Add Member
+                        Add Members
                     </label>
                     <div className="flex gap-2">
                         <select
-                            value={selectedUserId}
-                            onChange={(e) => setSelectedUserId(e.target.value)}
-                            className="flex-1 px-3 py-2 border border-gray-300 dark:border-gray-600 rounded-lg bg-white dark:bg-gray-700 text-gray-900 dark:text-white"
+                            multiple
+                            value={selectedUserIds}
+                            onChange={(e) => setSelectedUserIds(Array.from(e.target.selectedOptions, (option) => option.value))}
+                            className="flex-1 h-32 px-3 py-2 border border-gray-300 dark:border-gray-600 rounded-lg bg-white dark:bg-gray-700 text-gray-900 dark:text-white"
                             disabled={loading}
                         >
-                            <option value="">Select a user...</option>
                             {availableUsers.map((user) => (
                                 <option key={user.id} value={user.id}>
                                     {user.username} ({user.email})
@@ -107,12 +108,12 @@ export default function ManageMembersModal({ isOpen, onClose, roomId, roomName }
                             ))}
                         </select>
                         <button
-                            onClick={addMember}
-                            disabled={!selectedUserId || loading}
-                            className="px-4 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 disabled:opacity-50 disabled:cursor-not-allowed flex items-center gap-2"
+                            onClick={addMembers}
+                            disabled={selectedUserIds.length === 0 || loading}
+                            className="self-start px-4 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 disabled:opacity-50 disabled:cursor-not-allowed flex items-center gap-2"
                         >
                             <UserPlus size={16} />
-                            Add
+                            Add{selectedUserIds.length > 1 ? ` (${selectedUserIds.length})` : ''}
                         </button>
                     </div>
                 </div>
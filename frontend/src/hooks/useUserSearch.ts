@@ -0,0 +1,54 @@
+import { useState, useEffect, useRef, useCallback } from 'react';
+import api from '../lib/api';
+
+export interface DirectoryUser {
+    id: number;
+    username: string;
+    email: string;
+    role: string;
+}
+
+export interface UserSearchState {
+    users: DirectoryUser[];
+    hasMore: boolean;
+    loading: boolean;
+    loadMore: () => void;
+}
+
+/**
+ * Prefix search over the user directory (GET /users/?q=), one page at a time.
+ * Typing is debounced, and responses for an outdated query are dropped.
+ */
+export function useUserSearch(query: string, enabled = true, delay = 250): UserSearchState {
+    const [users, setUsers] = useState<DirectoryUser[]>([]);
+    const [next, setNext] = useState<string | null>(null);
+    const [loading, setLoading] = useState(false);
+    const requestRef = useRef(0);
+
+    const fetchPage = useCallback(async (q: string, cursor: string | null) => {
+        const request = ++requestRef.current;
+        setLoading(true);
+        try {
+            const res = await api.get('/users/', { params: { q, cursor: cursor ?? undefined } });
+            if (request !== requestRef.current) return;
+            setUsers(prev => (cursor ? [...prev, ...res.data.results] : res.data.results));
+            setNext(res.data.next);
+        } catch (error) {
+            console.error('Error searching users:', error);
+        } finally {
+            if (request === requestRef.current) setLoading(false);
+        }
+    }, []);
+
+    useEffect(() => {
+        if (!enabled) return;
+        const timeoutId = setTimeout(() => fetchPage(query.trim(), null), delay);
+        return () => clearTimeout(timeoutId);
+    }, [query, enabled, delay, fetchPage]);
+
+    const loadMore = useCallback(() => {
+        if (next && !loading) fetchPage(query.trim(), next);
+    }, [next, loading, query, fetchPage]);
+
+    return { users, hasMore: next !== null, loading, loadMore };
+}
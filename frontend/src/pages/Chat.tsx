@@ -1,6 +1,7 @@
 import { useState, useEffect, useRef, useMemo } from 'react';
 import { useParams, Link, useNavigate } from 'react-router-dom';
 import { useAuthStore } from '../store/authStore';
+import { useUserSearch } from '../hooks/useUserSearch';
 import api from '../lib/api';
 import ChatLayout from '../components/chat/ChatLayout';
 import Message from '../components/chat/Message';
@@ -48,28 +49,29 @@ interface ChatRoom {
     unread_count?: number;
 }
 
-interface User {
-    id: number;
-    username: string;
-    email: string;
-    role: string;
-}
-
 export default function Chat() {
     const { roomId } = useParams();
     const navigate = useNavigate();
     const { user } = useAuthStore();
     const [rooms, setRooms] = useState<ChatRoom[]>([]);
     const [filteredRooms, setFilteredRooms] = useState<ChatRoom[]>([]);
-    const [users, setUsers] = useState<User[]>([]);
     const [messages, setMessages] = useState<MessageType[]>([]);
+    const [olderCursor, setOlderCursor] = useState<string | null>(null);
+    const [isLoadingOlder, setIsLoadingOlder] = useState(false);
     const [newMessage, setNewMessage] = useState('');
     const [ws, setWs] = useState<WebSocket | null>(null);
     const [showUserList, setShowUserList] = useState(false);
     const [searchQuery, setSearchQuery] = useState('');
+    // The sidebar search also searches people while the new-chat list is open
+    const userSearch = useUserSearch(searchQuery, showUserList);
     const [showInfoPanel, setShowInfoPanel] = useState(false);
     const [isLoading, setIsLoading] = useState(false);
     const [isTyping, setIsTyping] = useState(false);
+    const [onlineUserIds, setOnlineUserIds] = useState<Set<number>>(new Set());
+    const typingTimeoutRef = useRef<ReturnType<typeof setTimeout> | null>(null);
+    const lastTypingSentRef = useRef(0);
+    // Bumped to reconnect and reload when the server asks for a resync
+    const [connectionKey, setConnectionKey] = useState(0);
     const [sidebarOpen, setSidebarOpen] = useState(true);
     const messagesEndRef = useRef<HTMLDivElement>(null);
     const [isMobileView, setIsMobileView] = useState(window.innerWidth < 768);
@@ -91,10 +93,9 @@ export default function Chat() {
         }
     }, [roomId, isMobileView]);
 
-    // Fetch rooms and users
+    // Fetch rooms
     useEffect(() => {
         fetchRooms();
-        api.get('/users/').then((res) => setUsers(res.data)).catch(console.error);
     }, []);
 
     // Filter rooms by search
@@ -123,7 +124,8 @@ export default function Chat() {
         setIsLoading(true);
         api.get(`/chat/rooms/${roomId}/messages/`)
             .then((res) => {
-                setMessages(res.data);
+                setMessages(res.data.results);
+                setOlderCursor(res.data.before);
                 setIsLoading(false);
             })
             .catch((err) => {
@@ -131,46 +133,121 @@ export default function Chat() {
                 setIsLoading(false);
             });
 
-        const websocket = new WebSocket(`ws://localhost:8000/ws/chat/${roomId}/`);
+        // Authenticate with the JWT access token via the subprotocol list
+        const token = localStorage.getItem('access_token') || '';
+        const websocket = new WebSocket(`ws://localhost:8000/ws/chat/${roomId}/`, ['jwt', token]);
 
         websocket.onmessage = (event) => {
             const data = JSON.parse(event.data);
 
-            if (data.type === 'chat_message' || data.message) {
-                setMessages((prev) => [...prev, {
-                    id: Date.now(),
-                    content: data.message,
-                    sender: { id: data.user_id, username: data.username || 'User' },
-                    timestamp: new Date().toISOString(),
-                    is_read: false,
-                }]);
-                fetchRooms();
+            // Server events (v1) are patches to apply to local state
+            if (data.type === 'message.created') {
+                const incoming: MessageType = data.message;
+                setMessages((prev) => prev.some(m => m.id === incoming.id) ? prev : [...prev, incoming]);
+                setRooms((prev) => prev.map(room => room.id === data.room ? {
+                    ...room,
+                    last_message: incoming.content,
+                    last_message_time: incoming.timestamp,
+                } : room));
             }
 
-            if (data.type === 'reaction_update' && data.message_id) {
-                api.get(`/chat/rooms/${roomId}/messages/`)
-                    .then((res) => setMessages(res.data))
-                    .catch(console.error);
+            if (data.type === 'reaction.changed') {
+                setMessages(prev => prev.map(msg => msg.id !== data.message_id ? msg : {
+                    ...msg,
+                    reactions: data.reactions.map((r: Omit<ReactionGroup, 'user_reacted'>) => ({
+                        ...r,
+                        user_reacted: r.users.some(u => u.id === user?.id),
+                    })),
+                }));
             }
 
-            if (data.type === 'messages_read') {
+            if (data.type === 'read.updated') {
                 if (data.user_id !== user?.id) {
                     setMessages(prev => prev.map(msg =>
-                        msg.sender.id === user?.id ? { ...msg, is_read: true } : msg
+                        msg.sender.id === user?.id && msg.id <= data.last_read_message_id ? { ...msg, is_read: true } : msg
                     ));
                 }
             }
 
-            // Simulated typing indicator (extend backend for real implementation)
-            if (data.type === 'typing') {
+            if (data.type === 'unread.updated') {
+                setRooms((prev) => prev.map(room => room.id === data.room ? {
+                    ...room,
+                    unread_count: data.unread_count,
+                } : room));
+            }
+
+            // Sent once per room to every member; our own messages don't count
+            if (data.type === 'unread.bumped') {
+                const own = data.senders.find(([id]: [number, number]) => id === user?.id);
+                const added = data.count - (own ? own[1] : 0);
+                if (added > 0) {
+                    setRooms((prev) => prev.map(room => room.id === data.room ? {
+                        ...room,
+                        unread_count: (room.unread_count || 0) + added,
+                    } : room));
+                }
+            }
+
+            if (data.type === 'presence.state') {
+                setOnlineUserIds(new Set(data.online));
+            }
+
+            if (data.type === 'presence.changed') {
+                setOnlineUserIds(prev => {
+                    const next = new Set(prev);
+                    data.online.forEach((id: number) => next.add(id));
+                    data.offline.forEach((id: number) => next.delete(id));
+                    return next;
+                });
+            }
+
+            // Ephemeral: the server relays at most one per typist every 2s
+            if (data.type === 'typing' && data.user_id !== user?.id) {
                 setIsTyping(true);
-                setTimeout(() => setIsTyping(false), 3000);
+                if (typingTimeoutRef.current) clearTimeout(typingTimeoutRef.current);
+                typingTimeoutRef.current = setTimeout(() => setIsTyping(false), 3000);
+            }
+        };
+
+        // Keep presence alive; the server expires sockets that go quiet
+        const heartbeat = setInterval(() => {
+            if (websocket.readyState === WebSocket.OPEN) {
+                websocket.send(JSON.stringify({ type: 'heartbeat' }));
+            }
+        }, 25000);
+
+        websocket.onclose = (event) => {
+            // We fell too far behind; the server dropped us and events were lost
+            if (event.code === 4429) {
+                setConnectionKey(key => key + 1);
+            }
+            // We were removed from the room
+            if (event.code === 4403) {
+                fetchRooms();
             }
         };
 
         setWs(websocket);
-        return () => websocket.close();
-    }, [roomId]);
+        return () => {
+            clearInterval(heartbeat);
+            setOnlineUserIds(new Set());
+            websocket.onclose = null;
+            websocket.close();
+        };
+    }, [roomId, connectionKey]);
+
+    // Page back through older history
+    const loadOlderMessages = () => {
+        if (!roomId || !olderCursor || isLoadingOlder) return;
+        setIsLoadingOlder(true);
+        api.get(`/chat/rooms/${roomId}/messages/`, { params: { before: olderCursor } })
+            .then((res) => {
+                setMessages(prev => [...res.data.results, ...prev]);
+                setOlderCursor(res.data.before);
+            })
+            .catch(console.error)
+            .finally(() => setIsLoadingOlder(false));
+    };
 
     // Auto-scroll to bottom
     useEffect(() => {
@@ -180,12 +257,21 @@ export default function Chat() {
     const sendMessage = () => {
         if (!newMessage.trim() || !ws || !user) return;
         ws.send(JSON.stringify({
-            message: newMessage,
-            user_id: user.id
+            message: newMessage
         }));
         setNewMessage('');
     };
 
+    const handleInputChange = (value: string) => {
+        setNewMessage(value);
+        // Tell the room we're typing, no more often than the server relays it
+        const now = Date.now();
+        if (value && ws?.readyState === WebSocket.OPEN && now - lastTypingSentRef.current > 2000) {
+            lastTypingSentRef.current = now;
+            ws.send(JSON.stringify({ type: 'typing' }));
+        }
+    };
+
     const handleReaction = async (messageId: number, emoji: string, isAdding: boolean) => {
         try {
             // Optimistic update
@@ -336,7 +422,7 @@ export default function Chat() {
                     </div>
                     <input
                         type="text"
-                        placeholder="Search chats..."
+                        placeholder={showUserList ? "Search people..." : "Search chats..."}
                         className="w-full bg-transparent text-sm text-[#e9edef] placeholder-[#8696a0] focus:outline-none pr-3"
                         value={searchQuery}
                         onChange={(e) => setSearchQuery(e.target.value)}
@@ -348,7 +434,7 @@ export default function Chat() {
             {showUserList && (
                 <div className="bg-[var(--obsidian-base)] border-b border-white/5 max-h-60 overflow-y-auto momentum-scroll">
                     <div className="p-3 text-[var(--cosmic-purple)] text-xs font-bold uppercase tracking-wide">Start a New Chat</div>
-                    {users.map((u) => (
+                    {userSearch.users.map((u) => (
                         <button
                             key={u.id}
                             onClick={() => startChatWithUser(u.id)}
@@ -363,6 +449,15 @@ export default function Chat() {
                             </div>
                         </button>
                     ))}
+                    {userSearch.hasMore && (
+                        <button
+                            onClick={userSearch.loadMore}
+                            disabled={userSearch.loading}
+                            className="w-full p-2 text-xs text-[var(--cosmic-purple)] hover:bg-[var(--cosmic-purple)]/10 disabled:opacity-50"
+                        >
+                            {userSearch.loading ? 'Loading…' : 'Load more'}
+                        </button>
+                    )}
                     {user?.role === 'ADMIN' && (
                         <Link to="/chat/create-group" className="w-full flex items-center gap-3 p-3 hover:bg-[var(--cosmic-purple)]/10 transition-all spring-scale">
                             <div className="w-10 h-10 rounded-full holographic-gradient flex items-center justify-center text-white shadow-lg">
@@ -438,7 +533,9 @@ export default function Chat() {
                     </div>
                     <div className="flex flex-col">
                         <h2 className="text-[#e9edef] font-bold text-base sm:text-lg">{currentRoom?.display_name || currentRoom?.name}</h2>
-                        <p className="text-xs text-[var(--cosmic-purple)]">Click for info</p>
+                        <p className="text-xs text-[var(--cosmic-purple)]">
+                            {onlineUserIds.size > 0 ? `${onlineUserIds.size} online` : 'Click for info'}
+                        </p>
                     </div>
                 </div>
                 <div className="flex items-center gap-3 text-[#8696a0]">
@@ -461,6 +558,17 @@ export default function Chat() {
                     <SkeletonLoader />
                 ) : (
                     <>
+                        {olderCursor && (
+                            <div className="flex justify-center mb-4">
+                                <button
+                                    onClick={loadOlderMessages}
+                                    disabled={isLoadingOlder}
+                                    className="text-xs text-[var(--cosmic-purple)] px-3 py-1 rounded-full hover:bg-[var(--cosmic-purple)]/10 transition-colors"
+                                >
+                                    {isLoadingOlder ? 'Loading...' : 'Load earlier messages'}
+                                </button>
+                            </div>
+                        )}
                         {groupedMessages.map((item) => {
                             if ('type' in item && item.type === 'separator') {
                                 return <DateSeparator key={item.id} date={item.date} />;
@@ -506,7 +614,7 @@ export default function Chat() {
             <div className="px-6 pb-6 shrink-0">
                 <MessageInput
                     value={newMessage}
-                    onChange={setNewMessage}
+                    onChange={handleInputChange}
                     onSend={sendMessage}
                 />
             </div>
@@ -1,18 +1,14 @@
-import { useState, useEffect } from 'react';
+import { useState } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { useAuthStore } from '../store/authStore';
 import api from '../lib/api';
-
-interface User {
-    id: number;
-    username: string;
-    email: string;
-}
+import { useUserSearch } from '../hooks/useUserSearch';
 
 export default function CreateGroup() {
     const { user } = useAuthStore();
     const navigate = useNavigate();
-    const [users, setUsers] = useState<User[]>([]);
+    const [memberQuery, setMemberQuery] = useState('');
+    const { users, hasMore, loading, loadMore } = useUserSearch(memberQuery);
     const [formData, setFormData] = useState({
         name: '',
         is_paid: false,
@@ -20,10 +16,6 @@ export default function CreateGroup() {
     });
     const [selectedMembers, setSelectedMembers] = useState<number[]>([]);
 
-    useEffect(() => {
-        api.get('/users/').then((res) => setUsers(res.data)).catch(console.error);
-    }, []);
-
     const handleSubmit = async (e: React.FormEvent) => {
         e.preventDefault();
         try {
@@ -77,6 +69,7 @@ export default function CreateGroup() {
 
                     <div>
                         <label className="block text-sm font-medium text-gray-700 dark:text-gray-300 mb-2">Add Members</label>
+                        <input type="search" value={memberQuery} onChange={(e) => setMemberQuery(e.target.value)} className="w-full mb-2 px-4 py-2 border border-gray-300 dark:border-gray-600 rounded-lg dark:bg-gray-700 dark:text-white" placeholder="Search by username or email" />
                         <div className="max-h-64 overflow-y-auto space-y-2 border border-gray-300 dark:border-gray-600 rounded-lg p-4">
                             {users.map((u) => (
                                 <label key={u.id} className="flex items-center gap-3 p-2 hover:bg-gray-50 dark:hover:bg-gray-700 rounded cursor-pointer">
@@ -87,6 +80,11 @@ export default function CreateGroup() {
                                     </div>
                                 </label>
                             ))}
+                            {hasMore && (
+                                <button type="button" onClick={loadMore} disabled={loading} className="w-full p-2 text-sm text-blue-600 dark:text-blue-400 hover:underline disabled:opacity-50">
+                                    {loading ? 'Loading…' : 'Load more'}
+                                </button>
+                            )}
                         </div>
                         <p className="text-xs text-gray-500 dark:text-gray-400 mt-2">{selectedMembers.length} member(s) selected</p>
                     </div>